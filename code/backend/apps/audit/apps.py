@@ -7,3 +7,8 @@ class AuditConfig(AppConfig):
 
     def ready(self):
         from . import signals
+        from .registry import audit_registry
+
+        # 所有模型加载完成后再注册审计模型并连接信号
+        audit_registry.load_from_config()
+        signals.connect_audit_receivers()
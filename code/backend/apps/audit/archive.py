@@ -0,0 +1,239 @@
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from backend.settings import BASE_DIR
+from lib.log import color_logger
+from lib.paginator_tool import COUNT_MODE_EXACT, COUNT_MODE_ESTIMATE, iter_keyset_batches
+from lib.time_tools import utc_obj_to_time_zone_str
+from .models import AuditLog
+from .partition import (
+    add_months, drop_partition, ensure_future_partitions, get_current_month_start, get_month_start,
+    get_monthly_partitions, is_partitioned,
+)
+from .sink import get_audit_config
+
+# 归档文件中每行记录的字段
+ARCHIVE_FIELDS = (
+    'uuid', 'operator_username', 'model_name', 'record_id', 'action', 'detail', 'ip_address', 'is_del', 'create_time'
+)
+ARCHIVE_FILE_PATTERN = re.compile(r'^audit_log_(\d{4})(\d{2})\.jsonl\.gz$')
+# 归档索引文件：{月份(YYYYMM): 记录数量}，用于估算归档记录总数
+ARCHIVE_INDEX_FILE = 'audit_log_index.json'
+
+ACTION_DISPLAY = dict(AuditLog.ACTION_CHOICES)
+
+
+def get_archive_dir():
+    """归档目录，相对路径基于项目目录"""
+    archive_dir = get_audit_config().get('ARCHIVE_DIR', 'archive/audit_log')
+    return archive_dir if os.path.isabs(archive_dir) else os.path.join(BASE_DIR, archive_dir)
+
+
+def get_archive_path(month_start):
+    return os.path.join(get_archive_dir(), f"audit_log_{month_start:%Y%m}.jsonl.gz")
+
+
+def list_archived_months():
+    """已归档的月份（升序）"""
+    archive_dir = get_archive_dir()
+    if not os.path.isdir(archive_dir):
+        return []
+
+    months = []
+    for file_name in os.listdir(archive_dir):
+        match = ARCHIVE_FILE_PATTERN.match(file_name)
+        if match:
+            months.append(datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=dt_timezone.utc))
+    return sorted(months)
+
+
+def load_archive_counts():
+    """读取归档索引 {月份(YYYYMM): 记录数量}"""
+    try:
+        with open(os.path.join(get_archive_dir(), ARCHIVE_INDEX_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_archive_count(month_start, count):
+    """更新归档索引中月份的记录数量"""
+    index_path = os.path.join(get_archive_dir(), ARCHIVE_INDEX_FILE)
+    counts = load_archive_counts()
+    counts[f"{month_start:%Y%m}"] = count
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(counts, f)
+    os.replace(tmp_path, index_path)
+
+
+def get_live_window_start():
+    """数据库中保留数据的起始时间（最新归档月份的下个月），没有归档时返回 None"""
+    months = list_archived_months()
+    return add_months(months[-1], 1) if months else None
+
+
+def export_audit_logs(month_start, query):
+    """将查询结果按 create_time, uuid 倒序（与审计日志列表的顺序一致）导出为 gzip 压缩的 NDJSON 文件
+
+    读取归档时按文件中的顺序流式输出，不需要再排序；先写入临时文件再重命名，导出中断不会留下不完整的归档文件
+
+    Returns:
+        导出的记录数量
+    """
+    archive_path = get_archive_path(month_start)
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+    tmp_path = f"{archive_path}.tmp"
+
+    count = 0
+    chunk_size = get_audit_config().get('ARCHIVE_CHUNK_SIZE', 2000)
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        batches = iter_keyset_batches(query.values(*ARCHIVE_FIELDS), batch_size=chunk_size, ordering=('-create_time', '-uuid'))
+        for batch in batches:
+            for row in batch:
+                row = {**row, 'uuid': str(row['uuid']), 'create_time': row['create_time'].isoformat()}
+                f.write(json.dumps(row, ensure_ascii=False, default=str))
+                f.write('\n')
+            count += len(batch)
+
+    os.replace(tmp_path, archive_path)
+    save_archive_count(month_start, count)
+    return count
+
+
+def archive_expired_audit_logs():
+    """归档并删除超过 ARCHIVE_AFTER_MONTHS 个月的审计日志
+
+    - MySQL 分区表：逐个导出过期的月分区后删除分区，并提前创建未来的分区
+    - 未分区（如其他数据库）：按月导出后删除对应记录
+
+    Returns:
+        {月份(YYYYMM): 归档的记录数量}
+    """
+    audit_config = get_audit_config()
+    cutoff = add_months(get_current_month_start(), -audit_config.get('ARCHIVE_AFTER_MONTHS', 6))
+    archived = {}
+
+    if is_partitioned():
+        ensure_future_partitions(audit_config.get('PARTITION_MONTHS_AHEAD', 2))
+        for partition_name, month_start in get_monthly_partitions():
+            next_month = add_months(month_start, 1)
+            if next_month > cutoff:
+                break
+            # 更早的分区已删除，小于分区上界的记录都在该分区中
+            query = AuditLog.all_objects.filter(create_time__lt=next_month)
+            archived[f"{month_start:%Y%m}"] = export_audit_logs(month_start, query)
+            drop_partition(partition_name)
+    else:
+        oldest = AuditLog.all_objects.order_by('create_time').values_list('create_time', flat=True).first()
+        month_start = get_month_start(oldest) if oldest else cutoff
+        while month_start < cutoff:
+            next_month = add_months(month_start, 1)
+            query = AuditLog.all_objects.filter(create_time__gte=month_start, create_time__lt=next_month)
+            if query.exists():
+                archived[f"{month_start:%Y%m}"] = export_audit_logs(month_start, query)
+                query.delete()
+            month_start = next_month
+
+    if archived:
+        color_logger.info(f"审计日志归档完成: {archived}")
+    return archived
+
+
+def read_archive_file(month_start):
+    """逐行读取归档文件，create_time 解析为带时区的 datetime"""
+    with gzip.open(get_archive_path(month_start), 'rt', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            row['create_time'] = datetime.fromisoformat(row['create_time'])
+            yield row
+
+
+def iter_archived_audit_logs(audit_log_filter):
+    """按 create_time 倒序流式遍历归档中满足条件的记录
+
+    归档文件按月份倒序读取，文件内的记录导出时已按 create_time, uuid 倒序排列，不在内存中缓存或排序
+    """
+    start_time, end_time = audit_log_filter.start_time, audit_log_filter.end_time
+    for month_start in reversed(list_archived_months()):
+        # 文件中的记录都早于下个月1日
+        if start_time and start_time >= add_months(month_start, 1):
+            break
+        if end_time and end_time < month_start:
+            continue
+
+        for row in read_archive_file(month_start):
+            # 之后的记录都更早，不会再满足开始时间
+            if start_time and row['create_time'] < start_time:
+                return
+            if audit_log_filter.match(row):
+                yield row
+
+
+def page_archived_audit_logs(audit_log_filter, offset, limit):
+    """对归档中满足条件的记录分页，读取到 offset + limit 之后的一条记录即停止
+
+    Returns:
+        (是否还有更多记录, offset 开始的 limit 条记录)
+    """
+    rows = []
+    for index, row in enumerate(iter_archived_audit_logs(audit_log_filter)):
+        if index >= offset + limit:
+            return True, rows
+        if index >= offset:
+            rows.append(row)
+    return False, rows
+
+
+def estimate_archived_count(audit_log_filter):
+    """按归档索引估算满足条件的记录数量（筛选时间范围内月份的记录总数，不读取归档文件）
+
+    索引中没有的月份（索引生成前导出的文件）统计一次文件行数并写入索引
+    """
+    start_time, end_time = audit_log_filter.start_time, audit_log_filter.end_time
+    counts = load_archive_counts()
+    total = 0
+    for month_start in list_archived_months():
+        if start_time and start_time >= add_months(month_start, 1):
+            continue
+        if end_time and end_time < month_start:
+            continue
+        month_count = counts.get(f"{month_start:%Y%m}")
+        if month_count is None:
+            month_count = sum(1 for _ in read_archive_file(month_start))
+            save_archive_count(month_start, month_count)
+        total += month_count
+    return total
+
+
+def count_archived_audit_logs(audit_log_filter, count_mode):
+    """按 count_mode 统计归档中满足条件的记录数量，none 时返回 None
+
+    exact 需要读取范围内的全部归档文件，estimate 只读取归档索引
+    """
+    if count_mode == COUNT_MODE_EXACT:
+        return sum(1 for _ in iter_archived_audit_logs(audit_log_filter))
+    if count_mode == COUNT_MODE_ESTIMATE:
+        return estimate_archived_count(audit_log_filter)
+    return None
+
+
+def format_archived_audit_log(row):
+    """归档记录格式化为与审计日志列表接口一致的结构"""
+    return {
+        'uuid': row['uuid'],
+        'operator_username': row.get('operator_username'),
+        'model_name': row.get('model_name'),
+        'record_id': row.get('record_id'),
+        'action': row.get('action'),
+        'action_display': ACTION_DISPLAY.get(row.get('action'), row.get('action')),
+        'detail': row.get('detail'),
+        'ip_address': row.get('ip_address'),
+        'create_time': utc_obj_to_time_zone_str(row['create_time']),
+        'archived': True,
+    }
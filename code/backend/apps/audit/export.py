@@ -0,0 +1,148 @@
+import csv
+import json
+import os
+import tempfile
+
+import pytz
+from openpyxl import Workbook
+
+from lib.json_tools import DateTimeEncoder
+from lib.paginator_tool import iter_keyset_batches
+from .archive import iter_archived_audit_logs
+from .models import AuditLog
+from .sink import get_audit_config
+
+# 导出的字段和表头
+EXPORT_FIELDS = (
+    ('uuid', 'UUID'),
+    ('operator_username', '操作人'),
+    ('model_name', '模型名称'),
+    ('record_id', '记录ID'),
+    ('action', '操作类型'),
+    ('detail', '操作详情'),
+    ('ip_address', 'IP地址'),
+    ('create_time', '创建时间'),
+)
+EXPORT_FIELD_NAMES = tuple(name for name, _ in EXPORT_FIELDS)
+
+EXPORT_FORMAT_CSV = 'csv'
+EXPORT_FORMAT_NDJSON = 'ndjson'
+EXPORT_FORMAT_XLSX = 'xlsx'
+
+EXPORT_CONTENT_TYPES = {
+    EXPORT_FORMAT_CSV: 'text/csv; charset=utf-8',
+    EXPORT_FORMAT_NDJSON: 'application/x-ndjson; charset=utf-8',
+    EXPORT_FORMAT_XLSX: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+ACTION_DISPLAY = dict(AuditLog.ACTION_CHOICES)
+
+# 读取 XLSX 临时文件时每次返回的字节数
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+class _EchoBuffer:
+    """csv.writer 的写入目标，直接返回写入的内容"""
+
+    def write(self, value):
+        return value
+
+
+def iter_export_rows(query, audit_log_filter=None):
+    """按 create_time 倒序分批读取数据库记录，需要时接着读取归档记录
+
+    Args:
+        query: 已应用筛选条件的查询集
+        audit_log_filter: 需要同时导出归档记录时传入筛选条件
+    """
+    batch_size = get_audit_config().get('EXPORT_CHUNK_SIZE', 2000)
+    for batch in iter_keyset_batches(query.values(*EXPORT_FIELD_NAMES), batch_size=batch_size):
+        yield from batch
+
+    if audit_log_filter is not None:
+        yield from iter_archived_audit_logs(audit_log_filter)
+
+
+class AuditLogExporter:
+    """审计日志导出，以固定内存逐行生成 CSV / NDJSON / XLSX 内容
+
+    Args:
+        export_format: csv / ndjson / xlsx
+        time_zone: 时间转换到的时区
+    """
+
+    def __init__(self, export_format, time_zone='Asia/Shanghai'):
+        if export_format not in EXPORT_CONTENT_TYPES:
+            raise ValueError(f"不支持的导出格式: {export_format}")
+        self.export_format = export_format
+        # 时区对象只创建一次，避免逐行转换时重复查找
+        self.tz = pytz.timezone(time_zone)
+
+    @property
+    def content_type(self):
+        return EXPORT_CONTENT_TYPES[self.export_format]
+
+    @property
+    def file_extension(self):
+        return 'jsonl' if self.export_format == EXPORT_FORMAT_NDJSON else self.export_format
+
+    def format_row(self, row):
+        """返回与 EXPORT_FIELDS 顺序一致的字段值列表"""
+        create_time = row.get('create_time')
+        return [
+            str(row['uuid']),
+            row.get('operator_username'),
+            row.get('model_name'),
+            row.get('record_id'),
+            ACTION_DISPLAY.get(row.get('action'), row.get('action')),
+            json.dumps(row.get('detail'), ensure_ascii=False, cls=DateTimeEncoder),
+            row.get('ip_address'),
+            create_time.astimezone(self.tz).strftime('%Y-%m-%d %H:%M:%S') if create_time else None,
+        ]
+
+    def stream(self, rows):
+        """逐块生成导出内容"""
+        if self.export_format == EXPORT_FORMAT_CSV:
+            return self._stream_csv(rows)
+        if self.export_format == EXPORT_FORMAT_NDJSON:
+            return self._stream_ndjson(rows)
+        return self._stream_xlsx(rows)
+
+    def _stream_csv(self, rows):
+        writer = csv.writer(_EchoBuffer())
+        # BOM 让 Excel 以 UTF-8 打开
+        yield '\ufeff' + writer.writerow([title for _, title in EXPORT_FIELDS])
+        for row in rows:
+            yield writer.writerow(self.format_row(row))
+
+    def _stream_ndjson(self, rows):
+        for row in rows:
+            data = {
+                'uuid': str(row['uuid']),
+                'operator_username': row.get('operator_username'),
+                'model_name': row.get('model_name'),
+                'record_id': row.get('record_id'),
+                'action': row.get('action'),
+                'detail': row.get('detail'),
+                'ip_address': row.get('ip_address'),
+                'create_time': row['create_time'].isoformat() if row.get('create_time') else None,
+            }
+            yield json.dumps(data, ensure_ascii=False, cls=DateTimeEncoder) + '\n'
+
+    def _stream_xlsx(self, rows):
+        """XLSX 无法边写边输出：以只写模式写入临时文件（内存占用固定），再分块读取输出"""
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet(title='audit_log')
+        worksheet.append([title for _, title in EXPORT_FIELDS])
+        for row in rows:
+            worksheet.append(self.format_row(row))
+
+        fd, tmp_path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            workbook.save(tmp_path)
+            with open(tmp_path, 'rb') as f:
+                while chunk := f.read(FILE_CHUNK_SIZE):
+                    yield chunk
+        finally:
+            os.remove(tmp_path)
@@ -0,0 +1,149 @@
+from datetime import datetime, time
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import get_network_packed_range, pack_ip
+
+# 文本筛选的匹配方式
+# - contains: 包含（默认，兼容原有行为，无法使用索引）
+# - prefix: 前缀匹配，可以使用索引
+# - exact: 精确匹配，可以使用索引
+MATCH_MODE_CONTAINS = 'contains'
+MATCH_MODE_PREFIX = 'prefix'
+MATCH_MODE_EXACT = 'exact'
+MATCH_MODES = (MATCH_MODE_CONTAINS, MATCH_MODE_PREFIX, MATCH_MODE_EXACT)
+
+# 匹配方式对应的查询 lookup，都不区分大小写（与归档记录的 _text_match 一致）
+# MySQL 上 startswith 会编译为区分大小写的 LIKE BINARY，istartswith 为普通 LIKE，同样可以使用索引
+MATCH_MODE_LOOKUPS = {
+    MATCH_MODE_CONTAINS: 'icontains',
+    MATCH_MODE_PREFIX: 'istartswith',
+    MATCH_MODE_EXACT: 'exact',
+}
+
+
+def parse_filter_datetime(value):
+    """解析时间筛选参数，支持日期或日期时间字符串（只有日期时为当天零点），无时区时按当前时区处理"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = parse_datetime(str(value))
+        if parsed is None:
+            parsed_date = parse_date(str(value))
+            if parsed_date is None:
+                raise ValueError(f"时间格式错误: {value}")
+            parsed = datetime.combine(parsed_date, time.min)
+
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _text_match(value, keyword, match_mode):
+    """归档记录的文本匹配（与数据库默认的不区分大小写排序规则一致）"""
+    if value is None:
+        return False
+    value, keyword = str(value).lower(), keyword.lower()
+    if match_mode == MATCH_MODE_EXACT:
+        return value == keyword
+    if match_mode == MATCH_MODE_PREFIX:
+        return value.startswith(keyword)
+    return keyword in value
+
+
+class AuditLogFilter:
+    """审计日志筛选条件，同时用于数据库查询和归档文件中的记录匹配
+
+    Args:
+        body: 请求参数（operator, model_name, record_id, action, ip_address, start_date, end_date, keyword, match_mode）
+
+    match_mode 作用于 operator、model_name、record_id 和 keyword；
+    ip_address 为 CIDR 网段（如 10.0.0.0/8）时按打包IP范围查询，match_mode 为 exact 时按打包IP精确查询
+    """
+
+    def __init__(self, body):
+        self.match_mode = body.get('match_mode') or MATCH_MODE_CONTAINS
+        if self.match_mode not in MATCH_MODES:
+            raise ValueError(f"不支持的匹配方式: {self.match_mode}")
+
+        self.operator = body.get('operator')
+        self.model_name = body.get('model_name')
+        self.record_id = body.get('record_id')
+        self.keyword = body.get('keyword')
+
+        # IP筛选：CIDR 网段或精确匹配时转换为打包IP范围
+        self.ip_address = body.get('ip_address')
+        self.ip_range = None
+        if self.ip_address and '/' in self.ip_address:
+            self.ip_range = get_network_packed_range(self.ip_address)
+        elif self.ip_address and self.match_mode == MATCH_MODE_EXACT:
+            packed_ip = pack_ip(self.ip_address)
+            if packed_ip is None:
+                raise ValueError(f"IP地址格式错误: {self.ip_address}")
+            self.ip_range = (packed_ip, packed_ip)
+
+        # 支持多选操作类型，以逗号分隔
+        action = body.get('action')
+        self.actions = [item.strip() for item in action.split(',')] if action else []
+
+        self.start_time = parse_filter_datetime(body.get('start_date'))
+        self.end_time = parse_filter_datetime(body.get('end_date'))
+
+    def apply(self, query):
+        """将筛选条件应用到查询集"""
+        lookup = MATCH_MODE_LOOKUPS[self.match_mode]
+        if self.operator:
+            query = query.filter(**{f'operator_username__{lookup}': self.operator})
+        if self.model_name:
+            query = query.filter(**{f'model_name__{lookup}': self.model_name})
+        if self.record_id:
+            query = query.filter(**{f'record_id__{lookup}': self.record_id})
+        if self.actions:
+            query = query.filter(action__in=self.actions)
+        if self.ip_range:
+            query = query.filter(ip_packed__gte=self.ip_range[0], ip_packed__lte=self.ip_range[1])
+        elif self.ip_address:
+            query = query.filter(ip_address__icontains=self.ip_address)
+        if self.start_time:
+            query = query.filter(create_time__gte=self.start_time)
+        if self.end_time:
+            query = query.filter(create_time__lte=self.end_time)
+        # 关键词搜索(搜索操作人和记录ID)
+        if self.keyword:
+            query = query.filter(
+                Q(**{f'operator_username__{lookup}': self.keyword}) |
+                Q(**{f'record_id__{lookup}': self.keyword})
+            )
+        return query
+
+    def match(self, row):
+        """判断归档记录（字典，create_time 为带时区的 datetime）是否满足筛选条件"""
+        match_mode = self.match_mode
+        if row.get('is_del'):
+            return False
+        if self.operator and not _text_match(row.get('operator_username'), self.operator, match_mode):
+            return False
+        if self.model_name and not _text_match(row.get('model_name'), self.model_name, match_mode):
+            return False
+        if self.record_id and not _text_match(row.get('record_id'), self.record_id, match_mode):
+            return False
+        if self.actions and row.get('action') not in self.actions:
+            return False
+        if self.ip_range:
+            packed_ip = pack_ip(row.get('ip_address'))
+            if packed_ip is None or not self.ip_range[0] <= packed_ip <= self.ip_range[1]:
+                return False
+        elif self.ip_address and not _text_match(row.get('ip_address'), self.ip_address, MATCH_MODE_CONTAINS):
+            return False
+        if self.start_time and row['create_time'] < self.start_time:
+            return False
+        if self.end_time and row['create_time'] > self.end_time:
+            return False
+        if self.keyword and not (_text_match(row.get('operator_username'), self.keyword, match_mode)
+                                 or _text_match(row.get('record_id'), self.keyword, match_mode)):
+            return False
+        return True
@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.audit.filters import AuditLogFilter
+from apps.audit.models import AuditLog
+
+# 典型的筛选条件：(说明, 请求参数, 期望使用的索引)
+SEARCH_SHAPES = (
+    ('按操作类型', {'action': 'UPDATE'}, 'audit_log_action_ctime_idx'),
+    ('按操作人精确匹配', {'operator': 'admin', 'match_mode': 'exact'}, 'audit_log_operator_ctime_idx'),
+    ('按操作人前缀匹配', {'operator': 'adm', 'match_mode': 'prefix'}, 'audit_log_operator_ctime_idx'),
+    ('按模型和记录ID', {'model_name': 'user', 'record_id': '0', 'match_mode': 'exact'}, 'audit_log_model_record_idx'),
+    ('按IP网段', {'ip_address': '10.0.0.0/8'}, 'audit_log_ip_ctime_idx'),
+)
+
+
+def build_search_query(body):
+    """与审计日志列表接口相同的查询（首页）"""
+    return AuditLogFilter(body).apply(AuditLog.objects.all()).order_by('-create_time', '-uuid')[:20]
+
+
+def collect_used_keys(plan):
+    """从 MySQL 的 JSON 格式执行计划中收集实际使用的索引"""
+    keys = set()
+    if isinstance(plan, dict):
+        for key, value in plan.items():
+            if key == 'key' and isinstance(value, str):
+                keys.add(value)
+            else:
+                keys |= collect_used_keys(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            keys |= collect_used_keys(item)
+    return keys
+
+
+def explain_query(query):
+    """返回 (执行计划文本, 实际使用的索引集合)，非 MySQL 时按文本包含判断"""
+    if connection.vendor == 'mysql':
+        plan = query.explain(format='JSON')
+        return plan, collect_used_keys(json.loads(plan))
+    plan = query.explain()
+    return plan, None
+
+
+class Command(BaseCommand):
+    help = 'Print EXPLAIN plans of typical audit log searches and check that they use the search indexes'
+
+    def handle(self, *args, **options):
+        failed = 0
+        for title, body, index_name in SEARCH_SHAPES:
+            plan, used_keys = explain_query(build_search_query(body))
+            used = index_name in used_keys if used_keys is not None else index_name in plan
+            failed += 0 if used else 1
+
+            style = self.style.SUCCESS if used else self.style.WARNING
+            self.stdout.write(style(f'{title}: {"使用" if used else "未使用"} {index_name}'))
+            self.stdout.write(plan)
+
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{failed} 个查询未使用期望的索引（数据量较小时优化器可能选择全表扫描）'))
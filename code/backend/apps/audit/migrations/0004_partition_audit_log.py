@@ -0,0 +1,67 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import migrations
+
+# 需要提前创建的未来月份数，之后由 archive_audit_logs 定时任务维护
+MONTHS_AHEAD = 2
+
+
+def _month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def _add_months(month_start, months):
+    month_index = month_start.year * 12 + month_start.month - 1 + months
+    return month_start.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+
+def partition_audit_log(apps, schema_editor):
+    """MySQL 上将 audit_log 改为按 create_time 每月一个分区，其他数据库不处理
+
+    分区表的唯一键必须包含分区列，主键改为 (uuid, create_time)
+    """
+    if schema_editor.connection.vendor != 'mysql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT MIN(create_time) FROM audit_log")
+        oldest = cursor.fetchone()[0]
+
+    now = datetime.now(dt_timezone.utc)
+    if oldest is not None and oldest.tzinfo is not None:
+        oldest = oldest.astimezone(dt_timezone.utc)
+    month_start = _month_start(oldest or now)
+    last_month = _add_months(_month_start(now), MONTHS_AHEAD)
+
+    definitions = []
+    while month_start <= last_month:
+        next_month = _add_months(month_start, 1)
+        definitions.append(
+            f"PARTITION p{month_start:%Y%m} VALUES LESS THAN ('{next_month:%Y-%m-%d %H:%M:%S}')"
+        )
+        month_start = next_month
+    definitions.append("PARTITION p_future VALUES LESS THAN (MAXVALUE)")
+
+    schema_editor.execute("ALTER TABLE audit_log DROP PRIMARY KEY, ADD PRIMARY KEY (uuid, create_time)")
+    schema_editor.execute(
+        f"ALTER TABLE audit_log PARTITION BY RANGE COLUMNS(create_time) ({', '.join(definitions)})"
+    )
+
+
+def unpartition_audit_log(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+
+    schema_editor.execute("ALTER TABLE audit_log REMOVE PARTITIONING")
+    schema_editor.execute("ALTER TABLE audit_log DROP PRIMARY KEY, ADD PRIMARY KEY (uuid)")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0003_auditlog_audit_log_del_ctime_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_audit_log, unpartition_audit_log),
+    ]
@@ -0,0 +1,63 @@
+import ipaddress
+
+import apps.audit.models
+from django.db import migrations, models
+
+
+def _pack_ip(ip_address):
+    try:
+        address = ipaddress.ip_address(str(ip_address).strip())
+    except ValueError:
+        return None
+    if address.version == 4:
+        address = ipaddress.IPv6Address(f'::ffff:{address}')
+    return address.packed
+
+
+def backfill_ip_packed(apps, schema_editor):
+    """按批回填已有审计日志的打包IP"""
+    AuditLog = apps.get_model('audit', 'AuditLog')
+    batch = []
+    queryset = AuditLog.objects.exclude(ip_address__isnull=True).only('uuid', 'create_time', 'ip_address')
+    for audit_log in queryset.iterator(chunk_size=2000):
+        audit_log.ip_packed = _pack_ip(audit_log.ip_address)
+        if audit_log.ip_packed is None:
+            continue
+        batch.append(audit_log)
+        if len(batch) >= 2000:
+            AuditLog.objects.bulk_update(batch, ['ip_packed'])
+            batch = []
+    if batch:
+        AuditLog.objects.bulk_update(batch, ['ip_packed'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0004_partition_audit_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auditlog',
+            name='ip_packed',
+            field=apps.audit.models.PackedIPField(help_text='用于按IP或CIDR网段查询', max_length=16, null=True, verbose_name='IP地址（打包）'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['action', 'create_time'], name='audit_log_action_ctime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['operator_username', 'create_time'], name='audit_log_operator_ctime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['model_name', 'record_id'], name='audit_log_model_record_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['ip_packed', 'create_time'], name='audit_log_ip_ctime_idx'),
+        ),
+        migrations.RunPython(backfill_ip_packed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0005_auditlog_ip_packed_and_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditLogRollup',
+            fields=[
+                ('uuid', models.UUIDField(auto_created=True, default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('is_del', models.BooleanField(default=False, verbose_name='是否删除')),
+                ('create_time', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('bucket', models.DateTimeField(verbose_name='统计小时（UTC）')),
+                ('action', models.CharField(max_length=20, verbose_name='操作类型')),
+                ('model_name', models.CharField(blank=True, default='', max_length=100, verbose_name='模型名称')),
+                ('operator_username', models.CharField(max_length=100, verbose_name='操作人')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='数量')),
+            ],
+            options={
+                'verbose_name': '审计日志统计',
+                'verbose_name_plural': '审计日志统计',
+                'db_table': 'audit_log_rollup',
+                'indexes': [
+                    models.Index(fields=['action', 'bucket'], name='audit_rollup_action_idx'),
+                    models.Index(fields=['operator_username', 'bucket'], name='audit_rollup_operator_idx'),
+                ],
+                'constraints': [
+                    models.UniqueConstraint(fields=('bucket', 'action', 'model_name', 'operator_username'), name='audit_log_rollup_key_uniq'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='AuditLogRollupWatermark',
+            fields=[
+                ('uuid', models.UUIDField(auto_created=True, default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('is_del', models.BooleanField(default=False, verbose_name='是否删除')),
+                ('create_time', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='名称')),
+                ('watermark', models.DateTimeField(verbose_name='水位')),
+            ],
+            options={
+                'verbose_name': '审计日志统计水位',
+                'verbose_name_plural': '审计日志统计水位',
+                'db_table': 'audit_log_rollup_watermark',
+            },
+        ),
+    ]
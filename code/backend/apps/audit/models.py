@@ -1,6 +1,45 @@
+import ipaddress
+
 from django.db import models
+from django.utils import timezone
 from lib.model_tools import BaseModel
 
+
+def pack_ip(ip_address):
+    """IP地址打包为16字节（IPv4 转为 IPv4 映射的 IPv6 地址），无效地址返回 None
+
+    打包后的字节序与地址大小顺序一致，CIDR 网段可以转换为范围查询
+    """
+    if not ip_address:
+        return None
+    try:
+        address = ipaddress.ip_address(str(ip_address).strip())
+    except ValueError:
+        return None
+    if address.version == 4:
+        address = ipaddress.IPv6Address(f'::ffff:{address}')
+    return address.packed
+
+
+def get_network_packed_range(cidr):
+    """CIDR 网段打包后的 (起始地址, 结束地址)，网段格式错误时抛出 ValueError"""
+    network = ipaddress.ip_network(str(cidr).strip(), strict=False)
+    return pack_ip(network.network_address), pack_ip(network.broadcast_address)
+
+
+class PackedIPField(models.BinaryField):
+    """打包的IP地址，MySQL 上使用可以建索引的 varbinary(16)"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', 16)
+        super().__init__(*args, **kwargs)
+
+    def db_type(self, connection):
+        if connection.vendor == 'mysql':
+            return 'varbinary(16)'
+        return super().db_type(connection)
+
+
 class AuditLog(BaseModel):
     """操作审计日志"""
     ACTION_CHOICES = (
@@ -18,9 +57,60 @@ class AuditLog(BaseModel):
     action = models.CharField(max_length=20, choices=ACTION_CHOICES, verbose_name='操作类型', help_text='操作类型')
     detail = models.JSONField(verbose_name='操作详情')
     ip_address = models.GenericIPAddressField(null=True, verbose_name='IP地址')
+    ip_packed = PackedIPField(null=True, verbose_name='IP地址（打包）', help_text='用于按IP或CIDR网段查询')
+    # 事件发生的时间：由 audit_sink 在提交条目时记录，异步后端延迟写入时保持不变（不使用 auto_now_add）
+    create_time = models.DateTimeField(default=timezone.now, verbose_name='创建时间')
 
     class Meta:
         db_table = 'audit_log'
         verbose_name = '审计日志'
         verbose_name_plural = verbose_name
-        ordering = ['-create_time']
\ No newline at end of file
+        ordering = ['-create_time']
+        indexes = [
+            # 游标分页按 (create_time, uuid) 排序翻页，默认管理器带 is_del 过滤
+            models.Index(fields=['is_del', 'create_time', 'uuid'], name='audit_log_del_ctime_idx'),
+            # 精确/前缀筛选使用的索引
+            models.Index(fields=['action', 'create_time'], name='audit_log_action_ctime_idx'),
+            models.Index(fields=['operator_username', 'create_time'], name='audit_log_operator_ctime_idx'),
+            models.Index(fields=['model_name', 'record_id'], name='audit_log_model_record_idx'),
+            models.Index(fields=['ip_packed', 'create_time'], name='audit_log_ip_ctime_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.ip_packed = pack_ip(self.ip_address)
+        super().save(*args, **kwargs)
+
+
+class AuditLogRollup(BaseModel):
+    """审计日志按小时预聚合的计数，由 rollup_audit_logs 定时任务按水位增量维护"""
+    bucket = models.DateTimeField(verbose_name='统计小时（UTC）')
+    action = models.CharField(max_length=20, verbose_name='操作类型')
+    model_name = models.CharField(max_length=100, default='', blank=True, verbose_name='模型名称')
+    operator_username = models.CharField(max_length=100, verbose_name='操作人')
+    count = models.PositiveIntegerField(default=0, verbose_name='数量')
+
+    class Meta:
+        db_table = 'audit_log_rollup'
+        verbose_name = '审计日志统计'
+        verbose_name_plural = verbose_name
+        constraints = [
+            models.UniqueConstraint(
+                fields=['bucket', 'action', 'model_name', 'operator_username'],
+                name='audit_log_rollup_key_uniq'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['action', 'bucket'], name='audit_rollup_action_idx'),
+            models.Index(fields=['operator_username', 'bucket'], name='audit_rollup_operator_idx'),
+        ]
+
+
+class AuditLogRollupWatermark(BaseModel):
+    """审计日志统计的处理水位，create_time 不晚于水位的审计日志已计入统计"""
+    name = models.CharField(max_length=50, unique=True, verbose_name='名称')
+    watermark = models.DateTimeField(verbose_name='水位')
+
+    class Meta:
+        db_table = 'audit_log_rollup_watermark'
+        verbose_name = '审计日志统计水位'
+        verbose_name_plural = verbose_name
@@ -0,0 +1,127 @@
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection
+
+from lib.log import color_logger
+from .models import AuditLog
+
+# audit_log 在 MySQL 上按 create_time（UTC）每月一个 RANGE COLUMNS 分区：
+# - 分区名 pYYYYMM，保存 create_time 小于下个月1日的记录
+# - p_future 保存所有更晚的记录，定时任务会提前把它拆分出未来几个月的分区
+# 分区表的所有唯一键都必须包含分区列，因此主键为 (uuid, create_time)（见迁移 0004）
+
+FUTURE_PARTITION = 'p_future'
+PARTITION_NAME_PATTERN = re.compile(r'^p(\d{4})(\d{2})$')
+
+
+def get_month_start(value):
+    """所在月份的1日零点（UTC）"""
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc)
+    else:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month_start, months):
+    """月份偏移，month_start 必须是某月1日"""
+    month_index = month_start.year * 12 + month_start.month - 1 + months
+    return month_start.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+
+def get_current_month_start():
+    return get_month_start(datetime.now(dt_timezone.utc))
+
+
+def get_partition_name(month_start):
+    return f"p{month_start:%Y%m}"
+
+
+def get_partition_month(partition_name):
+    """分区名对应的月份，p_future 返回 None"""
+    match = PARTITION_NAME_PATTERN.match(partition_name)
+    if not match:
+        return None
+    return datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=dt_timezone.utc)
+
+
+def format_partition_bound(month_start):
+    """分区边界值（MySQL DATETIME 字面量，UTC）"""
+    return month_start.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def build_partition_definition(month_start):
+    next_month = add_months(month_start, 1)
+    return f"PARTITION {get_partition_name(month_start)} VALUES LESS THAN ('{format_partition_bound(next_month)}')"
+
+
+def get_partition_names():
+    """audit_log 当前的分区名（按顺序），未分区或非 MySQL 时返回空列表"""
+    if connection.vendor != 'mysql':
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION",
+            [AuditLog._meta.db_table]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def is_partitioned():
+    return bool(get_partition_names())
+
+
+def get_monthly_partitions():
+    """[(分区名, 月份)]，不包含 p_future"""
+    partitions = []
+    for name in get_partition_names():
+        month_start = get_partition_month(name)
+        if month_start is not None:
+            partitions.append((name, month_start))
+    return partitions
+
+
+def ensure_future_partitions(months_ahead=2):
+    """从 p_future 中拆分出直到 months_ahead 个月后的月分区
+
+    Returns:
+        新建的分区名列表
+    """
+    partitions = get_monthly_partitions()
+    if not partitions:
+        return []
+
+    target_month = add_months(get_current_month_start(), months_ahead)
+    month_start = add_months(partitions[-1][1], 1)
+    new_months = []
+    while month_start <= target_month:
+        new_months.append(month_start)
+        month_start = add_months(month_start, 1)
+    if not new_months:
+        return []
+
+    definitions = [build_partition_definition(month_start) for month_start in new_months]
+    definitions.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"ALTER TABLE {AuditLog._meta.db_table} REORGANIZE PARTITION {FUTURE_PARTITION} "
+            f"INTO ({', '.join(definitions)})"
+        )
+
+    new_partitions = [get_partition_name(month_start) for month_start in new_months]
+    color_logger.info(f"审计日志新建分区: {new_partitions}")
+    return new_partitions
+
+
+def drop_partition(partition_name):
+    """删除分区（连同其中的数据，调用前需先归档）"""
+    if get_partition_month(partition_name) is None:
+        raise ValueError(f"不允许删除分区: {partition_name}")
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {AuditLog._meta.db_table} DROP PARTITION {partition_name}")
+    color_logger.info(f"审计日志删除分区: {partition_name}")
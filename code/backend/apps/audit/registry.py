@@ -0,0 +1,162 @@
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+from django.apps import apps
+from django.db import models
+
+from backend.settings import config_data
+from lib.log import color_logger
+from lib.time_tools import utc_obj_to_time_zone_str
+
+# 默认不记录的字段
+DEFAULT_EXCLUDE_FIELDS = ('update_time',)
+
+
+def serialize_value(value):
+    """序列化值，处理特殊类型"""
+    if isinstance(value, datetime):
+        return utc_obj_to_time_zone_str(value)
+    if isinstance(value, uuid.UUID):  # 处理 UUID 类型
+        return str(value)
+    if hasattr(value, 'uuid'):  # 处理UUID字段
+        return str(value.uuid)
+    if hasattr(value, 'pk'):  # 处理外键关联对象
+        return str(value.pk)
+    if isinstance(value, Decimal):  # 处理 Decimal 类型
+        return float(value)  # 转换为 float 类型
+    return value
+
+
+def _serialize_datetime(value):
+    return utc_obj_to_time_zone_str(value) if value is not None else None
+
+
+def _serialize_str(value):
+    return str(value) if value is not None else None
+
+
+def _serialize_decimal(value):
+    return float(value) if value is not None else None
+
+
+def get_field_serializer(field):
+    """根据字段类型选择序列化函数（启动时确定，避免每次保存都做类型判断）"""
+    if isinstance(field, models.DateTimeField):
+        return _serialize_datetime
+    if isinstance(field, models.DecimalField):
+        return _serialize_decimal
+    # 关系字段取 attname 的值，即关联对象的主键
+    if field.is_relation or isinstance(field, models.UUIDField):
+        return _serialize_str
+    return serialize_value
+
+
+class AuditField:
+    """审计字段的元数据"""
+
+    __slots__ = ('name', 'attname', 'is_relation', 'serialize')
+
+    def __init__(self, field):
+        self.name = field.name
+        self.attname = field.attname
+        self.is_relation = field.is_relation
+        self.serialize = get_field_serializer(field)
+
+
+class AuditModelOptions:
+    """单个审计模型的配置，字段元数据在 prepare() 时预先计算
+
+    Args:
+        model: 审计的模型
+        include: 只记录的字段名，为空时记录所有字段
+        exclude: 不记录的字段名（在 DEFAULT_EXCLUDE_FIELDS 基础上追加）
+    """
+
+    def __init__(self, model, include=None, exclude=None):
+        self.model = model
+        self.include = set(include or [])
+        self.exclude = set(DEFAULT_EXCLUDE_FIELDS) | set(exclude or [])
+        self.model_name = model._meta.model_name
+        self.fields = ()
+        self.attnames = ()
+        self.m2m_fields = {}
+
+    def is_field_audited(self, name):
+        if self.include and name not in self.include:
+            return False
+        return name not in self.exclude
+
+    def prepare(self):
+        """预先计算需要记录的字段、序列化函数和多对多字段（所有模型加载完成后调用）"""
+        opts = self.model._meta
+        self.fields = tuple(
+            AuditField(field) for field in opts.concrete_fields
+            if self.is_field_audited(field.name)
+        )
+        self.attnames = tuple(field.attname for field in opts.concrete_fields)
+        # {中间表: 多对多字段}
+        self.m2m_fields = {
+            field.remote_field.through: field for field in opts.many_to_many
+            if self.is_field_audited(field.name)
+        }
+
+
+class AuditRegistry:
+    """审计模型注册表
+
+    只有注册的模型才会连接审计信号，未注册模型的写入没有任何审计开销。
+    注册方式：
+
+    1. 装饰器::
+
+        @audit_registry.register(exclude=['password'])
+        class User(BaseModel):
+            ...
+
+    2. 配置文件 AUDIT.MODELS::
+
+        MODELS: {"user.User": {"exclude": ["password"]}, "perm.Role": {}}
+    """
+
+    def __init__(self):
+        self._registry = {}
+
+    def register(self, model=None, include=None, exclude=None):
+        """注册审计模型，可直接调用也可作为装饰器使用"""
+        def decorator(model_class):
+            self._registry[model_class] = AuditModelOptions(model_class, include=include, exclude=exclude)
+            return model_class
+
+        if model is not None:
+            return decorator(model)
+        return decorator
+
+    def load_from_config(self):
+        """从配置文件 AUDIT.MODELS 注册审计模型，配置优先于装饰器"""
+        model_configs = config_data.get('AUDIT', {}).get('MODELS') or {}
+        for model_label, model_config in model_configs.items():
+            try:
+                model = apps.get_model(model_label)
+            except (LookupError, ValueError) as e:
+                color_logger.error(f"审计模型配置错误: {model_label}, {e}")
+                continue
+            model_config = model_config or {}
+            self.register(model, include=model_config.get('include'), exclude=model_config.get('exclude'))
+
+    def prepare(self):
+        for options in self._registry.values():
+            options.prepare()
+
+    def get_options(self, model):
+        """获取模型的审计配置，未注册时返回 None"""
+        return self._registry.get(model)
+
+    def is_registered(self, model):
+        return model in self._registry
+
+    def get_all_options(self):
+        return list(self._registry.values())
+
+
+audit_registry = AuditRegistry()
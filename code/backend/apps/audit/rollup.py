@@ -0,0 +1,166 @@
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+import pytz
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+
+from lib.log import color_logger
+from lib.time_tools import get_now_time_utc_obj
+from .models import AuditLog, AuditLogRollup, AuditLogRollupWatermark
+from .sink import get_audit_config
+
+ROLLUP_WATERMARK_NAME = 'audit_log_hourly'
+
+# 统计维度
+ROLLUP_DIMENSIONS = ('action', 'model_name', 'operator_username')
+
+STATS_INTERVAL_HOUR = 'hour'
+STATS_INTERVAL_DAY = 'day'
+
+
+def get_rollup_watermark():
+    """当前处理水位，尚未处理过时返回 None"""
+    return AuditLogRollupWatermark.objects.filter(name=ROLLUP_WATERMARK_NAME).values_list('watermark', flat=True).first()
+
+
+def rollup_audit_logs():
+    """将水位之后的新审计日志按 (小时, 操作类型, 模型, 操作人) 聚合，累加到统计表
+
+    - 只处理 create_time 早于 当前时间 - ROLLUP_LAG_SECONDS 的记录，给未提交的事务和异步后端的写入延迟留出时间
+      （create_time 为事件时间，水位推进后才写入的更早记录不会计入统计）
+    - 单次最多处理 ROLLUP_MAX_WINDOW_HOURS 小时，首次运行时从最早的记录开始逐步追上
+    - 先对水位行加锁再读取水位和聚合，统计累加和水位更新在同一事务中；
+      并发执行时后一次等待前一次提交后从新水位开始，不会重复计数
+
+    Returns:
+        本次计入统计的审计日志数量
+    """
+    audit_config = get_audit_config()
+    lag = timedelta(seconds=audit_config.get('ROLLUP_LAG_SECONDS', 60))
+    max_window = timedelta(hours=audit_config.get('ROLLUP_MAX_WINDOW_HOURS', 24))
+
+    with transaction.atomic():
+        watermark_row = _lock_rollup_watermark()
+        if watermark_row is None:
+            return 0
+        watermark = watermark_row.watermark
+        upper = min(watermark + max_window, get_now_time_utc_obj() - lag)
+        if upper <= watermark:
+            return 0
+
+        # 一次 GROUP BY 只扫描水位之后的记录
+        groups = (
+            AuditLog.objects.filter(create_time__gt=watermark, create_time__lte=upper)
+            .annotate(bucket=TruncHour('create_time'))
+            .values('bucket', *ROLLUP_DIMENSIONS)
+            .annotate(count=Count('uuid'))
+            .order_by()
+        )
+        increments = {
+            (group['bucket'], group['action'], group['model_name'] or '', group['operator_username']): group['count']
+            for group in groups
+        }
+
+        if increments:
+            _apply_rollup_increments(increments)
+        watermark_row.watermark = upper
+        watermark_row.save(update_fields=['watermark', 'update_time'])
+
+    total = sum(increments.values())
+    if total:
+        color_logger.debug(f"审计日志统计: 新增 {total} 条, 水位 {upper}")
+    return total
+
+
+def _lock_rollup_watermark():
+    """在事务中锁定水位行，没有审计日志时返回 None
+
+    首次运行时以最早的记录之前的时间创建水位行；并发创建时唯一约束冲突的一方读取已创建的行
+    """
+    watermark_row = AuditLogRollupWatermark.objects.select_for_update().filter(name=ROLLUP_WATERMARK_NAME).first()
+    if watermark_row is not None:
+        return watermark_row
+
+    oldest = AuditLog.objects.order_by('create_time').values_list('create_time', flat=True).first()
+    if oldest is None:
+        return None
+    AuditLogRollupWatermark.objects.get_or_create(
+        name=ROLLUP_WATERMARK_NAME, defaults={'watermark': oldest - timedelta(microseconds=1)}
+    )
+    return AuditLogRollupWatermark.objects.select_for_update().get(name=ROLLUP_WATERMARK_NAME)
+
+
+def _apply_rollup_increments(increments):
+    """将 {(bucket, action, model_name, operator): count} 累加到统计表"""
+    buckets = {key[0] for key in increments}
+    existing = {
+        (rollup.bucket, rollup.action, rollup.model_name, rollup.operator_username): rollup
+        for rollup in AuditLogRollup.objects.select_for_update().filter(bucket__in=buckets)
+    }
+
+    to_create = []
+    to_update = []
+    for key, count in increments.items():
+        rollup = existing.get(key)
+        if rollup is None:
+            bucket, action, model_name, operator_username = key
+            to_create.append(AuditLogRollup(
+                bucket=bucket, action=action, model_name=model_name,
+                operator_username=operator_username, count=count
+            ))
+        else:
+            rollup.count += count
+            to_update.append(rollup)
+
+    AuditLogRollup.objects.bulk_create(to_create, batch_size=500)
+    AuditLogRollup.objects.bulk_update(to_update, ['count'], batch_size=500)
+
+
+def query_audit_stats(start_time, end_time, interval=STATS_INTERVAL_HOUR, group_by=None,
+                      actions=None, model_name=None, operator_username=None, time_zone='Asia/Shanghai'):
+    """从统计表查询时间序列，不读取审计日志表
+
+    Args:
+        start_time / end_time: 统计的时间范围（带时区）
+        interval: hour / day（按 time_zone 的自然日）
+        group_by: 分组维度 action / model_name / operator_username，为空时只按时间汇总
+        actions / model_name / operator_username: 精确筛选
+
+    Returns:
+        [{'bucket': 时间字符串, 'key': 分组值, 'count': 数量}]，按时间、分组值排序
+    """
+    if group_by is not None and group_by not in ROLLUP_DIMENSIONS:
+        raise ValueError(f"不支持的分组维度: {group_by}")
+    if interval not in (STATS_INTERVAL_HOUR, STATS_INTERVAL_DAY):
+        raise ValueError(f"不支持的统计间隔: {interval}")
+
+    query = AuditLogRollup.objects.filter(bucket__gte=_hour_floor(start_time), bucket__lte=end_time)
+    if actions:
+        query = query.filter(action__in=actions)
+    if model_name:
+        query = query.filter(model_name=model_name)
+    if operator_username:
+        query = query.filter(operator_username=operator_username)
+
+    group_fields = ['bucket'] + ([group_by] if group_by else [])
+    rows = query.values(*group_fields).annotate(total=Sum('count')).order_by()
+
+    # 小时数据量很小，按时区折算到天在内存中完成
+    tz = pytz.timezone(time_zone)
+    bucket_format = '%Y-%m-%d %H:00' if interval == STATS_INTERVAL_HOUR else '%Y-%m-%d'
+    series = defaultdict(int)
+    for row in rows:
+        bucket = row['bucket'].astimezone(tz).strftime(bucket_format)
+        series[(bucket, row[group_by] if group_by else None)] += row['total']
+
+    return [
+        {'bucket': bucket, 'key': key, 'count': count}
+        for (bucket, key), count in sorted(series.items(), key=lambda item: (item[0][0], item[0][1] or ''))
+    ]
+
+
+def _hour_floor(value):
+    """所在小时的起点（UTC）"""
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
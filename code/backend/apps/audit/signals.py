@@ -1,17 +1,14 @@
+from django.db import transaction
 from django.db.models.signals import pre_save, post_save, pre_delete, m2m_changed
 from django.dispatch import receiver
-from django.db.models import Model
 
-from apps.myAuth.token_utils import TokenManager
-from lib.time_tools import utc_obj_to_time_zone_str
+from lib.model_tools import BaseModel, tree_nodes_bulk_updated
 from .models import AuditLog
-from lib.request_tool import get_authorization_token, get_current_request, get_client_ip
+from .registry import audit_registry
+from .sink import audit_sink
+from lib.auth_context import get_auth_context
 from lib.log import color_logger
-from datetime import datetime
-import uuid
-from django.db import transaction
 from threading import local
-from decimal import Decimal
 
 # https://docs.djangoproject.com/zh-hans/5.1/ref/signals/
 # 创建一个线程本地存储来存储临时变更
@@ -29,146 +26,113 @@ def clear_thread_locals():
         del _thread_locals.changes
 
 def get_operator_info():
-    """获取操作者信息"""
-    username = 'UNKNOWN'
-    ip_address = 'UNKNOWN'
-
-    request = get_current_request()
-    if request is not None:
-        username = TokenManager().get_username_from_access_token(get_authorization_token(request))
-        if username is None:
-            color_logger.warning("当前请求中没有获取到用户名")
-            return None, None
-        ip_address = get_client_ip(request)
-    else:
-        color_logger.warning("当前请求中没有获取到请求对象")
+    """获取操作者信息（复用请求或任务的认证上下文，不重复校验token）"""
+    auth_context = get_auth_context()
+    if auth_context is None:
+        color_logger.warning("当前上下文中没有获取到认证信息")
+        return None, None
+
+    username = auth_context.username
+    if username is None:
+        color_logger.warning("当前请求中没有获取到用户名")
         return None, None
 
-    return username, ip_address
+    return username, auth_context.ip_address
 
 def create_audit_log(username, model_name, record_id, action, detail, ip_address):
-    """创建审计日志"""
-    def _create():
-        try:
-            AuditLog.objects.create(
-                operator_username=username,
-                model_name=model_name,
-                record_id=record_id,
-                action=action,
-                detail=detail,
-                ip_address=ip_address
-            )
-        except Exception as e:
-            color_logger.error(f"创建审计日志失败: {str(e)}")
-
-    transaction.on_commit(_create)
-
-def serialize_value(value):
-    """序列化值，处理特殊类型"""
-    if isinstance(value, datetime):
-        return utc_obj_to_time_zone_str(value)
-    if isinstance(value, uuid.UUID):  # 处理 UUID 类型
-        return str(value)
-    if hasattr(value, 'uuid'):  # 处理UUID字段
-        return str(value.uuid)
-    if hasattr(value, 'pk'):  # 处理外键关联对象
-        return str(value.pk)
-    if isinstance(value, Decimal):  # 处理 Decimal 类型
-        return float(value)  # 转换为 float 类型
-    return value
-
-def get_relation_changes(field, old_instance, new_instance):
-    """获取关系字段的变更"""
-    if field.many_to_many:
-        # 多对多关系由 m2m_changed 信号处理
+    """创建审计日志（事务提交后由 audit_sink 批量写入）"""
+    try:
+        audit_sink.submit(
+            operator_username=username,
+            model_name=model_name,
+            record_id=record_id,
+            action=action,
+            detail=detail,
+            ip_address=ip_address
+        )
+    except Exception as e:
+        color_logger.error(f"创建审计日志失败: {str(e)}")
+
+def get_original_values(options, instance):
+    """获取实例保存前的字段值 {attname: value}，新建的实例返回 None
+
+    BaseModel 直接使用从数据库加载时的快照，无需查询；
+    其他模型或未经数据库加载的实例回退为查询一次具体字段
+    """
+    if instance._state.adding:
         return None
-        
-    if field.one_to_many or field.many_to_one or field.one_to_one:
-        # 处理其他关系字段
-        old_value = getattr(old_instance, field.name) if old_instance else None
-        new_value = getattr(new_instance, field.name)
-        if old_value != new_value:
-            return {
-                'old': serialize_value(old_value),
-                'new': serialize_value(new_value)
-            }
-    return None
-
-def get_changes(old_instance, new_instance):
-    """获取实例变更的字段"""
+
+    if isinstance(instance, BaseModel):
+        loaded_values = instance.get_loaded_values()
+        if loaded_values is not None:
+            return loaded_values
+
+    return options.model._base_manager.filter(pk=instance.pk).values(*options.attnames).first()
+
+def get_changes(old_values, new_instance, options):
+    """获取实例变更的字段
+
+    Args:
+        old_values: 保存前的字段值 {attname: value}，为 None 时视为新建记录
+        new_instance: 保存后的实例
+        options: 模型的审计配置，只比较其中的审计字段
+    """
     changes = {}
-    if not old_instance:
-        # 新建记录
-        for field in new_instance._meta.fields:
-            # 跳过 update_time 字段
-            if field.name == 'update_time':
+    deferred_fields = new_instance.get_deferred_fields()
+    for field in options.fields:
+        # 跳过延迟加载（未修改）的字段
+        if field.attname in deferred_fields:
+            continue
+
+        new_value = getattr(new_instance, field.attname)
+        if old_values is None:
+            # 新建记录，关系字段只记录有值的
+            if field.is_relation and new_value is None:
                 continue
-            if field.is_relation:
-                relation_changes = get_relation_changes(field, None, new_instance)
-                if relation_changes:
-                    changes[field.name] = relation_changes
-            else:
+            changes[field.name] = {'old': None, 'new': field.serialize(new_value)}
+        elif field.attname in old_values:
+            old_value = old_values[field.attname]
+            if old_value != new_value:
                 changes[field.name] = {
-                    'old': None,
-                    'new': serialize_value(getattr(new_instance, field.name))
+                    'old': field.serialize(old_value),
+                    'new': field.serialize(new_value)
                 }
-    else:
-        # 更新记录
-        for field in new_instance._meta.fields:
-            # 跳过 update_time 字段
-            if field.name == 'update_time':
-                continue
-            if field.is_relation:
-                relation_changes = get_relation_changes(field, old_instance, new_instance)
-                if relation_changes:
-                    changes[field.name] = relation_changes
-            else:
-                old_value = getattr(old_instance, field.name)
-                new_value = getattr(new_instance, field.name)
-                if old_value != new_value:
-                    changes[field.name] = {
-                        'old': serialize_value(old_value),
-                        'new': serialize_value(new_value)
-                    }
     return changes
 
-@receiver(pre_save)
+@receiver(tree_nodes_bulk_updated)
+def tree_nodes_bulk_updated_handler(sender, summary, **kwargs):
+    """类型树批量更新只记录一条汇总审计日志"""
+    if not audit_registry.is_registered(sender):
+        return
+
+    try:
+        username, ip_address = get_operator_info()
+        if not username:
+            return
+
+        create_audit_log(
+            username=username,
+            model_name=sender._meta.model_name,
+            record_id=None,
+            action='UPDATE',
+            detail={'bulk_update_nodes': summary},
+            ip_address=ip_address
+        )
+    except Exception as e:
+        color_logger.error(f"类型树批量更新审计日志记录失败: {str(e)}")
+
 def model_pre_save(sender, instance, **kwargs):
     """保存前记录原始数据"""
-    if not issubclass(sender, Model) or sender == AuditLog:
-        return
-        
     try:
-        # 获取原始实例
-        original_instance = type(instance).objects.get(pk=instance.pk)
-        instance._original_state = original_instance
-        color_logger.debug(f"pre_save: 获取到原始实例 {instance._meta.model_name}_{instance.pk}")
-        
-        # 记录多对多关系的原始状态
-        instance._original_m2m_state = {}
-        for field in instance._meta.many_to_many:
-            original_value = set(getattr(original_instance, field.name).all())
-            instance._original_m2m_state[field.name] = original_value
-            color_logger.debug(f"pre_save: 记录多对多字段 {field.name} 的原始状态: {[serialize_value(item) for item in original_value]}")
-
-        # 初始化多对多操作的标记
-        if hasattr(instance, '_m2m_add_pending'):
-            delattr(instance, '_m2m_add_pending')
-        if hasattr(instance, '_m2m_clear_pending'):
-            delattr(instance, '_m2m_clear_pending')
-        if hasattr(instance, '_m2m_remove_pending'):
-            delattr(instance, '_m2m_remove_pending')
-    except (type(instance).DoesNotExist, AttributeError):
-        instance._original_state = None
-        instance._original_m2m_state = {}
-        color_logger.debug(f"pre_save: 无法获取原始实例 {instance._meta.model_name}_{instance.pk}")
-
-@receiver(post_save)
-def model_post_save(sender, instance, created, **kwargs):
-    """处理模型保存后的审计日志记录"""
-    if not issubclass(sender, Model) or sender == AuditLog:
-        return
+        instance._audit_original_values = get_original_values(audit_registry.get_options(sender), instance)
+    except Exception as e:
+        instance._audit_original_values = None
+        color_logger.debug(f"pre_save: 无法获取原始数据 {instance._meta.model_name}_{instance.pk}: {str(e)}")
 
+def model_post_save(sender, instance, created, update_fields=None, **kwargs):
+    """处理模型保存后的审计日志记录"""
+    original_values = getattr(instance, '_audit_original_values', None)
+    instance._audit_original_values = None
     try:
         username, ip_address = get_operator_info()
         if not username:
@@ -177,16 +141,18 @@ def model_post_save(sender, instance, created, **kwargs):
         color_logger.debug(f"post_save: 开始处理实例 {instance._meta.model_name}_{instance.pk}")
 
         # 获取普通字段的变更
-        changes = get_changes(getattr(instance, '_original_state', None), instance)
+        changes = get_changes(None if created else original_values, instance, audit_registry.get_options(sender))
+        if update_fields is not None:
+            changes = {k: v for k, v in changes.items() if k in update_fields}
         color_logger.debug(f"post_save: 获取到普通字段变更: {changes}")
-        
+
         # 过滤掉没有实际变化的字段
         changes = {k: v for k, v in changes.items() if v['old'] != v['new']}
-        
+
         if not changes:
             color_logger.warning(f"保存审计日志时，当前数据库变更请求中没有获取到变更字段，跳过记录")
             return
-    
+
         color_logger.info(f"保存审计日志时，当前数据库变更请求中获取到变更字段，开始记录审计日志: {changes}")
 
         create_audit_log(
@@ -203,27 +169,24 @@ def model_post_save(sender, instance, created, **kwargs):
         import traceback
         color_logger.error(f"堆栈跟踪: {traceback.format_exc()}")
 
-@receiver(pre_delete)
 def model_pre_delete(sender, instance, **kwargs):
     """删除前记录"""
-    if not issubclass(sender, Model) or sender == AuditLog:
-        return
-
     try:
         username, ip_address = get_operator_info()
         if not username:
             return
 
         color_logger.info(f"删除模型数据时，当前数据库变更请求的请求对象中获取到用户名，开始记录审计日志")
-        
+
         detail = {}
-        for field in instance._meta.fields:
-            if field.is_relation:
-                relation_changes = get_relation_changes(field, None, instance)
-                if relation_changes:
-                    detail[field.name] = relation_changes['old']
-            else:
-                detail[field.name] = serialize_value(getattr(instance, field.name))
+        deferred_fields = instance.get_deferred_fields()
+        for field in audit_registry.get_options(sender).fields:
+            if field.attname in deferred_fields:
+                continue
+            value = getattr(instance, field.attname)
+            if field.is_relation and value is None:
+                continue
+            detail[field.name] = field.serialize(value)
 
         create_audit_log(
             username=username,
@@ -236,134 +199,178 @@ def model_pre_delete(sender, instance, **kwargs):
     except Exception as e:
         color_logger.error(f"审计日志记录失败: {str(e)}")
 
-@receiver(m2m_changed)
-def model_m2m_changed(sender, instance, action, pk_set, **kwargs):
-    """处理多对多关系变更"""
-    if not issubclass(sender, Model) or sender == AuditLog:
+def load_m2m_pk_set(record_pk, field, through):
+    """从中间表读取记录当前关联的主键集合"""
+    return set(through._base_manager.filter(
+        **{field.m2m_field_name(): record_pk}
+    ).values_list(field.m2m_reverse_field_name(), flat=True))
+
+def load_m2m_record_pks(related_pk, field, through):
+    """从中间表读取关联了 related_pk 的多对多字段所在记录的主键"""
+    return list(through._base_manager.filter(
+        **{field.m2m_reverse_field_name(): related_pk}
+    ).values_list(field.m2m_field_name(), flat=True))
+
+def get_m2m_change_key(model, record_pk, field):
+    return f"{model._meta.model_name}_{record_pk}_{field.name}"
+
+def apply_m2m_change(pending_change, action, pk_set):
+    """按变更动作推算多对多字段的当前主键集合"""
+    if action == 'post_add':
+        pending_change['current'] |= pk_set
+    elif action == 'post_remove':
+        pending_change['current'] -= pk_set
+    elif action == 'post_clear':
+        pending_change['current'] = set()
+
+def apply_committed_m2m_change(change_keys, action, pk_set):
+    """事务提交后将变更合并到请求内汇总的多对多变更"""
+    changes = get_thread_locals()
+    for change_key in change_keys:
+        pending_change = changes.get(change_key)
+        if pending_change is not None:
+            apply_m2m_change(pending_change, action, pk_set)
+
+def emit_m2m_change(pending_change):
+    """记录一个多对多字段从首次变更前到当前的整体变化"""
+    if pending_change['original'] == pending_change['current']:
+        color_logger.debug(f"m2m_changed: 字段 {pending_change['field_name']} 没有实际变化，跳过记录")
         return
 
-    try:
-        username, ip_address = get_operator_info()
-        if not username:
-            return
+    changes = {
+        pending_change['field_name']: {
+            'old': sorted(str(pk) for pk in pending_change['original']),
+            'new': sorted(str(pk) for pk in pending_change['current'])
+        }
+    }
+    color_logger.info(f"多对多关系变更，开始记录审计日志: {changes}")
+    create_audit_log(
+        username=pending_change['username'],
+        model_name=pending_change['model_name'],
+        record_id=pending_change['record_id'],
+        action='UPDATE',
+        detail=changes,
+        ip_address=pending_change['ip_address']
+    )
+
+def flush_m2m_changes():
+    """请求结束时记录请求内汇总的多对多变更（注册为 audit_sink 的请求结束回调）
+
+    汇总的当前集合只包含已提交的变更，回滚的变更不会被记录
+    """
+    pending_changes = get_thread_locals()
+    clear_thread_locals()
+    for pending_change in pending_changes.values():
+        try:
+            emit_m2m_change(pending_change)
+        except Exception as e:
+            color_logger.error(f"多对多变更审计日志记录失败: {str(e)}")
+
+audit_sink.register_end_hook(flush_m2m_changes)
+
+def model_m2m_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """处理多对多关系变更
+
+    在首次收到某记录字段的变更时才从中间表读取原始主键集合，之后按 pk_set 推算当前集合；
+    Django 修改多对多字段时会先清空再添加，因此请求内的变更汇总到请求结束时只记录一条，
+    不在请求范围内时每次变更后立即记录。
+
+    请求内的变更在事务提交后才合并到汇总中（通过 transaction.on_commit 注册，
+    事务或保存点回滚时 Django 会丢弃回调），因此回滚的变更不会被记录。
 
-        # 获取变更的字段名
-        model_name = kwargs.get('model')._meta.model_name
-        color_logger.debug(f"m2m_changed: 当前处理的模型名: {model_name}")
-        color_logger.debug(f"m2m_changed: 当前实例类型: {instance._meta.model_name}")
-        color_logger.debug(f"m2m_changed: 当前动作: {action}")
-        color_logger.debug(f"m2m_changed: 变更的ID集合: {pk_set}")
-        
-        # 遍历实例的所有字段，找到对应的多对多字段
-        field_name = None
-        color_logger.debug(f"m2m_changed: 实例的所有字段: {[field.name for field in instance._meta.fields]}")
-        color_logger.debug(f"m2m_changed: 实例的所有多对多字段: {[field.name for field in instance._meta.many_to_many]}")
-        
-        # 遍历多对多字段而不是所有字段
-        for field in instance._meta.many_to_many:
-            related_model = field.related_model
-            color_logger.debug(f"m2m_changed: 检查字段: {field.name}, 关联模型: {related_model._meta.model_name}")
-            # 检查关联模型是否匹配
-            if related_model._meta.model_name == model_name:
-                field_name = field.name
-                color_logger.debug(f"m2m_changed: 找到匹配的字段: {field_name}")
-                break
-        
-        if not field_name:
-            color_logger.warning(f"未找到对应的多对多字段: {model_name}")
-            color_logger.debug(f"m2m_changed: 当前实例: {instance}")
+    通过反向关系修改（如 user.usergroup_set.add(group)）时 Django 只发送 reverse=True 的信号，
+    此时 instance 是关联模型的实例，pk_set 是多对多字段所在记录的主键，按正向字段逐条记录
+    """
+    try:
+        record_model = model if reverse else type(instance)
+        options = audit_registry.get_options(record_model)
+        field = options.m2m_fields.get(sender) if options else None
+        if field is None:
+            # 中间表同时属于其他审计模型，或该多对多字段不在审计范围内
             return
 
-        field = getattr(instance, field_name)
-        
-        # 获取原始状态
-        original_m2m_state = getattr(instance, '_original_m2m_state', {})
-        original_value = original_m2m_state.get(field_name, set())
-        current_value = set(field.all())
-        
-        color_logger.debug(f"m2m_changed: 原始值: {[serialize_value(item) for item in original_value]}")
-        color_logger.debug(f"m2m_changed: 当前值: {[serialize_value(item) for item in current_value]}")
-        
-        # # 检查是否有实际变化
-        # 在 Django 的多对多关系处理中，当我们修改一个多对多字段时，Django 会先清空所有关系，然后重新添加。
-        # if original_value == current_value:
-        #     color_logger.debug(f"m2m_changed: 字段 {field_name} 没有实际变化，跳过记录")
-        #     return
-
-        # 获取线程本地存储
         changes = get_thread_locals()
-        instance_key = f"{instance._meta.model_name}_{instance.pk}"
-        
-        # 初始化字段的状态记录
-        if instance_key not in changes:
-            changes[instance_key] = {}
-        if field_name not in changes[instance_key]:
-            changes[instance_key][field_name] = {
-                'original': original_value,
-                'states': [],
-                'audit_logs': []  # 记录每个字段创建的 audit log 对象
-            }
-        
-        # 记录当前状态
-        changes[instance_key][field_name]['states'].append({
-            'action': action,
-            'value': current_value
-        })
-        
-        # 在最后一个操作时记录变更
-        if action in ["post_add", "post_clear"]:
-            field_changes = changes[instance_key][field_name]
-            final_value = field_changes['states'][-1]['value']
-            
-            # 记录最终变更
-            changes = {
-                field_name: {
-                    'old': [serialize_value(item) for item in field_changes['original']],
-                    'new': [serialize_value(item) for item in final_value]
+
+        if action.startswith('pre_'):
+            if not reverse:
+                record_pks = [instance.pk]
+            elif action == 'pre_clear':
+                record_pks = load_m2m_record_pks(instance.pk, field, sender)
+            else:
+                record_pks = list(pk_set or ())
+
+            record_pks = [
+                record_pk for record_pk in record_pks
+                if get_m2m_change_key(record_model, record_pk, field) not in changes
+            ]
+            if not record_pks:
+                return
+            username, ip_address = get_operator_info()
+            if not username:
+                return
+            for record_pk in record_pks:
+                # 变更发生前读取一次原始状态
+                original = load_m2m_pk_set(record_pk, field, sender)
+                changes[get_m2m_change_key(record_model, record_pk, field)] = {
+                    'model_name': record_model._meta.model_name,
+                    'record_id': str(record_pk),
+                    'field_name': field.name,
+                    'username': username,
+                    'ip_address': ip_address,
+                    'original': original,
+                    'current': set(original),
                 }
-            }
-            color_logger.debug(f"m2m_changed: 记录最终变更 - 旧值: {changes[field_name]['old']}")
-            color_logger.debug(f"m2m_changed: 记录最终变更 - 新值: {changes[field_name]['new']}")
-            color_logger.info(f"多对多关系变更，开始记录审计日志: {changes}")
-
-            # 创建 audit log 对象
-            audit_log = AuditLog(
-                operator_username=username,
-                model_name=instance._meta.model_name,
-                record_id=str(instance.pk),
-                action='UPDATE',
-                detail=changes,
-                ip_address=ip_address
-            )
-            audit_log.save()
-            
-            # 记录 audit log 对象
-            field_changes['audit_logs'].append(audit_log)
-            
-            # 如果是 post_add，删除所有之前的记录
-            if action == "post_add":
-                for log in field_changes['audit_logs'][:-1]:  # 删除除最后一个之外的所有记录
-                    log.delete()
-                field_changes['audit_logs'] = [field_changes['audit_logs'][-1]]  # 只保留最后一个记录
-            
-                if final_value == original_value:
-                    color_logger.debug(f"m2m_changed: 字段 {field_name} 没有实际变化，删除审计日志")
-                    for log in field_changes['audit_logs']:
-                        log.delete()
-                    field_changes['audit_logs'] = []
-            
-            # 清理线程本地存储
-            try:
-                if instance_key in changes:
-                    if field_name in changes[instance_key]:
-                        del changes[instance_key][field_name]
-                    if not changes[instance_key]:
-                        del changes[instance_key]
-            except Exception as e:
-                color_logger.error(f"清理线程本地存储失败: {str(e)}")
+            return
+
+        if not reverse:
+            change_keys = [get_m2m_change_key(record_model, instance.pk, field)]
+            change_pks = set(pk_set or ())
+        else:
+            if action == 'post_clear':
+                # 清空后中间表中已没有关联记录，从该字段所有的待记录变更中移除 instance
+                # （pre_clear 时已为清空前关联的记录创建了待记录变更）
+                change_keys = [
+                    change_key for change_key, pending_change in changes.items()
+                    if pending_change['model_name'] == record_model._meta.model_name
+                    and pending_change['field_name'] == field.name
+                ]
+                action = 'post_remove'
+            else:
+                change_keys = [get_m2m_change_key(record_model, record_pk, field) for record_pk in pk_set or ()]
+            change_pks = {instance.pk}
+
+        if audit_sink.in_request_scope():
+            transaction.on_commit(lambda: apply_committed_m2m_change(change_keys, action, change_pks))
+            return
+
+        # 不在请求范围内时立即记录，create_audit_log 在当前事务提交后才写入，回滚时同样会被丢弃
+        for change_key in change_keys:
+            pending_change = changes.pop(change_key, None)
+            if pending_change is None:
+                continue
+            apply_m2m_change(pending_change, action, change_pks)
+            emit_m2m_change(pending_change)
 
     except Exception as e:
         color_logger.error(f"审计日志记录失败(外层): {str(e)}")
         color_logger.error(f"错误详情: {str(e.__class__.__name__)}")
         import traceback
-        color_logger.error(f"堆栈跟踪: {traceback.format_exc()}")
\ No newline at end of file
+        color_logger.error(f"堆栈跟踪: {traceback.format_exc()}")
+
+def connect_audit_receivers():
+    """为注册的审计模型连接信号，未注册的模型不连接任何审计接收器"""
+    audit_registry.prepare()
+    for options in audit_registry.get_all_options():
+        model = options.model
+        if model is AuditLog:
+            continue
+        label = model._meta.label_lower
+        pre_save.connect(model_pre_save, sender=model, dispatch_uid=f'audit_pre_save_{label}')
+        post_save.connect(model_post_save, sender=model, dispatch_uid=f'audit_post_save_{label}')
+        pre_delete.connect(model_pre_delete, sender=model, dispatch_uid=f'audit_pre_delete_{label}')
+        for through in options.m2m_fields:
+            m2m_changed.connect(
+                model_m2m_changed, sender=through,
+                dispatch_uid=f'audit_m2m_changed_{through._meta.label_lower}'
+            )
+        color_logger.debug(f"审计模型已注册: {label}, 字段: {[field.name for field in options.fields]}")
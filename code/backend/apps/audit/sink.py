@@ -0,0 +1,335 @@
+import json
+import threading
+import time
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_redis import get_redis_connection
+
+from backend.settings import config_data
+from lib.json_tools import DateTimeEncoder
+from lib.log import color_logger
+from .models import AuditLog, pack_ip
+
+# 审计日志字段，缓冲区和各后端传递的条目都只包含这些字段
+# create_time 为提交条目时的事件时间（ISO 格式字符串，可以直接 json 序列化），写入时保留，不使用入库时间
+AUDIT_LOG_FIELDS = ('operator_username', 'model_name', 'record_id', 'action', 'detail', 'ip_address', 'create_time')
+
+# 持久性级别
+# - best_effort: 后端写入失败时丢弃并记录错误日志
+# - fallback: 后端写入失败时降级为同步写入数据库，尽量不丢失
+DURABILITY_BEST_EFFORT = 'best_effort'
+DURABILITY_FALLBACK = 'fallback'
+
+
+def get_audit_config():
+    return config_data.get('AUDIT', {})
+
+
+def build_audit_log(entry):
+    """根据条目构造 AuditLog 对象（不保存）"""
+    values = {field: entry.get(field) for field in AUDIT_LOG_FIELDS}
+    create_time = values.pop('create_time')
+    if isinstance(create_time, str):
+        create_time = parse_datetime(create_time)
+    # 升级前进入队列的条目没有事件时间
+    audit_log = AuditLog(create_time=create_time or timezone.now(), **values)
+    # bulk_create 不会调用 save，这里同步打包IP
+    audit_log.ip_packed = pack_ip(audit_log.ip_address)
+    return audit_log
+
+
+def bulk_insert_audit_logs(entries):
+    """批量写入审计日志"""
+    if not entries:
+        return
+    AuditLog.objects.bulk_create(
+        [build_audit_log(entry) for entry in entries],
+        batch_size=get_audit_config().get('SINK_BATCH_SIZE', 500)
+    )
+
+
+class SyncAuditBackend:
+    """同步批量写入数据库"""
+    name = 'sync'
+
+    def write(self, entries):
+        bulk_insert_audit_logs(entries)
+
+    def queue_depth(self):
+        return 0
+
+
+class CeleryAuditBackend:
+    """投递到 Celery 任务异步批量写入"""
+    name = 'celery'
+
+    def write(self, entries):
+        from .tasks import write_audit_logs
+        write_audit_logs.delay(entries)
+
+    def queue_depth(self):
+        # 队列长度取决于 broker，这里不统计
+        return None
+
+
+class RedisStreamAuditBackend:
+    """追加到 Redis Stream，由 drain_audit_log_stream 定时任务按批消费写入数据库"""
+    name = 'redis_stream'
+
+    def __init__(self):
+        audit_config = get_audit_config()
+        self.redis_db_name = audit_config.get('STREAM_REDIS_DB', 'default')
+        self.stream_name = audit_config.get('STREAM_NAME', 'audit_log_stream')
+        self.group_name = audit_config.get('STREAM_GROUP', 'audit_log_writer')
+        self.maxlen = audit_config.get('STREAM_MAXLEN', 1000000)
+
+    def write(self, entries):
+        pipe = get_redis_connection(self.redis_db_name).pipeline(transaction=False)
+        for entry in entries:
+            pipe.xadd(
+                self.stream_name,
+                {'data': json.dumps(entry, cls=DateTimeEncoder)},
+                maxlen=self.maxlen,
+                approximate=True
+            )
+        pipe.execute()
+
+    def queue_depth(self):
+        """尚未被消费写入的条目数量（未读取 + 已读取未确认）"""
+        redis_conn = get_redis_connection(self.redis_db_name)
+        try:
+            groups = redis_conn.xinfo_groups(self.stream_name)
+        except Exception:
+            # stream 还不存在
+            return 0
+
+        for group in groups:
+            group_name = group.get('name')
+            group_name = group_name.decode('utf-8') if isinstance(group_name, bytes) else group_name
+            if group_name == self.group_name:
+                lag = group.get('lag')
+                if lag is None:
+                    lag = redis_conn.xlen(self.stream_name)
+                return int(lag or 0) + int(group.get('pending') or 0)
+        return redis_conn.xlen(self.stream_name)
+
+    def _ensure_group(self, redis_conn):
+        try:
+            redis_conn.xgroup_create(self.stream_name, self.group_name, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def drain(self, consumer_name, batch_size=500, max_batches=20, claim_idle_ms=60000):
+        """消费 stream 中的条目并批量写入数据库，写入成功后再确认（至少一次）
+
+        先认领其他消费者超时未确认的条目，再读取新条目
+
+        Returns:
+            写入的条目数量
+        """
+        redis_conn = get_redis_connection(self.redis_db_name)
+        self._ensure_group(redis_conn)
+
+        written = 0
+        claim_start = '0-0'
+        for _ in range(max_batches):
+            messages = []
+            if claim_start is not None:
+                claim_result = redis_conn.xautoclaim(
+                    self.stream_name, self.group_name, consumer_name,
+                    min_idle_time=claim_idle_ms, start_id=claim_start, count=batch_size
+                )
+                next_start, messages = claim_result[0], claim_result[1]
+                claim_start = None if next_start in (b'0-0', '0-0') else next_start
+
+            if not messages:
+                result = redis_conn.xreadgroup(
+                    self.group_name, consumer_name, {self.stream_name: '>'}, count=batch_size
+                )
+                messages = result[0][1] if result else []
+            if not messages:
+                break
+
+            message_ids = [message_id for message_id, _ in messages]
+            entries = []
+            for _, fields in messages:
+                # 认领时已被删除的条目没有内容
+                if not fields:
+                    continue
+                data = fields.get(b'data') or fields.get('data')
+                entries.append(json.loads(data))
+
+            bulk_insert_audit_logs(entries)
+            pipe = redis_conn.pipeline(transaction=False)
+            pipe.xack(self.stream_name, self.group_name, *message_ids)
+            pipe.xdel(self.stream_name, *message_ids)
+            pipe.execute()
+            written += len(entries)
+
+        return written
+
+
+AUDIT_BACKENDS = {
+    backend.name: backend for backend in (SyncAuditBackend, CeleryAuditBackend, RedisStreamAuditBackend)
+}
+
+
+class AuditSink:
+    """审计日志汇聚器
+
+    - 审计条目在事务提交后进入缓冲区（事务回滚则丢弃）
+    - 请求内的条目缓冲到请求结束（由 AuditSinkMiddleware 划定范围）后一次性写入；
+      不在请求范围内（如 celery 任务、管理命令）时提交后立即写入
+    - 缓冲区超过 SINK_BATCH_SIZE 时提前写入
+    - 写入由可替换的后端完成：sync / celery / redis_stream
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._backend = None
+        self._end_hooks = []
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'flush_count': 0,
+            'flushed_entries': 0,
+            'failed_entries': 0,
+            'last_flush_ms': None,
+            'avg_flush_ms': None,
+            'max_flush_ms': None,
+        }
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            backend_name = get_audit_config().get('SINK_BACKEND', SyncAuditBackend.name)
+            backend_class = AUDIT_BACKENDS.get(backend_name)
+            if backend_class is None:
+                color_logger.error(f"未知的审计日志后端: {backend_name}，使用同步写入")
+                backend_class = SyncAuditBackend
+            self._backend = backend_class()
+        return self._backend
+
+    @property
+    def durability(self):
+        return get_audit_config().get('SINK_DURABILITY', DURABILITY_FALLBACK)
+
+    def _get_buffer(self):
+        return getattr(self._local, 'buffer', None)
+
+    def in_request_scope(self):
+        """当前线程是否处于请求缓冲范围内"""
+        return self._get_buffer() is not None
+
+    def register_end_hook(self, hook):
+        """注册请求结束、写入缓冲区之前调用的函数（用于提交请求内汇总的审计条目）"""
+        if hook not in self._end_hooks:
+            self._end_hooks.append(hook)
+
+    def begin(self):
+        """开始缓冲（请求开始时调用）"""
+        self._local.buffer = []
+
+    def end(self):
+        """结束缓冲并写入缓冲区中的条目（请求结束时调用）"""
+        for hook in self._end_hooks:
+            try:
+                hook()
+            except Exception as e:
+                color_logger.error(f"审计日志请求结束回调失败: {e}")
+
+        buffer = self._get_buffer()
+        self._local.buffer = None
+        if buffer:
+            self.flush(buffer)
+
+    def submit(self, **entry):
+        """提交一条审计条目，在当前事务提交后进入缓冲区
+
+        未指定 create_time 时以提交时间作为事件时间，之后无论何时写入数据库都保持不变
+        """
+        entry = {field: entry.get(field) for field in AUDIT_LOG_FIELDS}
+        entry['create_time'] = (entry['create_time'] or timezone.now()).isoformat()
+        transaction.on_commit(lambda: self._enqueue(entry))
+
+    def _enqueue(self, entry):
+        buffer = self._get_buffer()
+        if buffer is None:
+            self.flush([entry])
+            return
+
+        buffer.append(entry)
+        if len(buffer) >= get_audit_config().get('SINK_BATCH_SIZE', 500):
+            self._local.buffer = []
+            self.flush(buffer)
+
+    def flush(self, entries):
+        """将条目交给后端写入，并记录写入耗时"""
+        start = time.monotonic()
+        try:
+            self.backend.write(entries)
+        except Exception as e:
+            color_logger.error(f"审计日志写入失败({self.backend.name}): {e}, 条目数量: {len(entries)}")
+            if self.durability == DURABILITY_FALLBACK and self.backend.name != SyncAuditBackend.name:
+                try:
+                    bulk_insert_audit_logs(entries)
+                except Exception as fallback_error:
+                    color_logger.error(f"审计日志同步降级写入失败: {fallback_error}")
+                    self._record_flush(start, 0, len(entries))
+                    return
+            else:
+                self._record_flush(start, 0, len(entries))
+                return
+
+        self._record_flush(start, len(entries), 0)
+
+    def _record_flush(self, start, flushed, failed):
+        elapsed_ms = (time.monotonic() - start) * 1000
+        with self._stats_lock:
+            stats = self._stats
+            stats['flush_count'] += 1
+            stats['flushed_entries'] += flushed
+            stats['failed_entries'] += failed
+            stats['last_flush_ms'] = round(elapsed_ms, 3)
+            stats['max_flush_ms'] = round(max(stats['max_flush_ms'] or 0, elapsed_ms), 3)
+            # 指数移动平均
+            avg = stats['avg_flush_ms']
+            stats['avg_flush_ms'] = round(elapsed_ms if avg is None else avg * 0.9 + elapsed_ms * 0.1, 3)
+
+        slow_ms = get_audit_config().get('SINK_SLOW_FLUSH_MS', 200)
+        if elapsed_ms >= slow_ms:
+            color_logger.warning(f"审计日志写入较慢: {elapsed_ms:.1f}ms, 条目数量: {flushed + failed}")
+
+    def get_stats(self):
+        """当前进程的写入统计，以及后端队列深度"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        buffer = self._get_buffer()
+        stats['backend'] = self.backend.name
+        stats['durability'] = self.durability
+        stats['buffered_entries'] = len(buffer) if buffer else 0
+        try:
+            stats['queue_depth'] = self.backend.queue_depth()
+        except Exception as e:
+            color_logger.error(f"获取审计日志队列深度失败: {e}")
+            stats['queue_depth'] = None
+        return stats
+
+
+audit_sink = AuditSink()
+
+
+class AuditSinkMiddleware:
+    """以请求为范围缓冲审计条目，请求结束后一次性写入"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        audit_sink.begin()
+        try:
+            return self.get_response(request)
+        finally:
+            audit_sink.end()
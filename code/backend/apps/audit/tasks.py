@@ -0,0 +1,71 @@
+import os
+import socket
+
+from celery import shared_task
+
+from lib.log import color_logger
+from lib.redis_tool import can_get_work_lock, release_work_lock
+from .archive import archive_expired_audit_logs
+from .rollup import rollup_audit_logs as rollup_new_audit_logs
+from .sink import RedisStreamAuditBackend, bulk_insert_audit_logs, get_audit_config
+
+
+@shared_task
+def write_audit_logs(entries):
+    """批量写入审计日志（celery 后端）"""
+    bulk_insert_audit_logs(entries)
+    color_logger.debug(f"批量写入审计日志: {len(entries)} 条")
+
+
+@shared_task
+def drain_audit_log_stream():
+    """消费 Redis Stream 中的审计日志并批量写入数据库（redis_stream 后端）"""
+    audit_config = get_audit_config()
+    if audit_config.get('SINK_BACKEND') != RedisStreamAuditBackend.name:
+        return 0
+
+    # 同一时间只有一个消费者在消费，避免定时任务堆积时重复认领
+    work_flag = 'drain_audit_log_stream'
+    if not can_get_work_lock('default', work_flag, lock_time=audit_config.get('STREAM_DRAIN_LOCK_SECONDS', 60)):
+        return 0
+
+    try:
+        written = RedisStreamAuditBackend().drain(
+            consumer_name=f"{socket.gethostname()}-{os.getpid()}",
+            batch_size=audit_config.get('STREAM_DRAIN_BATCH_SIZE', 500),
+            max_batches=audit_config.get('STREAM_DRAIN_MAX_BATCHES', 20),
+            claim_idle_ms=audit_config.get('STREAM_CLAIM_IDLE_MS', 60000),
+        )
+        if written:
+            color_logger.info(f"消费审计日志stream并写入: {written} 条")
+        return written
+    finally:
+        release_work_lock('default', work_flag)
+
+
+@shared_task
+def archive_audit_logs():
+    """归档过期的审计日志分区，并提前创建未来的分区"""
+    audit_config = get_audit_config()
+    work_flag = 'archive_audit_logs'
+    if not can_get_work_lock('default', work_flag, lock_time=audit_config.get('ARCHIVE_LOCK_SECONDS', 3600)):
+        return {}
+
+    try:
+        return archive_expired_audit_logs()
+    finally:
+        release_work_lock('default', work_flag)
+
+
+@shared_task
+def rollup_audit_logs():
+    """将水位之后的新审计日志累加到小时统计表"""
+    audit_config = get_audit_config()
+    work_flag = 'rollup_audit_logs'
+    if not can_get_work_lock('default', work_flag, lock_time=audit_config.get('ROLLUP_LOCK_SECONDS', 300)):
+        return 0
+
+    try:
+        return rollup_new_audit_logs()
+    finally:
+        release_work_lock('default', work_flag)
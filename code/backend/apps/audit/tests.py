@@ -1,3 +1,161 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from apps.perm.models import Permission
+from lib.json_tools import DateTimeEncoder
+
+from .filters import MATCH_MODE_EXACT, MATCH_MODE_PREFIX, AuditLogFilter
+from .management.commands.explain_audit_log_search import SEARCH_SHAPES, build_search_query, explain_query
+from .models import AuditLog, AuditLogRollup
+from .rollup import get_rollup_watermark, rollup_audit_logs
+from .sink import AuditSink, audit_sink, build_audit_log, bulk_insert_audit_logs
 
 # Create your tests here.
+
+
+class QueuedAuditBackend:
+    """只把条目放入队列的后端，由测试模拟 worker 积压后再写入"""
+    name = 'queued'
+
+    def __init__(self):
+        self.queue = []
+
+    def write(self, entries):
+        self.queue.extend(entries)
+
+
+class AuditSinkCreateTimeTest(TestCase):
+    """异步后端延迟写入时保留提交条目时的事件时间"""
+
+    def test_delayed_write_keeps_event_time(self):
+        event_time = timezone.now() - timedelta(hours=3)
+        sink = AuditSink()
+        sink._backend = QueuedAuditBackend()
+
+        with mock.patch('apps.audit.sink.timezone.now', return_value=event_time):
+            with self.captureOnCommitCallbacks(execute=True):
+                sink.submit(
+                    operator_username='admin', model_name='user', record_id='1',
+                    action='UPDATE', detail={}, ip_address='10.0.0.1'
+                )
+
+        # 经过 celery / redis stream 的 json 序列化，3小时后才被消费写入
+        entries = json.loads(json.dumps(sink._backend.queue, cls=DateTimeEncoder))
+        bulk_insert_audit_logs(entries)
+
+        audit_log = AuditLog.objects.get()
+        self.assertEqual(audit_log.create_time, event_time)
+        self.assertEqual(audit_log.operator_username, 'admin')
+
+
+class AuditJSONFieldChangeTest(TestCase):
+    """原地修改 JSONField 后保存，审计日志能记录到变更"""
+
+    def save_and_get_detail(self, instance):
+        with mock.patch('apps.audit.signals.get_operator_info', return_value=('admin', '127.0.0.1')), \
+                mock.patch.object(audit_sink, 'submit') as submit:
+            instance.save()
+        self.assertEqual(submit.call_count, 1)
+        return submit.call_args.kwargs['detail']
+
+    def test_in_place_json_change(self):
+        Permission.objects.create(name='权限', code='perm', permission_json={'menu': ['user']})
+        permission = Permission.objects.get(code='perm')
+
+        permission.permission_json['menu'].append('role')
+        detail = self.save_and_get_detail(permission)
+        self.assertEqual(detail['permission_json'], {
+            'old': {'menu': ['user']},
+            'new': {'menu': ['user', 'role']},
+        })
+
+        # 保存后刷新的快照同样不受之后原地修改的影响
+        permission.permission_json['api'] = ['audit']
+        detail = self.save_and_get_detail(permission)
+        self.assertEqual(detail['permission_json'], {
+            'old': {'menu': ['user', 'role']},
+            'new': {'menu': ['user', 'role'], 'api': ['audit']},
+        })
+
+
+class AuditLogFilterMatchModeTest(TestCase):
+    """前缀匹配时数据库查询与归档记录匹配的结果一致（都不区分大小写）"""
+
+    def test_prefix_ignores_case(self):
+        entries = [
+            {'operator_username': username, 'model_name': 'user', 'record_id': '1', 'action': 'UPDATE',
+             'detail': {}, 'ip_address': '10.0.0.1'}
+            for username in ('Admin', 'admin_ops', 'operator')
+        ]
+        bulk_insert_audit_logs(entries)
+        archived_rows = [
+            {**entry, 'create_time': timezone.now(), 'is_del': False} for entry in entries
+        ]
+
+        audit_log_filter = AuditLogFilter({'operator': 'ADM', 'match_mode': MATCH_MODE_PREFIX})
+        live = set(audit_log_filter.apply(AuditLog.objects.all()).values_list('operator_username', flat=True))
+        archived = {row['operator_username'] for row in archived_rows if audit_log_filter.match(row)}
+        self.assertEqual(live, {'Admin', 'admin_ops'})
+        self.assertEqual(archived, live)
+
+
+class AuditLogRollupTest(TestCase):
+    """按水位增量统计，重复执行不会重复计数"""
+
+    def test_rollup_twice_counts_once(self):
+        event_time = timezone.now() - timedelta(hours=2)
+        bulk_insert_audit_logs([
+            {'operator_username': 'admin', 'model_name': 'user', 'record_id': str(i), 'action': 'UPDATE',
+             'detail': {}, 'ip_address': '10.0.0.1', 'create_time': event_time}
+            for i in range(3)
+        ])
+
+        self.assertEqual(rollup_audit_logs(), 3)
+        self.assertEqual(rollup_audit_logs(), 0)
+        self.assertEqual(AuditLogRollup.objects.get().count, 3)
+        self.assertGreaterEqual(get_rollup_watermark(), event_time)
+
+
+# 数据量过小时优化器会选择全表扫描，需要足够多且分散的记录
+AUDIT_LOG_ROWS = 5000
+
+
+@skipUnless(connection.vendor == 'mysql', '执行计划只在 MySQL 上校验')
+class AuditLogSearchIndexTest(TransactionTestCase):
+    """精确匹配和前缀匹配的典型筛选条件使用对应的组合索引
+
+    ANALYZE TABLE 会隐式提交事务，因此使用 TransactionTestCase
+    """
+
+    def setUp(self):
+        actions = [action for action, _ in AuditLog.ACTION_CHOICES]
+        AuditLog.objects.bulk_create([
+            build_audit_log({
+                'operator_username': 'admin' if i % 500 == 0 else f'operator_{i % 200}',
+                'model_name': 'user' if i % 500 == 0 else f'model_{i % 50}',
+                'record_id': str(i % 1000),
+                'action': actions[i % len(actions)],
+                'detail': {},
+                'ip_address': f'192.168.{i % 256}.{i % 200 + 1}',
+            })
+            for i in range(AUDIT_LOG_ROWS)
+        ], batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE TABLE {connection.ops.quote_name(AuditLog._meta.db_table)}')
+
+    def test_exact_and_prefix_shapes_use_index(self):
+        shapes = [
+            shape for shape in SEARCH_SHAPES
+            if shape[1].get('match_mode') in (MATCH_MODE_EXACT, MATCH_MODE_PREFIX)
+        ]
+        self.assertTrue(shapes)
+
+        for title, body, index_name in shapes:
+            with self.subTest(title):
+                plan, used_keys = explain_query(build_search_query(body))
+                self.assertIn(index_name, used_keys, plan)
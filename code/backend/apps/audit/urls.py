@@ -3,5 +3,8 @@ from . import views
 
 urlpatterns = [
     path('audit-logs/', views.get_audit_logs, name='get_audit_logs'),
+    path('export/', views.export_audit_logs, name='export_audit_logs'),
     path('config/', views.get_audit_config, name='get_audit_config'),
+    path('stats/', views.get_audit_stats, name='get_audit_stats'),
+    path('sink-stats/', views.get_audit_sink_stats, name='get_audit_sink_stats'),
 ] 
\ No newline at end of file
@@ -1,10 +1,19 @@
+from datetime import timedelta
+
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
-from django.db.models import Q
 from lib.request_tool import pub_success_response, pub_error_response, pub_get_request_body
 from lib.log import color_logger
-from lib.paginator_tool import pub_paging_tool
+from lib.paginator_tool import COUNT_MODE_ESTIMATE, COUNT_MODE_EXACT, COUNT_MODE_NONE, estimate_count, pub_paging_response_data
+from .archive import (
+    count_archived_audit_logs, format_archived_audit_log, get_live_window_start, page_archived_audit_logs,
+)
+from .export import AuditLogExporter, EXPORT_FORMAT_CSV, iter_export_rows
+from .filters import AuditLogFilter, parse_filter_datetime
 from .models import AuditLog
-from lib.time_tools import utc_obj_to_time_zone_str
+from .rollup import STATS_INTERVAL_HOUR, get_rollup_watermark, query_audit_stats
+from .sink import audit_sink
+from lib.time_tools import get_now_time_utc_obj, utc_obj_to_time_zone_str
 
 def get_audit_config(request):
     """获取审计配置信息，包括操作类型等"""
@@ -60,72 +69,153 @@ def get_audit_logs(request):
         body = pub_get_request_body(request)
         
         # 构建查询条件
-        query = AuditLog.objects.all()
-        
-        # 操作人筛选
-        if operator := body.get('operator'):
-            query = query.filter(operator_username__icontains=operator)
-            
-        # 模型名称筛选
-        if model_name := body.get('model_name'):
-            query = query.filter(model_name__icontains=model_name)
-            
-        # 操作类型筛选
-        if action := body.get('action'):
-            # 支持多选操作类型，以逗号分隔
-            if ',' in action:
-                action_list = [item.strip() for item in action.split(',')]
-                query = query.filter(action__in=action_list)
-            else:
-                query = query.filter(action=action)
-            
-        # IP地址筛选
-        if ip_address := body.get('ip_address'):
-            query = query.filter(ip_address__icontains=ip_address)
-            
-        # 时间范围筛选
-        if start_date := body.get('start_date'):
-            query = query.filter(create_time__gte=start_date)
-        if end_date := body.get('end_date'):
-            query = query.filter(create_time__lte=end_date)
-            
-        # 关键词搜索(搜索操作人和记录ID)
-        if keyword := body.get('keyword'):
-            query = query.filter(
-                Q(operator_username__icontains=keyword) |
-                Q(record_id__icontains=keyword)
-            )
-            
-        # 分页处理
-        page = int(body.get('page', 1))
-        page_size = int(body.get('page_size', 20))
-        
-        has_next, next_page, page_list, total, records = pub_paging_tool(
-            page, query.order_by('-create_time'), page_size
-        )
+        audit_log_filter = AuditLogFilter(body)
+        query = audit_log_filter.apply(AuditLog.objects.all()).order_by('-create_time', '-uuid')
+
+        # 开始时间早于数据库保留范围时，同时查询归档文件
+        if is_archive_range(audit_log_filter):
+            return pub_success_response(get_audit_logs_with_archive(body, query, audit_log_filter))
+
+        # 分页处理（请求带 cursor 参数时使用游标分页，按 create_time, uuid 倒序）
+        page_info, records = pub_paging_response_data(body, query)
         
         # 构建返回数据
-        result = []
-        for record in records:
-            result.append({
-                'uuid': record.uuid,
-                'operator_username': record.operator_username,
-                'model_name': record.model_name,
-                'record_id': record.record_id,
-                'action': record.action,
-                'action_display': record.get_action_display(),
-                'detail': record.detail,
-                'ip_address': record.ip_address,
-                'create_time': utc_obj_to_time_zone_str(record.create_time)
-            })
+        result = [format_audit_log_data(record) for record in records]
         
-        return pub_success_response({
-            'data': result,
-            'total': total,
-            'has_next': has_next,
-            'next_page': next_page
-        })
+        page_info['total'] = page_info.pop('all_num')
+        return pub_success_response({**page_info, 'data': result})
         
     except Exception as e:
         color_logger.error(f"获取审计日志失败: {str(e)}")
         return pub_error_response(14002, msg=str(e))
+
+
+def is_archive_range(audit_log_filter):
+    """筛选的开始时间是否早于数据库保留范围（需要读取归档文件）"""
+    live_window_start = get_live_window_start()
+    return bool(audit_log_filter.start_time and live_window_start and audit_log_filter.start_time < live_window_start)
+
+
+def export_audit_logs(request):
+    """导出审计日志，筛选条件与审计日志列表相同
+
+    format 参数指定导出格式 csv（默认）/ ndjson / xlsx，以流式响应分批读取输出
+    """
+    try:
+        if request.method != 'GET':
+            return pub_error_response(14007, msg="只允许GET请求")
+
+        body = pub_get_request_body(request)
+        exporter = AuditLogExporter(body.get('format') or EXPORT_FORMAT_CSV)
+
+        audit_log_filter = AuditLogFilter(body)
+        query = audit_log_filter.apply(AuditLog.objects.all())
+        rows = iter_export_rows(query, audit_log_filter if is_archive_range(audit_log_filter) else None)
+
+        response = StreamingHttpResponse(exporter.stream(rows), content_type=exporter.content_type)
+        file_name = f"audit_log_{utc_obj_to_time_zone_str(get_now_time_utc_obj(), '%Y%m%d%H%M%S')}.{exporter.file_extension}"
+        response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+        return response
+    except Exception as e:
+        color_logger.error(f"导出审计日志失败: {str(e)}")
+        return pub_error_response(14008, msg=f"导出审计日志失败: {str(e)}")
+
+
+def format_audit_log_data(record):
+    return {
+        'uuid': record.uuid,
+        'operator_username': record.operator_username,
+        'model_name': record.model_name,
+        'record_id': record.record_id,
+        'action': record.action,
+        'action_display': record.get_action_display(),
+        'detail': record.detail,
+        'ip_address': record.ip_address,
+        'create_time': utc_obj_to_time_zone_str(record.create_time)
+    }
+
+
+def get_audit_logs_with_archive(body, query, audit_log_filter):
+    """数据库记录和归档记录合并分页
+
+    数据库中的记录都晚于归档记录，按时间倒序时先取数据库记录，不足一页时再从归档文件流式读取，
+    读取到当前页之后的一条记录即停止；归档查询只支持页码分页。
+    总数按 count_mode 统计（默认 estimate，归档部分按归档索引估算），none 时不统计
+    """
+    page = max(int(body.get('page', 1)), 1)
+    page_size = int(body.get('page_size', 20))
+    start = (page - 1) * page_size
+    count_mode = body.get('count_mode', COUNT_MODE_ESTIMATE)
+
+    # 多取一条判断是否有下一页
+    records = list(query[start:start + page_size + 1])
+    has_next = len(records) > page_size
+    records = records[:page_size]
+    result = [format_audit_log_data(record) for record in records]
+
+    live_total = None
+    if not has_next:
+        # 当前页已到数据库记录末尾，只有整页都在归档中时才需要统计数据库记录数量
+        live_total = start + len(records) if records or start == 0 else query.count()
+        has_next, archived_rows = page_archived_audit_logs(
+            audit_log_filter, offset=max(start - live_total, 0), limit=page_size - len(records))
+        result.extend(format_archived_audit_log(row) for row in archived_rows)
+
+    total = None
+    if count_mode != COUNT_MODE_NONE:
+        if live_total is None:
+            live_total = query.count() if count_mode == COUNT_MODE_EXACT else estimate_count(query)
+        total = live_total + count_archived_audit_logs(audit_log_filter, count_mode)
+
+    return {
+        'has_next': has_next,
+        'next_page': page + 1 if has_next else 1,
+        'total': total,
+        'data': result,
+    }
+
+
+def get_audit_stats(request):
+    """审计日志统计时间序列（只读取小时统计表）
+
+    参数：start_date / end_date（默认最近24小时），interval（hour/day），
+    group_by（action/model_name/operator_username），action（逗号分隔）、model_name、operator 精确筛选
+    """
+    try:
+        if request.method != 'GET':
+            return pub_error_response(14009, msg="只允许GET请求")
+
+        body = pub_get_request_body(request)
+        end_time = parse_filter_datetime(body.get('end_date')) or get_now_time_utc_obj()
+        start_time = parse_filter_datetime(body.get('start_date')) or end_time - timedelta(hours=24)
+        action = body.get('action')
+
+        series = query_audit_stats(
+            start_time,
+            end_time,
+            interval=body.get('interval') or STATS_INTERVAL_HOUR,
+            group_by=body.get('group_by') or None,
+            actions=[item.strip() for item in action.split(',')] if action else None,
+            model_name=body.get('model_name'),
+            operator_username=body.get('operator'),
+        )
+        return pub_success_response({
+            'series': series,
+            # 统计包含 create_time 不晚于该时间的审计日志
+            'watermark': utc_obj_to_time_zone_str(get_rollup_watermark()),
+        })
+    except Exception as e:
+        color_logger.error(f"获取审计日志统计失败: {str(e)}")
+        return pub_error_response(14010, msg=f"获取审计日志统计失败: {str(e)}")
+
+
+def get_audit_sink_stats(request):
+    """获取审计日志写入统计（当前进程的写入耗时，以及后端队列深度）"""
+    try:
+        if request.method != 'GET':
+            return pub_error_response(14005, msg="只允许GET请求")
+
+        return pub_success_response(audit_sink.get_stats())
+    except Exception as e:
+        color_logger.error(f"获取审计日志写入统计失败: {str(e)}")
+        return pub_error_response(14006, msg=f"获取审计日志写入统计失败: {str(e)}")
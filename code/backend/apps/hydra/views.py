@@ -6,7 +6,7 @@ from apps.user.models import User
 from apps.myAuth.token_utils import TokenManager
 from apps.perm.utils import get_user_perm_json_all
 from apps.ldapauth.ldap_utils import LdapAuthBackend
-from apps.ldapauth.models import LdapConfig
+from apps.ldapauth.utils import get_enabled_ldap_config
 from apps.audit.utils import add_audit_log
 from lib.log import color_logger
 from backend.settings import config_data
@@ -64,7 +64,7 @@ def hydra_login(request):
             user_obj = None
 
             # Check LDAP configuration
-            ldap_config = LdapConfig.objects.filter(enabled=True).first()
+            ldap_config = get_enabled_ldap_config()
 
             if ldap_config:
                 # First check if user exists locally
@@ -5,3 +5,6 @@ class LdapauthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.ldapauth'
     verbose_name = 'LDAP认证管理'
+
+    def ready(self):
+        from . import signals
@@ -1,6 +1,7 @@
 from django.conf import settings
 from lib.log import color_logger
 from apps.ldapauth.models import LdapConfig
+from apps.ldapauth.utils import get_enabled_ldap_config
 from apps.user.models import User
 from lib.ad_ldap_tool import ADLDAPClient
 from lib.openldap_tool import LDAPBackend
@@ -15,7 +16,7 @@ class LdapAuthBackend:
         """
         try:
             # 获取LDAP配置
-            ldap_config = LdapConfig.objects.filter(enabled=True).first()
+            ldap_config = get_enabled_ldap_config()
             if not ldap_config:
                 color_logger.debug("LDAP未启用或未配置")
                 return None
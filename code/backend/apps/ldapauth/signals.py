@@ -0,0 +1,30 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from lib.log import color_logger
+from .models import LdapConfig, SecurityConfig
+from .utils import ldap_config_cache, security_config_cache
+
+# 模型 -> 需要失效的两级缓存
+CONFIG_CACHES = {
+    LdapConfig: ldap_config_cache,
+    SecurityConfig: security_config_cache,
+}
+
+
+def _on_config_changed(sender, **kwargs):
+    cache = CONFIG_CACHES[sender]
+
+    def _invalidate():
+        try:
+            cache.invalidate()
+        except Exception as e:
+            color_logger.error(f"失效配置缓存失败: {cache.namespace}, {e}")
+
+    # 提交后再失效，避免提交前有请求读取到旧数据并重新写入缓存
+    transaction.on_commit(_invalidate)
+
+
+for _model in CONFIG_CACHES:
+    post_save.connect(_on_config_changed, sender=_model, dispatch_uid=f'config_cache_{_model.__name__}_saved')
+    post_delete.connect(_on_config_changed, sender=_model, dispatch_uid=f'config_cache_{_model.__name__}_deleted')
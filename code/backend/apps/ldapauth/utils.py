@@ -0,0 +1,65 @@
+from backend.settings import config_data
+from lib.two_tier_cache import TwoTierCache
+from .models import LdapConfig, SecurityConfig
+
+# 配置变更时由 apps/ldapauth/signals.py 主动失效
+ldap_config_cache = TwoTierCache(
+    namespace='ldap_config',
+    ttl=config_data.get('TWO_TIER_CACHE', {}).get('CONFIG_TTL', 300),
+)
+security_config_cache = TwoTierCache(
+    namespace='security_config',
+    ttl=config_data.get('TWO_TIER_CACHE', {}).get('CONFIG_TTL', 300),
+)
+
+LDAP_CONFIG_CACHE_KEY = 'enabled'
+SECURITY_CONFIG_CACHE_KEY = 'default'
+
+# 未配置安全配置时的默认值
+DEFAULT_SECURITY_CONFIG = {
+    'max_login_attempts': 5,
+    'lockout_duration': 60,
+}
+
+
+def _load_enabled_ldap_config(key):
+    """启用的LDAP配置的字段值，未启用时返回空字典（同样缓存）"""
+    ldap_config = LdapConfig.objects.filter(enabled=True).first()
+    if not ldap_config:
+        return {}
+
+    values = {
+        field.attname: field.value_from_object(ldap_config)
+        for field in LdapConfig._meta.concrete_fields
+        if field.attname not in ('create_time', 'update_time')
+    }
+    values['uuid'] = str(values['uuid'])
+    return values
+
+
+def get_enabled_ldap_config():
+    """获取启用的LDAP配置（两级缓存），未启用时返回 None
+
+    返回的对象由缓存的字段值构造，只用于读取，不要保存
+    """
+    values = ldap_config_cache.get(LDAP_CONFIG_CACHE_KEY, loader=_load_enabled_ldap_config)
+    return LdapConfig(**values) if values else None
+
+
+def _load_security_config(key):
+    security_config = SecurityConfig.objects.first()
+    if not security_config:
+        return dict(DEFAULT_SECURITY_CONFIG)
+    return {
+        'max_login_attempts': security_config.max_login_attempts,
+        'lockout_duration': security_config.lockout_duration,
+    }
+
+
+def get_security_config():
+    """获取安全配置（两级缓存），未配置时返回默认值
+
+    Returns:
+        {'max_login_attempts': 最大登录尝试次数, 'lockout_duration': 锁定持续时间(分钟)}
+    """
+    return security_config_cache.get(SECURITY_CONFIG_CACHE_KEY, loader=_load_security_config)
@@ -3,6 +3,7 @@ from lib.request_tool import pub_success_response, pub_error_response, pub_get_r
 from lib.log import color_logger
 from .models import LdapConfig, SecurityConfig
 from .ldap_utils import LdapUtils
+from .utils import get_security_config
 from lib.redis_tool import get_redis_value, set_redis_value
 from datetime import datetime, timedelta
 
@@ -173,9 +174,9 @@ def record_user_login_failed(user_name):
         current_login_failed_num = 1
 
     # 获取安全配置
-    security_config = SecurityConfig.objects.first()
-    max_attempts = security_config.max_login_attempts if security_config else 5
-    lockout_duration = security_config.lockout_duration if security_config else 60  # 分钟
+    security_config = get_security_config()
+    max_attempts = security_config['max_login_attempts']
+    lockout_duration = security_config['lockout_duration']  # 分钟
 
     # 设置过期时间（锁定时长的分钟数）
     expire_time = lockout_duration * 60  # 转换为秒
@@ -191,8 +192,8 @@ def record_user_login_failed(user_name):
 def get_user_is_lock(user_name):
     """检查用户是否被锁定"""
     # 获取安全配置
-    security_config = SecurityConfig.objects.first()
-    max_attempts = security_config.max_login_attempts if security_config else 5
+    security_config = get_security_config()
+    max_attempts = security_config['max_login_attempts']
 
     redis_key_name = f"user_login_frequency_{user_name}"
 
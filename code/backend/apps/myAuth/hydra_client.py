@@ -0,0 +1,246 @@
+import hashlib
+import os
+import threading
+import time
+
+import jwt
+import requests
+from requests.adapters import HTTPAdapter
+
+from backend.settings import config_data
+from lib.cache_tool import LRUCache, SingleFlight
+from lib.log import color_logger
+
+# 缓存中表示"token无效"的标记，与"未缓存"区分
+_INACTIVE = object()
+_MISSING = object()
+
+
+class HydraIntrospectionClient:
+    """Hydra token introspection 客户端
+
+    - 使用带连接池的 requests.Session 复用与 Hydra 的连接
+    - 有效结果缓存到 min(exp, INTROSPECT_CACHE_TTL)，无效结果缓存较短时间，抵御无效token洪峰
+    - 同一token的并发校验只会发起一次 introspection 请求
+    """
+
+    def __init__(self):
+        hydra_config = config_data.get('HYDRA', {})
+        self.admin_url = hydra_config.get('ADMIN_URL', 'http://hydra:4445').rstrip('/')
+        self.timeout = hydra_config.get('INTROSPECT_TIMEOUT', 3)
+        self.cache_ttl = hydra_config.get('INTROSPECT_CACHE_TTL', 60)
+        self.negative_cache_ttl = hydra_config.get('INTROSPECT_NEGATIVE_CACHE_TTL', 5)
+
+        # 从配置获取Hydra管理凭据，如果未配置则不使用认证
+        hydra_client_id = hydra_config.get('CLIENT_ID', 'admin')
+        hydra_client_secret = hydra_config.get('CLIENT_SECRET', '')
+        self.auth = (hydra_client_id, hydra_client_secret) if hydra_client_id and hydra_client_secret else None
+
+        pool_size = hydra_config.get('POOL_SIZE', 10)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._cache = LRUCache(maxsize=hydra_config.get('INTROSPECT_CACHE_MAX_SIZE', 10000))
+        self._single_flight = SingleFlight()
+
+    def introspect(self, token):
+        """校验token，有效时返回用户信息，否则返回None"""
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+        cached = self._cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            return None if cached is _INACTIVE else cached
+
+        return self._single_flight.do(key, self._introspect_and_cache, token, key)
+
+    def _introspect_and_cache(self, token, key):
+        try:
+            # 调用Hydra的introspection端点验证token
+            response = self.session.post(
+                f"{self.admin_url}/admin/oauth2/introspect",
+                data={"token": token},
+                auth=self.auth,  # 可选的认证，取决于Hydra配置
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            # 网络异常不缓存，下次请求重新校验
+            color_logger.error(f"Error verifying OAuth2 token with Hydra: {e}")
+            return None
+
+        if response.status_code != 200:
+            color_logger.error(f"Hydra introspection failed: Status {response.status_code}")
+            return None
+
+        token_info = response.json()
+        if not token_info.get("active"):
+            self._cache.set(key, _INACTIVE, ttl=self.negative_cache_ttl)
+            return None
+
+        # Token有效，返回用户信息
+        payload = {
+            'username': token_info.get('sub'),  # OAuth2中的subject通常对应username
+            'scope': token_info.get('scope', '').split(),
+            'client_id': token_info.get('client_id'),
+            'exp': token_info.get('exp'),
+            'iat': token_info.get('iat')
+        }
+
+        expire_at = time.time() + self.cache_ttl
+        if payload['exp']:
+            expire_at = min(expire_at, payload['exp'])
+        self._cache.set(key, payload, expire_at=expire_at)
+        return payload
+
+
+class JWKSKeyNotFound(Exception):
+    """JWKS中找不到token对应的公钥（或JWKS暂不可用）"""
+
+
+class HydraJWKSVerifier:
+    """使用 Hydra 公开的 JWKS 在本地校验 JWT 格式的 access token
+
+    - JWKS 缓存在进程内，由后台线程定期刷新
+    - 遇到未知的 kid（密钥轮换）时立即刷新一次，刷新频率受 JWKS_MIN_REFRESH_INTERVAL 限制
+    - 校验签名、过期时间、issuer、audience 以及必需的 scope
+    """
+
+    def __init__(self):
+        hydra_config = config_data.get('HYDRA', {})
+        public_url = hydra_config.get('PUBLIC_URL', 'http://hydra:4444').rstrip('/')
+        self.jwks_url = hydra_config.get('JWKS_URL') or f"{public_url}/.well-known/jwks.json"
+        self.issuer = hydra_config.get('ISSUER')
+        self.audience = hydra_config.get('AUDIENCE')
+        self.required_scopes = hydra_config.get('REQUIRED_SCOPES', [])
+        self.algorithms = hydra_config.get('JWT_ALGORITHMS', ['RS256'])
+        self.leeway = hydra_config.get('JWT_LEEWAY', 0)
+        self.timeout = hydra_config.get('INTROSPECT_TIMEOUT', 3)
+        self.refresh_interval = hydra_config.get('JWKS_REFRESH_INTERVAL', 600)
+        self.min_refresh_interval = hydra_config.get('JWKS_MIN_REFRESH_INTERVAL', 30)
+
+        self.session = requests.Session()
+        self._keys = {}
+        self._last_refresh = 0
+        self._single_flight = SingleFlight()
+        self._refresh_thread = None
+
+    def refresh(self):
+        """拉取 JWKS 并替换本地公钥，失败时保留原有公钥"""
+        return self._single_flight.do('jwks', self._refresh)
+
+    def _refresh(self):
+        self._last_refresh = time.time()
+        try:
+            response = self.session.get(self.jwks_url, timeout=self.timeout)
+            response.raise_for_status()
+            jwk_set = jwt.PyJWKSet.from_dict(response.json())
+        except Exception as e:
+            color_logger.error(f"Failed to fetch JWKS from Hydra: {e}")
+            return False
+
+        self._keys = {key.key_id: key for key in jwk_set.keys}
+        color_logger.debug(f"Hydra JWKS refreshed, kids: {list(self._keys)}")
+        return True
+
+    def _ensure_refresh_thread(self):
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        def _loop():
+            while True:
+                time.sleep(self.refresh_interval)
+                self.refresh()
+
+        self._refresh_thread = threading.Thread(target=_loop, name='hydra-jwks-refresh', daemon=True)
+        self._refresh_thread.start()
+
+    def _get_key(self, kid):
+        self._ensure_refresh_thread()
+
+        key = self._keys.get(kid)
+        if key is None and time.time() - self._last_refresh >= self.min_refresh_interval:
+            # 未知kid，可能发生了密钥轮换
+            self.refresh()
+            key = self._keys.get(kid)
+
+        if key is None:
+            raise JWKSKeyNotFound(f"JWKS key not found: {kid}")
+        return key
+
+    def verify(self, token):
+        """校验token，有效时返回用户信息，否则返回None
+
+        找不到对应公钥时抛出 JWKSKeyNotFound，由调用方决定是否回退到 introspection
+        """
+        header = jwt.get_unverified_header(token)
+        key = self._get_key(header.get('kid'))
+
+        try:
+            claims = jwt.decode(
+                token,
+                key.key,
+                algorithms=self.algorithms,
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.leeway,
+                options={
+                    'verify_aud': bool(self.audience),
+                    'verify_iss': bool(self.issuer),
+                    'require': ['exp', 'sub'],
+                }
+            )
+        except jwt.InvalidTokenError as e:
+            color_logger.debug(f"Invalid Hydra JWT access token: {e}")
+            return None
+
+        # Hydra 的 JWT access token 使用 scp 数组保存 scope
+        scopes = claims.get('scp')
+        if scopes is None:
+            scopes = claims.get('scope', '').split()
+
+        missing_scopes = set(self.required_scopes) - set(scopes)
+        if missing_scopes:
+            color_logger.debug(f"Hydra JWT access token missing scopes: {missing_scopes}")
+            return None
+
+        return {
+            'username': claims.get('sub'),
+            'scope': scopes,
+            'client_id': claims.get('client_id'),
+            'exp': claims.get('exp'),
+            'iat': claims.get('iat')
+        }
+
+
+def is_hydra_jwks_enabled():
+    """是否使用 JWKS 在本地校验 Hydra 签发的 JWT access token"""
+    return config_data.get('HYDRA', {}).get('TOKEN_VERIFY_STRATEGY', 'introspect') == 'jwks'
+
+
+_client_lock = threading.Lock()
+_clients = {}
+
+
+def _get_process_client(client_class):
+    """获取当前进程的客户端单例（fork 后重新创建，避免共享连接和后台线程）"""
+    key = (client_class, os.getpid())
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _client_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = client_class()
+    return client
+
+
+def get_hydra_introspection_client():
+    """获取当前进程的 Hydra introspection 客户端"""
+    return _get_process_client(HydraIntrospectionClient)
+
+
+def get_hydra_jwks_verifier():
+    """获取当前进程的 Hydra JWKS 校验器"""
+    return _get_process_client(HydraJWKSVerifier)
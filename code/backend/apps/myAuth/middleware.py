@@ -1,21 +1,33 @@
 import re
 from apps.myAuth.token_utils import TokenManager
 from apps.perm.utils import check_user_api_permission
-from lib.request_tool import get_authorization_token, pub_error_response, set_current_request
+from lib.request_tool import get_authorization_token, get_client_ip, pub_error_response, set_current_request
+from lib.auth_context import AuthContext, get_auth_context, set_auth_context, reset_auth_context
 from backend.settings import config_data
+from lib.route_matcher import RouteMatcher
 from lib.log import color_logger
 
 
 class AuthMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        # 白名单在启动时编译一次，支持 "*"、"{param}" 通配
+        self.white_list_matcher = RouteMatcher(config_data.get('MIDDLEWARE_WHITE_LIST', []))
 
     def __call__(self, request):
         set_current_request(request)
-        response = self.process_request(request)
-        if response:
-            return response
-        return self.get_response(request)
+        # 认证上下文在请求范围内有效，token 校验后写入 payload 供下游复用
+        context_token = set_auth_context(AuthContext(
+            access_token=get_authorization_token(request),
+            ip_address=get_client_ip(request),
+        ))
+        try:
+            response = self.process_request(request)
+            if response:
+                return response
+            return self.get_response(request)
+        finally:
+            reset_auth_context(context_token)
 
     def process_request(self, request):
         """处理请求"""
@@ -31,7 +43,7 @@ class AuthMiddleware:
             
             # 如果是公开路径，直接放行
             current_path_prefix = current_path.split('?')[0]
-            if current_path_prefix in config_data.get('MIDDLEWARE_WHITE_LIST', []):
+            if self.white_list_matcher.matches(current_path_prefix):
                 color_logger.debug(f'白名单，跳过中间件校验token：{current_path}')
                 return None
 
@@ -51,7 +63,7 @@ class AuthMiddleware:
                     
                 # 验证token
                 token_manager = TokenManager()
-                payload = token_manager.verify_token(access_token)
+                payload = token_manager.verify_token_with_cache(access_token)
                 if not payload:
                     return pub_error_response(99999, msg='access_token校验失败')
                 
@@ -61,10 +73,9 @@ class AuthMiddleware:
                 color_logger.debug(f'中间件校验token成功：{current_path}, {current_method}')
                 
                 # 检查权限 - 对于OAuth2 token，需要特别处理
-                token_payload = token_manager.verify_token(access_token)
-                if token_payload and 'client_id' in token_payload:
+                if 'client_id' in payload:
                     # 这是OAuth2 token，检查scope权限
-                    client_scopes = token_payload.get('scope', [])
+                    client_scopes = payload.get('scope', [])
                     # 对于OAuth2 token，可以有额外的scope检查逻辑
                     # 这里我们仍然使用现有的权限系统进行检查
                     check_res = check_user_api_permission(
@@ -82,6 +93,8 @@ class AuthMiddleware:
 
                 # 将用户名和用户类型设置到request中
                 request.user_name = user_name
+                request.session_id = payload.get('session_id')
+                get_auth_context().set_payload(payload)
 
                 return None
             except Exception as e:
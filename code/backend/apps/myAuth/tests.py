@@ -1,3 +1,209 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+from django.test import SimpleTestCase
+
+from backend.settings import config_data
+from . import hydra_client
+from .hydra_client import HydraJWKSVerifier, JWKSKeyNotFound
+from .token_utils import TokenManager
 
 # Create your tests here.
+
+ISSUER = 'http://hydra.test/'
+AUDIENCE = 'initial_django_vue'
+REQUIRED_SCOPE = 'openid'
+OPAQUE_TOKEN = 'ory_at_opaque_token'
+
+
+class SigningKey:
+    """本地生成的 RSA 密钥，用于签发测试 token 并提供对应的 JWK"""
+
+    def __init__(self, kid):
+        self.kid = kid
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    @property
+    def jwk(self):
+        jwk = json.loads(RSAAlgorithm.to_jwk(self.private_key.public_key()))
+        jwk.update({'kid': self.kid, 'alg': 'RS256', 'use': 'sig'})
+        return jwk
+
+    def sign(self, **claims):
+        now = int(time.time())
+        payload = {
+            'iss': ISSUER,
+            'aud': [AUDIENCE],
+            'sub': 'oauth_user',
+            'client_id': 'test_client',
+            'scp': [REQUIRED_SCOPE],
+            'iat': now,
+            'exp': now + 300,
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self.private_key, algorithm='RS256', headers={'kid': self.kid})
+
+
+class StandInHydraHandler(BaseHTTPRequestHandler):
+    """模拟 Hydra 的 JWKS 和 introspection 端点"""
+
+    def do_GET(self):
+        if self.path != '/.well-known/jwks.json':
+            self.send_error(404)
+            return
+        self.server.jwks_requests += 1
+        self._send_json({'keys': [key.jwk for key in self.server.signing_keys]})
+
+    def do_POST(self):
+        if self.path != '/admin/oauth2/introspect':
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        token = parse_qs(body).get('token', [''])[0]
+        self.server.introspect_requests += 1
+        self._send_json(self.server.active_tokens.get(token, {'active': False}))
+
+    def _send_json(self, data):
+        content = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HydraJWKSTest(SimpleTestCase):
+    """使用本地的 Hydra 替身服务校验 JWKS 本地验签、密钥轮换和 introspection 回退"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHydraHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.current_key = SigningKey('key-1')
+        self.server.signing_keys = [self.current_key]
+        self.server.active_tokens = {}
+        self.server.jwks_requests = 0
+        self.server.introspect_requests = 0
+
+        hydra_config = {
+            **config_data.get('HYDRA', {}),
+            'ADMIN_URL': self.base_url,
+            'PUBLIC_URL': self.base_url,
+            'JWKS_URL': None,
+            'TOKEN_VERIFY_STRATEGY': 'jwks',
+            'ISSUER': ISSUER,
+            'AUDIENCE': AUDIENCE,
+            'REQUIRED_SCOPES': [REQUIRED_SCOPE],
+            'JWT_ALGORITHMS': ['RS256'],
+            'JWKS_REFRESH_INTERVAL': 3600,
+            'JWKS_MIN_REFRESH_INTERVAL': 0,
+            'CLIENT_ID': None,
+        }
+        config_patcher = mock.patch.dict(config_data, {'HYDRA': hydra_config})
+        config_patcher.start()
+        self.addCleanup(config_patcher.stop)
+        # 进程内单例按测试配置重新创建
+        clients_patcher = mock.patch.dict(hydra_client._clients, clear=True)
+        clients_patcher.start()
+        self.addCleanup(clients_patcher.stop)
+
+    def test_valid_token(self):
+        payload = HydraJWKSVerifier().verify(self.current_key.sign())
+        self.assertEqual(payload['username'], 'oauth_user')
+        self.assertEqual(payload['client_id'], 'test_client')
+        self.assertEqual(payload['scope'], [REQUIRED_SCOPE])
+        self.assertEqual(self.server.jwks_requests, 1)
+
+    def test_invalid_signature(self):
+        forged_key = SigningKey(self.current_key.kid)
+        self.assertIsNone(HydraJWKSVerifier().verify(forged_key.sign()))
+
+    def test_invalid_issuer(self):
+        self.assertIsNone(HydraJWKSVerifier().verify(self.current_key.sign(iss='http://other.test/')))
+
+    def test_invalid_audience(self):
+        self.assertIsNone(HydraJWKSVerifier().verify(self.current_key.sign(aud=['other_client'])))
+
+    def test_expired_token(self):
+        now = int(time.time())
+        self.assertIsNone(HydraJWKSVerifier().verify(self.current_key.sign(iat=now - 600, exp=now - 300)))
+
+    def test_missing_scope(self):
+        self.assertIsNone(HydraJWKSVerifier().verify(self.current_key.sign(scp=['offline'])))
+
+    def test_scope_string_claim(self):
+        token = self.current_key.sign(scp=None, scope=f'offline {REQUIRED_SCOPE}')
+        payload = HydraJWKSVerifier().verify(token)
+        self.assertEqual(payload['scope'], ['offline', REQUIRED_SCOPE])
+
+    def test_key_rotation_refetches_jwks(self):
+        verifier = HydraJWKSVerifier()
+        self.assertIsNotNone(verifier.verify(self.current_key.sign()))
+        self.assertEqual(self.server.jwks_requests, 1)
+
+        # 已知kid不重新拉取
+        self.assertIsNotNone(verifier.verify(self.current_key.sign()))
+        self.assertEqual(self.server.jwks_requests, 1)
+
+        rotated_key = SigningKey('key-2')
+        self.server.signing_keys = [self.current_key, rotated_key]
+        payload = verifier.verify(rotated_key.sign(sub='rotated_user'))
+        self.assertEqual(payload['username'], 'rotated_user')
+        self.assertEqual(self.server.jwks_requests, 2)
+
+    def test_unknown_kid_refresh_rate_limited(self):
+        config_data['HYDRA']['JWKS_MIN_REFRESH_INTERVAL'] = 3600
+        verifier = HydraJWKSVerifier()
+        self.assertIsNotNone(verifier.verify(self.current_key.sign()))
+
+        with self.assertRaises(JWKSKeyNotFound):
+            verifier.verify(SigningKey('key-unknown').sign())
+        self.assertEqual(self.server.jwks_requests, 1)
+
+    def test_unknown_kid_falls_back_to_introspection(self):
+        token = SigningKey('key-unknown').sign()
+        self.server.active_tokens[token] = {'active': True, 'sub': 'introspected_user', 'scope': REQUIRED_SCOPE}
+
+        payload = TokenManager().verify_token(token)
+        self.assertEqual(payload['username'], 'introspected_user')
+        self.assertEqual(self.server.introspect_requests, 1)
+
+    def test_opaque_token_uses_introspection(self):
+        self.server.active_tokens[OPAQUE_TOKEN] = {
+            'active': True, 'sub': 'opaque_user', 'scope': REQUIRED_SCOPE, 'client_id': 'test_client',
+            'exp': int(time.time()) + 300,
+        }
+
+        payload = TokenManager().verify_token(OPAQUE_TOKEN)
+        self.assertEqual(payload['username'], 'opaque_user')
+        self.assertEqual(self.server.introspect_requests, 1)
+        self.assertEqual(self.server.jwks_requests, 0)
+
+        # 无效的 opaque token
+        self.assertIsNone(TokenManager().verify_token('ory_at_inactive_token'))
+
+    def test_hydra_jwt_verified_locally(self):
+        payload = TokenManager().verify_token(self.current_key.sign())
+        self.assertEqual(payload['username'], 'oauth_user')
+        self.assertEqual(self.server.introspect_requests, 0)
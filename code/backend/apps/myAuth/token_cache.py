@@ -0,0 +1,212 @@
+import hashlib
+import os
+import threading
+import time
+
+from backend.settings import config_data
+from lib.cache_tool import LRUCache
+from lib.log import color_logger
+from lib.redis_tool import (
+    get_redis_value_with_prefix, get_ttl_many, publish_redis_message, scan_redis_keys, subscribe_redis_channel,
+)
+
+# token失效广播频道
+# 消息格式: {
+#     "username": "xxx",
+#     "session_id": "xxx" 或 None,  # 移除该会话的缓存
+#     "except_session_id": "xxx" 或 None,  # 移除除该会话外的缓存
+#     "epoch": 1 或 None,  # 用户新的token纪元，纪元更小的token全部失效
+#     "revoked_session_ids": ["xxx"] 或 None,  # 被吊销的会话
+# }
+TOKEN_REVOKE_CHANNEL = 'token_revoke'
+
+# 用户token纪元与会话吊销记录的Redis键前缀（AUTH库）
+TOKEN_EPOCH_KEY_PREFIX = 'token_epoch:'
+REVOKED_SESSION_KEY_PREFIX = 'revoked_session:'
+
+_verified_token_cache = LRUCache(
+    maxsize=config_data.get('AUTH', {}).get('TOKEN_CACHE_MAX_SIZE', 10000)
+)
+
+_listener_lock = threading.Lock()
+_listener_pid = None
+
+# 无状态模式下本进程已知的吊销状态
+_revocation_lock = threading.Lock()
+_user_token_epochs = {}  # username -> epoch
+_revoked_sessions = {}  # (username, session_id) -> 过期时间戳
+
+
+def is_token_cache_enabled():
+    """是否启用进程内已校验token缓存"""
+    return config_data.get('AUTH', {}).get('TOKEN_CACHE_ENABLED', False)
+
+
+def is_stateless_token_mode():
+    """是否启用无状态access token校验（只校验签名和过期时间，吊销状态由本地缓存判断）"""
+    return config_data.get('AUTH', {}).get('STATELESS_ACCESS_TOKEN', False)
+
+
+def _token_digest(token):
+    """token摘要，避免在内存中以原文作为键"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def get_cached_token_payload(token):
+    """从进程内缓存获取已校验的token payload"""
+    if not is_token_cache_enabled() or not token:
+        return None
+    ensure_token_revoke_listener()
+    return _verified_token_cache.get(_token_digest(token))
+
+
+def cache_token_payload(token, payload):
+    """缓存已校验的token payload
+
+    过期时间取 JWT exp 与重新校验窗口中较早的一个
+    """
+    if not is_token_cache_enabled() or not token or not payload:
+        return
+
+    revalidate_seconds = config_data.get('AUTH', {}).get('TOKEN_CACHE_REVALIDATE_SECONDS', 30)
+    expire_at = time.time() + revalidate_seconds
+    if payload.get('exp'):
+        expire_at = min(expire_at, payload['exp'])
+
+    _verified_token_cache.set(_token_digest(token), payload, expire_at=expire_at)
+
+
+def evict_cached_tokens(username, session_id=None, except_session_id=None):
+    """从本进程缓存中移除指定用户（或指定会话、或除某会话外）的token"""
+    def _match(key, payload):
+        if payload.get('username') != username:
+            return False
+        if except_session_id is not None and payload.get('session_id') == except_session_id:
+            return False
+        return session_id is None or payload.get('session_id') == session_id
+
+    evicted = _verified_token_cache.delete_where(_match)
+    if evicted:
+        color_logger.debug(f"移除进程内token缓存: {username}, {session_id}, 数量: {evicted}")
+
+
+def publish_token_revoke(username, session_id=None, except_session_id=None, epoch=None, revoked_session_ids=None):
+    """广播token失效消息，所有进程收到后移除本地缓存并更新吊销状态"""
+    # 先更新本进程，避免依赖订阅线程的延迟
+    evict_cached_tokens(username, session_id, except_session_id)
+    _apply_revocation(username, epoch, revoked_session_ids)
+
+    if not (is_token_cache_enabled() or is_stateless_token_mode()):
+        return
+    try:
+        publish_redis_message(
+            redis_db_name='AUTH',
+            channel=TOKEN_REVOKE_CHANNEL,
+            message={
+                'username': username,
+                'session_id': session_id,
+                'except_session_id': except_session_id,
+                'epoch': epoch,
+                'revoked_session_ids': revoked_session_ids,
+            }
+        )
+    except Exception as e:
+        color_logger.error(f"广播token失效消息失败: {e}")
+
+
+def _apply_revocation(username, epoch=None, revoked_session_ids=None, revoked_expire_at=None):
+    """更新本进程的用户token纪元和会话吊销记录"""
+    if epoch is None and not revoked_session_ids:
+        return
+
+    if revoked_expire_at is None:
+        revoked_expire_at = time.time() + config_data.get('AUTH', {}).get('ACCESS_TOKEN_EXPIRE')
+
+    with _revocation_lock:
+        if epoch is not None:
+            _user_token_epochs[username] = max(_user_token_epochs.get(username, 0), int(epoch))
+        for session_id in revoked_session_ids or []:
+            _revoked_sessions[(username, session_id)] = revoked_expire_at
+
+
+def _prune_revoked_sessions():
+    """清理已过期的会话吊销记录（对应的access token此时已过期）"""
+    now = time.time()
+    with _revocation_lock:
+        for key in [key for key, expire_at in _revoked_sessions.items() if expire_at <= now]:
+            del _revoked_sessions[key]
+
+
+def _load_revocation_state():
+    """从Redis全量加载token纪元与会话吊销记录，用于进程启动和断线重连"""
+    epochs = {}
+    revoked_sessions = {}
+    now = time.time()
+
+    # SCAN 遍历键，按批 MGET / pipeline TTL 读取
+    for key, value in (get_redis_value_with_prefix('AUTH', f'{TOKEN_EPOCH_KEY_PREFIX}*') or {}).items():
+        if value is not None:
+            epochs[key[len(TOKEN_EPOCH_KEY_PREFIX):]] = int(value)
+
+    revoked_keys = list(scan_redis_keys('AUTH', f'{REVOKED_SESSION_KEY_PREFIX}*'))
+    for key, ttl in get_ttl_many('AUTH', revoked_keys).items():
+        username, _, session_id = key[len(REVOKED_SESSION_KEY_PREFIX):].rpartition(':')
+        revoked_sessions[(username, session_id)] = now + ttl
+
+    with _revocation_lock:
+        _user_token_epochs.clear()
+        _user_token_epochs.update(epochs)
+        _revoked_sessions.clear()
+        _revoked_sessions.update(revoked_sessions)
+    color_logger.info(f"加载token吊销状态: 纪元 {len(epochs)} 个, 吊销会话 {len(revoked_sessions)} 个")
+
+
+def is_token_revoked(payload):
+    """无状态模式下判断token是否已被吊销（不访问Redis）"""
+    ensure_token_revoke_listener()
+
+    username = payload.get('username')
+    if payload.get('epoch', 0) < _user_token_epochs.get(username, 0):
+        return True
+
+    expire_at = _revoked_sessions.get((username, payload.get('session_id')))
+    return expire_at is not None and expire_at > time.time()
+
+
+def _on_token_revoke_message(message):
+    evict_cached_tokens(message.get('username'), message.get('session_id'), message.get('except_session_id'))
+    _apply_revocation(message.get('username'), message.get('epoch'), message.get('revoked_session_ids'))
+    _prune_revoked_sessions()
+
+
+def _on_token_revoke_listener_connect():
+    # 断线期间可能错过失效消息，重连后清空缓存并重新加载吊销状态
+    _verified_token_cache.clear()
+    if is_stateless_token_mode():
+        _load_revocation_state()
+
+
+def ensure_token_revoke_listener():
+    """确保当前进程已启动token失效消息的订阅线程
+
+    uwsgi 等预fork模型下线程不会被子进程继承，因此按进程号判断是否需要启动
+    """
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        # fork 后继承的缓存条目无法再收到失效消息，直接清空
+        _verified_token_cache.clear()
+        if is_stateless_token_mode():
+            # 订阅线程异步启动，先同步加载一次吊销状态，避免启动初期放行已吊销的token
+            _load_revocation_state()
+        subscribe_redis_channel(
+            redis_db_name='AUTH',
+            channel=TOKEN_REVOKE_CHANNEL,
+            callback=_on_token_revoke_message,
+            on_connect=_on_token_revoke_listener_connect
+        )
+        _listener_pid = os.getpid()
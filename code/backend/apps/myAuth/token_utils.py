@@ -5,17 +5,70 @@ from backend.settings import config_data
 from apps.user.models import User
 from lib.log import color_logger
 
-from lib.redis_tool import delete_redis_value, get_redis_value, set_redis_value
-import requests
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+from lib.redis_tool import dump_redis_value, get_redis_value, load_redis_value, set_many, set_redis_value
+from .hydra_client import (
+    JWKSKeyNotFound, get_hydra_introspection_client, get_hydra_jwks_verifier, is_hydra_jwks_enabled
+)
+from .token_cache import (
+    REVOKED_SESSION_KEY_PREFIX, TOKEN_EPOCH_KEY_PREFIX, cache_token_payload, get_cached_token_payload,
+    is_stateless_token_mode, is_token_revoked, publish_token_revoke
+)
+
+# 删除用户所有会话（可保留一个）的token并重建会话索引
+# KEYS[1]: 会话索引键
+# ARGV[1]: 用户名, ARGV[2]: 需要保留的会话ID（空字符串表示不保留）
+# ARGV[3]: 会话索引过期秒数, ARGV[4]: 当前时间戳
+# 兼容旧版逗号分隔字符串格式（JSON编码）的会话索引
+REVOKE_SESSIONS_LUA = """
+local key_type = redis.call('TYPE', KEYS[1])['ok']
+local sessions = {}
+local keep_score = nil
+if key_type == 'zset' then
+    sessions = redis.call('ZRANGE', KEYS[1], 0, -1)
+    if ARGV[2] ~= '' then
+        keep_score = redis.call('ZSCORE', KEYS[1], ARGV[2])
+    end
+elseif key_type == 'string' then
+    local legacy = cjson.decode(redis.call('GET', KEYS[1]))
+    for session in string.gmatch(legacy, '[^,]+') do
+        table.insert(sessions, session)
+        if session == ARGV[2] then
+            keep_score = tonumber(ARGV[4]) + tonumber(ARGV[3])
+        end
+    end
+end
+
+local revoked = {}
+for _, session in ipairs(sessions) do
+    if session ~= ARGV[2] then
+        redis.call('DEL', 'access_token:' .. ARGV[1] .. ':' .. session, 'refresh_token:' .. ARGV[1] .. ':' .. session)
+        table.insert(revoked, session)
+    end
+end
+
+redis.call('DEL', KEYS[1])
+if keep_score then
+    redis.call('ZADD', KEYS[1], keep_score, ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return revoked
+"""
 
 
 class TokenManager:
-    def _generate_token(self, user_id, username, session_id, expire_time):
-        """生成JWT token"""
+    def _generate_token(self, user_id, username, session_id, expire_time, token_type='access', epoch=0):
+        """生成JWT token
+
+        token_type 区分 access/refresh token，epoch 为签发时用户的token纪元（用于无状态校验模式下的吊销）
+        """
         payload = {
             'user_id': user_id,
             'username': username,
             'session_id': session_id,
+            'token_type': token_type,
+            'epoch': epoch,
             'exp': int(time.time()) + expire_time,
             'iat': int(time.time())
         }
@@ -38,35 +91,27 @@ class TokenManager:
         except:
             return False
 
+    def is_hydra_jwt_token(self, token):
+        """检查是否为Hydra签发的JWT token（带kid头，内部JWT不带kid）"""
+        try:
+            return bool(jwt.get_unverified_header(token).get('kid'))
+        except Exception:
+            return False
+
+    def verify_oauth2_token_via_jwks(self, token):
+        """通过Hydra的JWKS在本地验证OAuth2 JWT token，公钥不可用时回退到introspection"""
+        try:
+            return get_hydra_jwks_verifier().verify(token)
+        except JWKSKeyNotFound as e:
+            color_logger.warning(f"{e}, fallback to Hydra introspection")
+        except Exception as e:
+            color_logger.error(f"Error verifying OAuth2 token with JWKS: {e}")
+        return self.verify_oauth2_token_via_hydra(token)
+
     def verify_oauth2_token_via_hydra(self, token):
         """通过Hydra验证OAuth2 token"""
         try:
-            # 从配置获取Hydra管理凭据，如果未配置则不使用认证
-            from backend.settings import config_data
-            hydra_client_id = config_data.get('HYDRA', {}).get('CLIENT_ID', 'admin')
-            hydra_client_secret = config_data.get('HYDRA', {}).get('CLIENT_SECRET', '')
-
-            auth = None
-            if hydra_client_id and hydra_client_secret:
-                auth = (hydra_client_id, hydra_client_secret)
-
-            # 调用Hydra的introspection端点验证token
-            response = requests.post(
-                "http://hydra:4445/admin/oauth2/introspect",
-                data={"token": token},
-                auth=auth  # 可选的认证，取决于Hydra配置
-            )
-            if response.status_code == 200:
-                token_info = response.json()
-                if token_info.get("active"):
-                    # Token有效，返回用户信息
-                    return {
-                        'username': token_info.get('sub'),  # OAuth2中的subject通常对应username
-                        'scope': token_info.get('scope', '').split(),
-                        'client_id': token_info.get('client_id'),
-                        'exp': token_info.get('exp'),
-                        'iat': token_info.get('iat')
-                    }
+            return get_hydra_introspection_client().introspect(token)
         except Exception as e:
             color_logger.error(f"Error verifying OAuth2 token with Hydra: {e}")
         return None
@@ -76,65 +121,110 @@ class TokenManager:
         # 生成唯一的会话ID
         session_id = str(uuid.uuid4())
         
+        epoch = self._get_token_epoch(user_obj.username)
+
         access_token = self._generate_token(
             str(user_obj.uuid),
             user_obj.username,
             session_id,
-            config_data.get('AUTH', {}).get('ACCESS_TOKEN_EXPIRE')
+            config_data.get('AUTH', {}).get('ACCESS_TOKEN_EXPIRE'),
+            epoch=epoch
         )
         refresh_token = self._generate_token(
             str(user_obj.uuid),
             user_obj.username,
             session_id,
-            config_data.get('AUTH', {}).get('REFRESH_TOKEN_EXPIRE')
+            config_data.get('AUTH', {}).get('REFRESH_TOKEN_EXPIRE'),
+            token_type='refresh',
+            epoch=epoch
         )
 
-        # 存储到Redis - 使用用户名和会话ID的组合键
-        set_redis_value(
-            redis_db_name='AUTH',
-            redis_key_name=f"access_token:{user_obj.username}:{session_id}",
-            redis_key_value=access_token,
+        # 存储到Redis - 使用用户名和会话ID的组合键，并将会话ID添加到用户的活跃会话索引
+        # 两个token与会话索引在同一个事务中写入
+        self._store_session_tokens(user_obj.username, session_id, access_token, refresh_token)
+
+        return access_token, refresh_token, session_id
+
+    def _get_token_epoch(self, username):
+        """获取用户当前的token纪元"""
+        return int(get_redis_value(redis_db_name='AUTH', redis_key_name=f"{TOKEN_EPOCH_KEY_PREFIX}{username}") or 0)
+
+    def _bump_token_epoch(self, username):
+        """递增用户的token纪元，使之前签发的所有access token在无状态模式下失效
+
+        纪元键永不过期：各进程在内存中保留已知的最大纪元，键过期后新签发的token纪元会回到 0/1，
+        小于进程内记录的纪元而被全部拒绝
+        """
+        epoch_key = f"{TOKEN_EPOCH_KEY_PREFIX}{username}"
+        pipe = get_redis_connection('AUTH').pipeline(transaction=True)
+        pipe.incr(epoch_key)
+        # INCR 不会清除之前版本设置的过期时间
+        pipe.persist(epoch_key)
+        epoch, _ = pipe.execute()
+        return epoch
+
+    def _record_revoked_sessions(self, username, session_ids):
+        """记录被吊销的会话，供无状态模式下各进程加载，保留到对应的access token过期为止"""
+        if not session_ids:
+            return
+        set_many(
+            'AUTH',
+            {f"{REVOKED_SESSION_KEY_PREFIX}{username}:{session_id}": 1 for session_id in session_ids},
             set_expire=config_data.get('AUTH', {}).get('ACCESS_TOKEN_EXPIRE')
         )
-        set_redis_value(
-            redis_db_name='AUTH',
-            redis_key_name=f"refresh_token:{user_obj.username}:{session_id}",
-            redis_key_value=refresh_token,
-            set_expire=config_data.get('AUTH', {}).get('REFRESH_TOKEN_EXPIRE')
-        )
-        
-        # 将会话ID添加到用户的活跃会话列表
-        self._add_user_session(user_obj.username, session_id)
 
-        return access_token, refresh_token, session_id
+    def _get_sessions_key(self, username):
+        """用户活跃会话索引的键（有序集合，score为会话过期时间戳）"""
+        return f"user_sessions:{username}"
+
+    def _store_session_tokens(self, username, session_id, access_token, refresh_token):
+        """在一个 MULTI 事务中写入 access token、refresh token 和会话索引"""
+        access_expire = config_data.get('AUTH', {}).get('ACCESS_TOKEN_EXPIRE')
+        refresh_expire = config_data.get('AUTH', {}).get('REFRESH_TOKEN_EXPIRE')
+        sessions_key = self._get_sessions_key(username)
+        now = int(time.time())
 
-    def _add_user_session(self, username, session_id):
-        """将用户会话添加到活跃会话列表"""
+        def _execute():
+            pipe = get_redis_connection('AUTH').pipeline(transaction=True)
+            pipe.set(f"access_token:{username}:{session_id}", dump_redis_value(access_token), ex=access_expire)
+            pipe.set(f"refresh_token:{username}:{session_id}", dump_redis_value(refresh_token), ex=refresh_expire)
+            pipe.zadd(sessions_key, {session_id: now + refresh_expire})
+            # 顺带清理已过期的会话
+            pipe.zremrangebyscore(sessions_key, '-inf', now)
+            pipe.expire(sessions_key, refresh_expire)
+            pipe.execute()
+
+        self._execute_with_legacy_sessions(username, _execute)
+
+    def _execute_with_legacy_sessions(self, username, func):
+        """执行会话索引操作，遇到旧版逗号分隔字符串格式的索引时先迁移再重试"""
         try:
-            # 获取当前活跃会话列表
-            sessions_key = f"user_sessions:{username}"
-            current_sessions = get_redis_value(redis_db_name='AUTH', redis_key_name=sessions_key)
-            if current_sessions:
-                # 如果已有会话列表，添加新会话ID
-                sessions_list = current_sessions.split(',')
-                if session_id not in sessions_list:
-                    sessions_list.append(session_id)
-                    new_sessions = ','.join(sessions_list)
-                else:
-                    new_sessions = current_sessions
-            else:
-                # 如果没有会话列表，创建一个包含新会话ID的列表
-                new_sessions = session_id
-            
-            # 存储更新后的会话列表，设置为与refresh token相同的过期时间
-            set_redis_value(
-                redis_db_name='AUTH',
-                redis_key_name=sessions_key,
-                redis_key_value=new_sessions,
-                set_expire=config_data.get('AUTH', {}).get('REFRESH_TOKEN_EXPIRE')
-            )
-        except Exception as e:
-            color_logger.error(f"_add_user_session error: {e}")
+            return func()
+        except ResponseError as e:
+            if 'WRONGTYPE' not in str(e):
+                raise
+            self._migrate_legacy_sessions(username)
+            return func()
+
+    def _migrate_legacy_sessions(self, username):
+        """将旧版逗号分隔字符串格式的会话索引迁移为有序集合"""
+        redis_conn = get_redis_connection('AUTH')
+        sessions_key = self._get_sessions_key(username)
+        if redis_conn.type(sessions_key) not in (b'string', 'string'):
+            return
+
+        refresh_expire = config_data.get('AUTH', {}).get('REFRESH_TOKEN_EXPIRE')
+        legacy_sessions = load_redis_value(redis_conn.get(sessions_key)) or ''
+        session_ids = [session for session in legacy_sessions.split(',') if session]
+
+        pipe = redis_conn.pipeline(transaction=True)
+        pipe.delete(sessions_key)
+        if session_ids:
+            expire_at = int(time.time()) + refresh_expire
+            pipe.zadd(sessions_key, {session: expire_at for session in session_ids})
+            pipe.expire(sessions_key, refresh_expire)
+        pipe.execute()
+        color_logger.info(f"迁移用户会话索引为有序集合: {username}, 会话数: {len(session_ids)}")
 
     def verify_token(self, token):
         """验证token - 支持内部JWT和外部OAuth2 token"""
@@ -142,6 +232,10 @@ class TokenManager:
             color_logger.debug(f"verify_token")
             # 首先检查是否为内部JWT token
             if self.is_jwt_token(token):
+                if is_hydra_jwks_enabled() and self.is_hydra_jwt_token(token):
+                    color_logger.debug(f"verify_token - is hydra jwt token")
+                    return self.verify_oauth2_token_via_jwks(token)
+
                 color_logger.debug(f"verify_token - is jwt token")
                 # 这是内部JWT token，使用原有逻辑验证
                 payload = jwt.decode(
@@ -150,6 +244,12 @@ class TokenManager:
                     algorithms=[config_data.get('AUTH', {}).get('JWT_ALGORITHM')]
                 )
 
+                if is_stateless_token_mode():
+                    # 无状态模式：签名和过期时间已校验，只需检查token类型与本地吊销状态
+                    if payload.get('token_type') != 'access' or is_token_revoked(payload):
+                        return None
+                    return payload
+
                 # 检查Redis中是否存在该特定会话的token
                 stored_token = get_redis_value(
                     redis_db_name='AUTH',
@@ -178,6 +278,20 @@ class TokenManager:
                 return oauth2_result
             return None
 
+    def verify_token_with_cache(self, token):
+        """验证token，优先使用进程内已校验token缓存
+
+        只缓存内部JWT token的校验结果，缓存会在token失效广播时被移除
+        """
+        payload = get_cached_token_payload(token)
+        if payload:
+            return payload
+
+        payload = self.verify_token(token)
+        if payload and 'session_id' in payload:
+            cache_token_payload(token, payload)
+        return payload
+
     def refresh_access_token(self, refresh_token):
         """使用refresh token刷新access token"""
         try:
@@ -206,7 +320,8 @@ class TokenManager:
                     payload['user_id'],
                     payload['username'],
                     payload['session_id'],  # 保持相同的会话ID
-                    config_data.get('AUTH', {}).get('ACCESS_TOKEN_EXPIRE')
+                    config_data.get('AUTH', {}).get('ACCESS_TOKEN_EXPIRE'),
+                    epoch=self._get_token_epoch(payload['username'])
                 )
                 color_logger.debug(f"refresh_access_token 生成access_token")
 
@@ -219,6 +334,9 @@ class TokenManager:
                 )
                 color_logger.debug(f"refresh_access_token 更新Redis")
 
+                # 旧的access token已被替换，通知各进程移除缓存
+                publish_token_revoke(payload['username'], payload['session_id'])
+
                 return access_token, payload['username']
             else:
                 # 这可能是OAuth2 refresh token，需要通过Hydra处理
@@ -242,65 +360,48 @@ class TokenManager:
         try:
             # 如果指定了session_id，则只使特定会话失效
             if session_id:
-                delete_redis_value(
-                    redis_db_name='AUTH',
-                    redis_key_name=f"access_token:{username}:{session_id}"
-                )
-                delete_redis_value(
-                    redis_db_name='AUTH',
-                    redis_key_name=f"refresh_token:{username}:{session_id}"
-                )
-                # 从活跃会话列表中移除该会话
                 self._remove_user_session(username, session_id)
             else:
-                # 如果没有指定session_id，则使该用户的所有会话失效
-                sessions_key = f"user_sessions:{username}"
-                current_sessions = get_redis_value(redis_db_name='AUTH', redis_key_name=sessions_key)
-                if current_sessions:
-                    sessions_list = current_sessions.split(',')
-                    for session in sessions_list:
-                        delete_redis_value(
-                            redis_db_name='AUTH',
-                            redis_key_name=f"access_token:{username}:{session}"
-                        )
-                        delete_redis_value(
-                            redis_db_name='AUTH',
-                            redis_key_name=f"refresh_token:{username}:{session}"
-                        )
-                
-                # 删除会话列表
-                delete_redis_value(
-                    redis_db_name='AUTH',
-                    redis_key_name=sessions_key
-                )
+                # 如果没有指定session_id，则使该用户的所有会话失效，并递增token纪元
+                self._revoke_sessions(username)
+                epoch = self._bump_token_epoch(username)
+                publish_token_revoke(username, epoch=epoch)
         except Exception as e:
             color_logger.error(f"invalidate_tokens error: {e}")
             return None
 
+    def _revoke_sessions(self, username, keep_session_id=None):
+        """一次 Lua 脚本调用删除用户（除 keep_session_id 外）所有会话的token，返回被删除的会话ID"""
+        revoke_script = get_redis_connection('AUTH').register_script(REVOKE_SESSIONS_LUA)
+        revoked = revoke_script(
+            keys=[self._get_sessions_key(username)],
+            args=[
+                username,
+                keep_session_id or '',
+                config_data.get('AUTH', {}).get('REFRESH_TOKEN_EXPIRE'),
+                int(time.time()),
+            ]
+        )
+        return [session.decode('utf-8') if isinstance(session, bytes) else session for session in revoked]
+
     def _remove_user_session(self, username, session_id):
-        """从活跃会话列表中移除会话"""
+        """删除会话的token并从活跃会话索引中移除"""
         try:
-            sessions_key = f"user_sessions:{username}"
-            current_sessions = get_redis_value(redis_db_name='AUTH', redis_key_name=sessions_key)
-            if current_sessions:
-                sessions_list = current_sessions.split(',')
-                if session_id in sessions_list:
-                    sessions_list.remove(session_id)
-                    if sessions_list:
-                        new_sessions = ','.join(sessions_list)
-                        # 更新会话列表
-                        set_redis_value(
-                            redis_db_name='AUTH',
-                            redis_key_name=sessions_key,
-                            redis_key_value=new_sessions,
-                            set_expire=config_data.get('AUTH', {}).get('REFRESH_TOKEN_EXPIRE')
-                        )
-                    else:
-                        # 如果没有活跃会话了，删除会话列表
-                        delete_redis_value(
-                            redis_db_name='AUTH',
-                            redis_key_name=sessions_key
-                        )
+            def _execute():
+                pipe = get_redis_connection('AUTH').pipeline(transaction=True)
+                pipe.delete(
+                    f"access_token:{username}:{session_id}",
+                    f"refresh_token:{username}:{session_id}"
+                )
+                pipe.zrem(self._get_sessions_key(username), session_id)
+                pipe.set(
+                    f"{REVOKED_SESSION_KEY_PREFIX}{username}:{session_id}", 1,
+                    ex=config_data.get('AUTH', {}).get('ACCESS_TOKEN_EXPIRE')
+                )
+                pipe.execute()
+
+            self._execute_with_legacy_sessions(username, _execute)
+            publish_token_revoke(username, session_id, revoked_session_ids=[session_id])
         except Exception as e:
             color_logger.error(f"_remove_user_session error: {e}")
 
@@ -318,11 +419,12 @@ class TokenManager:
     def get_all_user_sessions(self, username):
         """获取用户的所有活跃会话"""
         try:
-            sessions_key = f"user_sessions:{username}"
-            current_sessions = get_redis_value(redis_db_name='AUTH', redis_key_name=sessions_key)
-            if current_sessions:
-                return current_sessions.split(',')
-            return []
+            def _execute():
+                return get_redis_connection('AUTH').zrangebyscore(
+                    self._get_sessions_key(username), int(time.time()), '+inf')
+
+            sessions = self._execute_with_legacy_sessions(username, _execute)
+            return [session.decode('utf-8') if isinstance(session, bytes) else session for session in sessions]
         except Exception as e:
             color_logger.error(f"get_all_user_sessions error: {e}")
             return []
@@ -330,19 +432,8 @@ class TokenManager:
     def invalidate_all_user_sessions_except_current(self, username, current_session_id):
         """使用户除当前会话外的所有会话失效"""
         try:
-            all_sessions = self.get_all_user_sessions(username)
-            for session in all_sessions:
-                if session != current_session_id:
-                    # 删除该会话的tokens
-                    delete_redis_value(
-                        redis_db_name='AUTH',
-                        redis_key_name=f"access_token:{username}:{session}"
-                    )
-                    delete_redis_value(
-                        redis_db_name='AUTH',
-                        redis_key_name=f"refresh_token:{username}:{session}"
-                    )
-                    # 从会话列表中移除该会话
-                    self._remove_user_session(username, session)
+            revoked = self._revoke_sessions(username, keep_session_id=current_session_id)
+            self._record_revoked_sessions(username, revoked)
+            publish_token_revoke(username, except_session_id=current_session_id, revoked_session_ids=revoked)
         except Exception as e:
-            color_logger.error(f"invalidate_all_user_sessions_except_current error: {e}")
\ No newline at end of file
+            color_logger.error(f"invalidate_all_user_sessions_except_current error: {e}")
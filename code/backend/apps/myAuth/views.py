@@ -1,8 +1,9 @@
 from datetime import datetime, timedelta, timezone as dt_timezone
 from lib.redis_tool import get_redis_value, set_redis_value
 from lib.time_tools import get_now_time_utc_obj
-from lib.request_tool import get_authorization_token, pub_success_response, pub_error_response
+from lib.request_tool import pub_success_response, pub_error_response
 from lib.request_tool import pub_get_request_body
+from lib.auth_context import get_current_username
 from apps.user.models import User
 from backend.settings import config_data
 from .token_utils import TokenManager
@@ -11,7 +12,7 @@ from apps.perm.utils import get_user_perm_json_all
 from lib.route_tool import RouteTool
 from apps.user.utils import format_user_data
 from django.contrib.auth.hashers import check_password
-from apps.ldapauth.models import LdapConfig
+from apps.ldapauth.utils import get_enabled_ldap_config
 from apps.ldapauth.views import record_user_login_failed, get_user_is_lock
 from apps.ldapauth.ldap_utils import LdapAuthBackend
 from apps.audit.utils import add_audit_log
@@ -63,7 +64,7 @@ def login(request):
             return pub_error_response(10003, msg="错误过多，被锁定，请联系管理员")
 
         # 检查LDAP配置是否启用
-        ldap_config = LdapConfig.objects.filter(enabled=True).first()
+        ldap_config = get_enabled_ldap_config()
         user_obj = None
 
         if ldap_config:
@@ -217,13 +218,13 @@ def logout(request):
         # 获取当前用户
         token_manager = TokenManager()
         access_token = request.COOKIES.get(config_data.get('AUTH', {}).get('COOKIE_ACCESS_TOKEN_NAME'))
-        username = token_manager.get_username_from_access_token(access_token)
+        # 只校验一次token，用户名和session_id都从payload中获取
+        payload = token_manager.verify_token(access_token) if access_token else None
+        username = payload.get('username') if payload else None
         
         if username:
             # 使当前会话的token失效
-            # 需要从token中提取session_id
-            payload = token_manager.verify_token(access_token)
-            if payload and 'session_id' in payload:
+            if 'session_id' in payload:
                 token_manager.invalidate_tokens(username, session_id=payload['session_id'])
             else:
                 # 如果无法获取session_id，则使用户的所有token失效
@@ -370,7 +371,7 @@ def get_async_routes(request):
 
         body = pub_get_request_body(request)
 
-        user_name = TokenManager().get_username_from_access_token(get_authorization_token(request))
+        user_name = get_current_username()
 
         if user_name is None:
             return pub_success_response(data=[])
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PermConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.perm'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.perm.utils import resolve_users_perm_json
+from apps.user.models import User
+from lib.redis_codec import (
+    COMPRESSIONS, SERIALIZERS, RedisCodec, is_compression_available, is_serializer_available,
+)
+
+
+def benchmark_codec(codec, documents, iterations):
+    """返回 (平均编码后字节数, 每个文档的平均编码耗时(微秒), 每个文档的平均解码耗时(微秒))"""
+    encoded = [codec.encode(document) for document in documents]
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for document in documents:
+            codec.encode(document)
+    encode_cost = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for data in encoded:
+            codec.decode(data)
+    decode_cost = time.perf_counter() - start
+
+    operations = iterations * len(documents)
+    return (
+        sum(len(data) for data in encoded) / len(encoded),
+        encode_cost / operations * 1e6,
+        decode_cost / operations * 1e6,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Benchmark Redis value codecs on the merged permission JSON of real users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='参与测试的用户数量')
+        parser.add_argument('--iterations', type=int, default=20, help='每种编解码方式重复的轮数')
+        parser.add_argument('--compress-min-size', type=int, default=1024, help='触发压缩的最小字节数')
+
+    def handle(self, *args, **options):
+        users = list(User.objects.filter(is_active=True).order_by('uuid')[:options['users']])
+        documents = list(resolve_users_perm_json(users).values())
+        if not documents:
+            self.stdout.write(self.style.WARNING('No active users to benchmark'))
+            return
+
+        self.stdout.write(f"documents: {len(documents)}, iterations: {options['iterations']}")
+        self.stdout.write(f"{'serializer':<10} {'compression':<12} {'avg bytes':>10} {'encode us':>10} {'decode us':>10}")
+        for serializer in SERIALIZERS:
+            if not is_serializer_available(serializer):
+                self.stdout.write(self.style.WARNING(f"{serializer:<10} not installed, skipped"))
+                continue
+            for compression in COMPRESSIONS:
+                if not is_compression_available(compression):
+                    continue
+                codec = RedisCodec(serializer, compression, options['compress_min_size'])
+                size, encode_us, decode_us = benchmark_codec(codec, documents, options['iterations'])
+                self.stdout.write(f"{serializer:<10} {compression:<12} {size:>10.0f} {encode_us:>10.1f} {decode_us:>10.1f}")
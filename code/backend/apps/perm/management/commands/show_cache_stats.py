@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from lib.two_tier_cache import STAT_FIELDS, get_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show two-tier cache hit/miss counters of all processes, per namespace'
+
+    def handle(self, *args, **options):
+        stats = get_cache_stats()
+        if not stats:
+            self.stdout.write(self.style.WARNING('No cache stats recorded yet'))
+            return
+
+        self.stdout.write(f"{'namespace':<24} " + ' '.join(f"{field:>13}" for field in STAT_FIELDS) + f" {'hit_ratio':>10}")
+        for namespace, namespace_stats in sorted(stats.items()):
+            hit_ratio = namespace_stats['hit_ratio']
+            self.stdout.write(
+                f"{namespace:<24} " + ' '.join(f"{namespace_stats[field]:>13}" for field in STAT_FIELDS)
+                + f" {'-' if hit_ratio is None else f'{hit_ratio:.2%}':>10}"
+            )
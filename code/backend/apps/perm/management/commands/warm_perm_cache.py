@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from apps.user.models import User
+from apps.perm.utils import get_users_perm_json_all
+from lib.log import color_logger
+
+
+class Command(BaseCommand):
+    help = 'Warm up the merged user permission JSON cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批解析的用户数量')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_uuids = list(User.objects.filter(is_active=True).values_list('uuid', flat=True))
+
+        for i in range(0, len(user_uuids), batch_size):
+            get_users_perm_json_all(user_uuids[i:i + batch_size])
+
+        color_logger.info(f'用户权限缓存预热完成，用户数量: {len(user_uuids)}')
+        self.stdout.write(self.style.SUCCESS(f'Warmed permission cache for {len(user_uuids)} users'))
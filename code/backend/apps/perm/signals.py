@@ -0,0 +1,200 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_save
+
+from apps.user.models import User, UserGroup
+from lib.log import color_logger
+from lib.model_tools import tree_nodes_bulk_updated
+from .models import Permission, Role
+from .utils import invalidate_user_perm_json_cache
+
+# 所有用户都拥有的权限编码，变更时需要失效所有用户的缓存
+EVERYONE_BASE_PERM_CODE = 'everyone_base_perm'
+
+# 保存时影响关联用户权限的字段（attname），其他字段变更不失效缓存
+# - 权限的 permission_json、用户组的层级（parent_id/path）、软删除
+# - 用户名：缓存同时以用户名为键
+PERM_AFFECTING_FIELDS = {
+    Permission: ('permission_json', 'is_del'),
+    Role: ('is_del',),
+    UserGroup: ('parent_id', 'path', 'is_del'),
+    User: ('username', 'is_del'),
+}
+
+# 影响用户权限的多对多关系: (字段所在模型, 字段名, 受影响用户由字段所在模型一侧决定)
+# 例如 UserGroup.users 中受影响的是被加入/移出的用户（关联模型一侧）
+PERM_M2M_FIELDS = [
+    (User, 'permissions', True),
+    (User, 'roles', True),
+    (UserGroup, 'users', False),
+    (UserGroup, 'permissions', True),
+    (UserGroup, 'roles', True),
+    (Role, 'permissions', True),
+]
+
+
+def get_group_and_descendant_ids(group_ids):
+    """获取用户组及其所有子孙用户组的uuid（子组继承父组的权限）"""
+    group_paths = UserGroup.all_objects.filter(uuid__in=group_ids).values_list('path', flat=True)
+    path_filter = Q()
+    for group_path in group_paths:
+        path_filter |= Q(path__startswith=group_path)
+    if not path_filter:
+        return set(group_ids)
+    return set(group_ids) | set(UserGroup.all_objects.filter(path_filter).values_list('uuid', flat=True))
+
+
+def get_users_of_groups(group_ids):
+    if not group_ids:
+        return []
+    group_ids = get_group_and_descendant_ids(group_ids)
+    return list(User.all_objects.filter(usergroup__in=group_ids).values_list('uuid', 'username').distinct())
+
+
+def get_users_of_roles(role_ids):
+    if not role_ids:
+        return []
+    users = set(User.all_objects.filter(roles__in=role_ids).values_list('uuid', 'username'))
+    group_ids = UserGroup.all_objects.filter(roles__in=role_ids).values_list('uuid', flat=True)
+    users.update(get_users_of_groups(set(group_ids)))
+    return list(users)
+
+
+def get_users_of_permissions(permission_ids):
+    if not permission_ids:
+        return []
+    users = set(User.all_objects.filter(permissions__in=permission_ids).values_list('uuid', 'username'))
+    role_ids = Role.all_objects.filter(permissions__in=permission_ids).values_list('uuid', flat=True)
+    users.update(get_users_of_roles(set(role_ids)))
+    group_ids = UserGroup.all_objects.filter(permissions__in=permission_ids).values_list('uuid', flat=True)
+    users.update(get_users_of_groups(set(group_ids)))
+    return list(users)
+
+
+def get_affected_users(model, pks):
+    """获取 model 中 pks 对应记录变更时，权限受影响的用户 (uuid, username) 列表
+
+    返回 None 表示影响所有用户
+    """
+    pks = set(pks or [])
+    if not pks:
+        return []
+    if model is User:
+        return list(User.all_objects.filter(uuid__in=pks).values_list('uuid', 'username'))
+    if model is UserGroup:
+        return get_users_of_groups(pks)
+    if model is Role:
+        return get_users_of_roles(pks)
+    if model is Permission:
+        if Permission.all_objects.filter(uuid__in=pks, code=EVERYONE_BASE_PERM_CODE).exists():
+            return None
+        return get_users_of_permissions(pks)
+    return []
+
+
+def schedule_invalidation(model, pks, extra_users=()):
+    """计算受影响的用户，并在事务提交后失效其权限缓存
+
+    受影响用户在调用时计算（清空关联前关系仍然存在），缓存在提交后失效，
+    避免提交前有请求读取到旧数据并重新写入缓存
+
+    Args:
+        extra_users: 额外需要失效的 (uuid, username)，如用户改名前的用户名
+    """
+    users = get_affected_users(model, pks)
+    if users is not None:
+        users = list(users) + list(extra_users)
+    if users == []:
+        return
+
+    def _invalidate():
+        try:
+            invalidate_user_perm_json_cache(users)
+        except Exception as e:
+            color_logger.error(f"失效用户权限缓存失败: {e}")
+
+    transaction.on_commit(_invalidate)
+
+
+def get_changed_fields(instance, attnames, update_fields=None):
+    """与从数据库加载时的快照比较，返回 attnames 中变更的字段
+
+    没有快照（未经数据库加载的实例）时视为全部变更；指定 update_fields 时只比较其中的字段
+    """
+    if update_fields is not None:
+        saved_attnames = {instance._meta.get_field(name).attname for name in update_fields}
+        attnames = [attname for attname in attnames if attname in saved_attnames]
+
+    loaded_values = instance.get_loaded_values()
+    if loaded_values is None:
+        return set(attnames)
+
+    deferred_fields = instance.get_deferred_fields()
+    return {
+        attname for attname in attnames
+        if attname not in deferred_fields
+        and (attname not in loaded_values or loaded_values[attname] != getattr(instance, attname))
+    }
+
+
+def _on_perm_object_saved(sender, instance, created, update_fields=None, **kwargs):
+    # 新建的权限/角色/用户组还没有关联任何用户；
+    # 只有 PERM_AFFECTING_FIELDS 中的字段变更才影响关联用户（及子孙用户组的用户）
+    if created:
+        return
+    changed_fields = get_changed_fields(instance, PERM_AFFECTING_FIELDS[sender], update_fields)
+    if not changed_fields:
+        return
+
+    extra_users = []
+    loaded_values = instance.get_loaded_values() or {}
+    if 'username' in changed_fields and 'username' in loaded_values:
+        # 缓存同时以用户名为键，改名后旧用户名的缓存同样需要失效
+        extra_users.append((instance.pk, loaded_values['username']))
+    schedule_invalidation(sender, [instance.pk], extra_users=extra_users)
+
+
+for _model in (Permission, Role, UserGroup, User):
+    post_save.connect(_on_perm_object_saved, sender=_model, dispatch_uid=f'perm_cache_{_model.__name__}_saved')
+
+
+def _on_user_group_tree_bulk_updated(sender, updated, deleted, **kwargs):
+    # 批量更新不会触发逐行的 post_save，移动或删除的用户组（及其子孙用户组）的用户权限受影响
+    schedule_invalidation(UserGroup, [node.pk for node in updated + deleted])
+
+
+tree_nodes_bulk_updated.connect(
+    _on_user_group_tree_bulk_updated, sender=UserGroup, dispatch_uid='perm_cache_UserGroup_bulk_updated'
+)
+
+
+def _make_m2m_receiver(source_model, field_name, holder_is_source):
+    field = source_model._meta.get_field(field_name)
+    holder_model = source_model if holder_is_source else field.related_model
+    # 中间表上分别指向两侧模型的外键名
+    holder_fk = field.m2m_field_name() if holder_is_source else field.m2m_reverse_field_name()
+    other_fk = field.m2m_reverse_field_name() if holder_is_source else field.m2m_field_name()
+
+    def _receiver(sender, instance, action, pk_set, **kwargs):
+        if action not in ('post_add', 'post_remove', 'pre_clear'):
+            return
+
+        if isinstance(instance, holder_model):
+            holder_pks = [instance.pk]
+        elif action == 'pre_clear':
+            holder_pks = sender.objects.filter(**{other_fk: instance.pk}).values_list(holder_fk, flat=True)
+        else:
+            holder_pks = pk_set
+
+        schedule_invalidation(holder_model, holder_pks)
+
+    return _receiver
+
+
+for _source_model, _field_name, _holder_is_source in PERM_M2M_FIELDS:
+    m2m_changed.connect(
+        _make_m2m_receiver(_source_model, _field_name, _holder_is_source),
+        sender=getattr(_source_model, _field_name).through,
+        weak=False,
+        dispatch_uid=f'perm_cache_{_source_model.__name__}_{_field_name}_changed'
+    )
@@ -1,3 +1,108 @@
-from django.test import TestCase
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django_redis import get_redis_connection
+
+from apps.user.models import User
+from lib import route_matcher
+from lib.two_tier_cache import TwoTierCache
+from .models import Permission
 
 # Create your tests here.
+
+versioned_cache = TwoTierCache(namespace='test_two_tier_cache_version', ttl=60, stale_ttl=10)
+
+
+class TwoTierCacheVersionTest(SimpleTestCase):
+    """回源期间其他进程失效了缓存时，回源得到的旧值不写入 Redis"""
+
+    def setUp(self):
+        self.redis_conn = get_redis_connection(versioned_cache.redis_db_name)
+        # 不使用 invalidate：本进程收到自身的失效广播时同样会丢弃回源结果，导致结果不稳定
+        self.clear()
+        self.addCleanup(self.clear)
+
+    def clear(self):
+        self.redis_conn.delete(versioned_cache.redis_key('key'))
+        versioned_cache.evict_local()
+
+    def invalidate_in_other_process(self, key):
+        """只修改 Redis（其他进程的失效），不影响本进程的 generation"""
+        self.redis_conn.incr(versioned_cache.version_key)
+        self.redis_conn.delete(versioned_cache.redis_key(key))
+
+    def test_load_skips_write_after_invalidation(self):
+        def loader(key):
+            self.invalidate_in_other_process(key)
+            return 'stale'
+
+        self.assertEqual(versioned_cache.get('key', loader=loader), 'stale')
+        self.assertIsNone(self.redis_conn.get(versioned_cache.redis_key('key')))
+        self.assertEqual(versioned_cache.get('key', loader=lambda key: 'fresh'), 'fresh')
+        self.assertEqual(versioned_cache.get_many(['key']), {'key': 'fresh'})
+
+    def test_set_many_skips_write_after_invalidation(self):
+        version = versioned_cache.get_version()
+        self.invalidate_in_other_process('key')
+        versioned_cache.set_many({'key': 'stale'}, version=version)
+        self.assertEqual(versioned_cache.get_many(['key']), {})
+
+        versioned_cache.set_many({'key': 'fresh'}, version=versioned_cache.get_version())
+        self.assertEqual(versioned_cache.get_many(['key']), {'key': 'fresh'})
+
+
+class RouteMatcherCacheTest(SimpleTestCase):
+    """同一个权限文档对象只编译一次匹配器，重新加载的文档（新对象）重新编译"""
+
+    def test_compile_once_per_document(self):
+        routes = {'/api/v1/user/users/': ['GET']}
+        with mock.patch.object(route_matcher, 'RouteMatcher', wraps=route_matcher.RouteMatcher) as compile_matcher:
+            matcher = route_matcher.get_route_matcher(routes)
+            self.assertIs(route_matcher.get_route_matcher(routes), matcher)
+            self.assertEqual(compile_matcher.call_count, 1)
+
+            reloaded = {'/api/v1/user/users/': '*'}
+            self.assertTrue(route_matcher.get_route_matcher(reloaded).allows('/api/v1/user/users/', 'DELETE'))
+            self.assertFalse(matcher.allows('/api/v1/user/users/', 'DELETE'))
+            self.assertEqual(compile_matcher.call_count, 2)
+
+
+class PermCacheInvalidationTest(TestCase):
+    """只有影响权限的字段变更时才失效用户权限缓存"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='perm_user', nickname='权限用户')
+        cls.permission = Permission.objects.create(name='用户列表', code='user_list', permission_json={'menu': []})
+        cls.user.permissions.add(cls.permission)
+
+    def save_and_get_invalidated(self, instance, **kwargs):
+        """保存实例，返回提交后失效的 (uuid, username)"""
+        with mock.patch('apps.perm.signals.invalidate_user_perm_json_cache') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                instance.save(**kwargs)
+        return {user for call in invalidate.call_args_list for user in call.args[0]}
+
+    def test_permission_fields(self):
+        permission = Permission.objects.get(pk=self.permission.pk)
+        permission.description = '只修改描述'
+        self.assertEqual(self.save_and_get_invalidated(permission), set())
+
+        permission.permission_json['menu'].append('user')
+        self.assertEqual(self.save_and_get_invalidated(permission), {(self.user.uuid, 'perm_user')})
+
+        # 未保存的字段不比较
+        permission.permission_json['menu'].append('role')
+        permission.name = '用户管理'
+        self.assertEqual(self.save_and_get_invalidated(permission, update_fields=['name']), set())
+
+    def test_user_fields(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.nickname = '新昵称'
+        self.assertEqual(self.save_and_get_invalidated(user), set())
+
+        user.username = 'renamed_user'
+        self.assertEqual(
+            self.save_and_get_invalidated(user),
+            {(self.user.uuid, 'renamed_user'), (self.user.uuid, 'perm_user')}
+        )
@@ -4,7 +4,49 @@ from lib.log import color_logger
 from lib.json_tools import merge_jsons
 from lib.time_tools import utc_obj_to_time_zone_str
 from backend.settings import config_data
-from lib.redis_tool import get_redis_value, set_redis_value
+from django.db.models import Q
+from lib.route_matcher import get_route_matcher
+from lib.query_plan import QueryPlan
+from lib.two_tier_cache import TwoTierCache
+
+# 合并后的用户权限JSON缓存（Redis 键为 user_perm_json_all:{uuid 或 username}，取决于调用方式）
+# 权限变更时由 apps/perm/signals.py 主动失效，这里的过期时间只是兜底
+user_perm_json_cache = TwoTierCache(
+    namespace='user_perm_json_all',
+    ttl=config_data.get('PERM', {}).get('PERM_JSON_CACHE_EXPIRE', 21600),
+)
+
+# 格式化函数 only_basic=True 时用到的字段
+PERMISSION_BASIC_PLAN = QueryPlan(Permission, only=[
+    'uuid', 'create_time', 'update_time', 'name', 'code', 'permission_json', 'is_system', 'description'])
+ROLE_BASIC_PLAN = QueryPlan(Role, only=['uuid', 'create_time', 'update_time', 'name', 'code', 'description'])
+
+
+def get_permission_query_plan(only_basic=False):
+    """format_permission_data 对应的查询计划"""
+    if only_basic:
+        return PERMISSION_BASIC_PLAN
+
+    from apps.user.utils import USER_BASIC_PLAN, USER_GROUP_BASIC_PLAN
+    return QueryPlan(Permission, only=PERMISSION_BASIC_PLAN.only, prefetch={
+        'role_set': ROLE_BASIC_PLAN,
+        'user_set': USER_BASIC_PLAN,
+        'usergroup_set': USER_GROUP_BASIC_PLAN,
+    })
+
+
+def get_role_query_plan(only_basic=False):
+    """format_role_data 对应的查询计划"""
+    if only_basic:
+        return ROLE_BASIC_PLAN
+
+    from apps.user.utils import USER_BASIC_PLAN, USER_GROUP_BASIC_PLAN
+    return QueryPlan(Role, only=ROLE_BASIC_PLAN.only, prefetch={
+        'permissions': PERMISSION_BASIC_PLAN,
+        'user_set': USER_BASIC_PLAN,
+        'usergroup_set': USER_GROUP_BASIC_PLAN,
+    })
+
 
 def format_permission_data(permission: Permission, only_basic=False):
     """格式化权限数据"""
@@ -50,6 +92,103 @@ def format_role_data(role: Role, only_basic=False):
         })
     return res
 
+def _get_group_with_ancestors(group_paths):
+    """根据用户组的物化路径获取用户组及其所有父级用户组（由近到远，不查询数据库）"""
+    result = []
+    for group_path in group_paths:
+        for group_id in reversed(UserGroup.parse_path(group_path)):
+            if group_id not in result:
+                result.append(group_id)
+    return result
+
+
+def resolve_users_perm_json(users):
+    """批量解析用户的合并权限JSON（不读写缓存）
+
+    查询次数与用户数量、用户组层级无关：
+    - 父级用户组由用户组的物化路径直接解析
+    - 每张中间表（用户-用户组、用户-权限、用户-角色、用户组-权限、用户组-角色、角色-权限）各查询一次
+    - 一次查询所有涉及的权限（含所有用户都拥有的权限）
+
+    合并顺序与之前保持一致：用户直接权限、所有用户都拥有的权限、用户角色权限、用户组（含父级）权限及其角色权限
+
+    Args:
+        users: 用户对象列表
+    Returns:
+        {user.uuid: merged_permission_json}
+    """
+    users = list(users)
+    if not users:
+        return {}
+    user_ids = [user.uuid for user in users]
+
+    # 用户所在的（未删除的）用户组，以及这些用户组的所有父级用户组
+    user_direct_group_paths = {user_id: [] for user_id in user_ids}
+    for user_id, group_path in UserGroup.users.through.objects.filter(
+            user_id__in=user_ids, usergroup__is_del=False).values_list('user_id', 'usergroup__path'):
+        user_direct_group_paths[user_id].append(group_path)
+
+    user_group_ids = {
+        user_id: _get_group_with_ancestors(group_paths)
+        for user_id, group_paths in user_direct_group_paths.items()
+    }
+    all_group_ids = {group_id for group_ids in user_group_ids.values() for group_id in group_ids}
+
+    def _group_rows(through, owner_field, owner_ids, target_field):
+        rows = {}
+        for owner_id, target_id in through.objects.filter(
+                **{f'{owner_field}_id__in': owner_ids, f'{target_field}__is_del': False}
+        ).values_list(f'{owner_field}_id', f'{target_field}_id'):
+            rows.setdefault(owner_id, []).append(target_id)
+        return rows
+
+    user_permission_ids = _group_rows(User.permissions.through, 'user', user_ids, 'permission')
+    user_role_ids = _group_rows(User.roles.through, 'user', user_ids, 'role')
+    group_permission_ids = _group_rows(UserGroup.permissions.through, 'usergroup', all_group_ids, 'permission')
+    group_role_ids = _group_rows(UserGroup.roles.through, 'usergroup', all_group_ids, 'role')
+
+    all_role_ids = {role_id for role_ids in user_role_ids.values() for role_id in role_ids}
+    all_role_ids |= {role_id for role_ids in group_role_ids.values() for role_id in role_ids}
+    role_permission_ids = _group_rows(Role.permissions.through, 'role', all_role_ids, 'permission')
+
+    all_permission_ids = set()
+    for permission_ids_map in (user_permission_ids, group_permission_ids, role_permission_ids):
+        for permission_ids in permission_ids_map.values():
+            all_permission_ids.update(permission_ids)
+
+    # 所有用户都拥有的权限与其他权限一次查出
+    permission_jsons = {}
+    everyone_base_perm_id = None
+    for permission_id, code, permission_json in Permission.objects.filter(
+            Q(uuid__in=all_permission_ids) | Q(code='everyone_base_perm')
+    ).values_list('uuid', 'code', 'permission_json'):
+        permission_jsons[permission_id] = permission_json
+        if code == 'everyone_base_perm':
+            everyone_base_perm_id = permission_id
+
+    result = {}
+    for user_id in user_ids:
+        ordered_permission_ids = list(user_permission_ids.get(user_id, []))
+        if everyone_base_perm_id is not None:
+            ordered_permission_ids.append(everyone_base_perm_id)
+        for role_id in user_role_ids.get(user_id, []):
+            ordered_permission_ids.extend(role_permission_ids.get(role_id, []))
+        for group_id in user_group_ids[user_id]:
+            ordered_permission_ids.extend(group_permission_ids.get(group_id, []))
+            for role_id in group_role_ids.get(group_id, []):
+                ordered_permission_ids.extend(role_permission_ids.get(role_id, []))
+
+        # 同一权限只合并一次
+        ordered_permission_ids = list(dict.fromkeys(ordered_permission_ids))
+        result[user_id] = merge_jsons([
+            permission_jsons[permission_id]
+            for permission_id in ordered_permission_ids
+            if permission_id in permission_jsons
+        ])
+
+    return result
+
+
 def get_user_perm_json_all(user_uuid, is_user_name=False):
     """获取所有用户权限组成的json
     
@@ -61,73 +200,16 @@ def get_user_perm_json_all(user_uuid, is_user_name=False):
     - 用户所在用户组的所有父级用户组的权限
     - 用户所在用户组的所有父级用户组的角色包含的权限
     """
-    try:
-        redis_key = f"user_perm_json_all:{user_uuid}"
-        
-        user_perm_json_all = get_redis_value(
-            redis_db_name='default',
-            redis_key_name=redis_key
-        )
-        if user_perm_json_all:
-            return user_perm_json_all
-
-        # color_logger.debug(f"获取用户权限JSON: {user_uuid}")
+    def _load(key):
         if is_user_name:
-            user = User.objects.get(username=user_uuid)
+            user = User.objects.get(username=key)
         else:
-            user = User.objects.get(uuid=user_uuid)
+            user = User.objects.get(uuid=key)
         assert user, '用户不存在'
-        
-        # 1. 获取用户直接拥有的权限JSON
-        # color_logger.debug(f"获取用户直接拥有的权限JSON: {user.permissions.all()}")
-        user_permission_jsons = [p.permission_json for p in user.permissions.all()]
-        
-        # 所有用户都拥有的权限
-        everyone_base_perm = Permission.objects.filter(code='everyone_base_perm').first()
-        if everyone_base_perm:
-            user_permission_jsons.append(everyone_base_perm.permission_json)
-
-        # 2. 获取用户角色包含的权限JSON
-        # color_logger.debug(f"获取用户角色包含的权限JSON: {user.roles.all()}")
-        role_permission_jsons = []
-        for role in user.roles.all():
-            role_permission_jsons.extend([p.permission_json for p in role.permissions.all()])
-            
-        # 3. 获取用户所在用户组的权限JSON
-        # color_logger.debug(f"获取用户所在用户组的权限JSON: {UserGroup.objects.filter(users=user)}")
-        group_permission_jsons = []
-        user_direct_groups = UserGroup.objects.filter(users=user)
-        # color_logger.debug(f"获取用户直接用户组: {user_direct_groups}")
-
-        all_groups = list(user_direct_groups)
-        for group in user_direct_groups:
-            all_groups.extend(group.get_type_all_parent_type())
-        # color_logger.debug(f"获取用户所有用户组: {all_groups}")
-        
-        for group in all_groups:
-            # 用户组直接拥有的权限
-            # color_logger.debug(f"获取用户组直接拥有的权限JSON: {group.permissions.all()}")
-            group_permission_jsons.extend([p.permission_json for p in group.permissions.all()])
-            # 用户组角色包含的权限
-            for role in group.roles.all():
-                # color_logger.debug(f"获取用户组角色包含的权限JSON: {role.permissions.all()}")
-                group_permission_jsons.extend([p.permission_json for p in role.permissions.all()])
-        
-        # 合并所有权限JSON
-        # color_logger.debug(f"({user_uuid})合并所有权限JSON: {user_permission_jsons + role_permission_jsons + group_permission_jsons}")
-        all_permission_jsons = user_permission_jsons + role_permission_jsons + group_permission_jsons
-        merged_permission_json = merge_jsons(all_permission_jsons)
-        # color_logger.debug(f"({user_uuid})合并后的权限JSON: {merged_permission_json}")
-        
-        set_redis_value(
-            redis_db_name='default',
-            redis_key_name=redis_key,
-            redis_key_value=merged_permission_json,
-            set_expire=60
-        )
-
-        return merged_permission_json
-        
+        return resolve_users_perm_json([user])[user.uuid]
+
+    try:
+        return user_perm_json_cache.get(user_uuid, loader=_load)
     except User.DoesNotExist:
         color_logger.error(f"用户不存在: {user_uuid}")
         return {}
@@ -136,6 +218,49 @@ def get_user_perm_json_all(user_uuid, is_user_name=False):
         return {}
 
 
+def get_users_perm_json_all(user_uuids, is_user_name=False):
+    """批量获取用户权限组成的json，用于管理页面和缓存预热
+
+    先批量读取缓存，未命中的用户一次性解析后批量写回缓存（解析期间缓存被失效时不写回）
+
+    Returns:
+        {user_uuid(或username): merged_permission_json}，不存在的用户不包含在结果中
+    """
+    user_uuids = list(dict.fromkeys(user_uuids))
+    if not user_uuids:
+        return {}
+
+    # 在读取数据库之前取版本号
+    version = user_perm_json_cache.get_version()
+    cached = user_perm_json_cache.get_many(user_uuids)
+    result = {}
+    missing = []
+    for user_uuid in user_uuids:
+        user_perm_json_all = cached.get(str(user_uuid))
+        if user_perm_json_all:
+            result[user_uuid] = user_perm_json_all
+        else:
+            missing.append(user_uuid)
+
+    if not missing:
+        return result
+
+    lookup_field = 'username' if is_user_name else 'uuid'
+    users = list(User.objects.filter(**{f'{lookup_field}__in': missing}))
+    resolved = resolve_users_perm_json(users)
+
+    # 调用方传入的可能是字符串形式的uuid，结果以传入的值为键
+    requested_keys = {str(user_uuid): user_uuid for user_uuid in missing}
+    to_cache = {}
+    for user in users:
+        user_key = requested_keys[str(getattr(user, lookup_field))]
+        result[user_key] = resolved[user.uuid]
+        to_cache[user_key] = resolved[user.uuid]
+    user_perm_json_cache.set_many(to_cache, version=version)
+
+    return result
+
+
 def check_user_api_permission(user_uuid, check_permission_dict, is_user_name=False):
     """
     检查用户是否具有api权限
@@ -149,15 +274,35 @@ def check_user_api_permission(user_uuid, check_permission_dict, is_user_name=Fal
     user_api_permission_in_server = user_api_permission_in_server.get('backend', {}).get('api', {})
     # color_logger.debug(f"用户api权限JSON: {user_api_permission_in_server}")
 
+    # api路径支持 "*"、"{param}" 通配，编译后的匹配器按权限文档缓存
+    api_matcher = get_route_matcher(user_api_permission_in_server)
     for check_api, check_methods in check_permission_dict.items():
-        if check_api not in user_api_permission_in_server:
-            return False
-        
-        allow_methods = user_api_permission_in_server[check_api]
-        if isinstance(check_methods, str):
-            check_methods = [check_methods]
-        if len(set(check_methods) - set(allow_methods)) > 0:
+        if not api_matcher.allows(check_api, check_methods):
             return False
 
     return True
 
+
+def invalidate_user_perm_json_cache(users=None):
+    """使用户的合并权限JSON缓存失效
+
+    users: 用户对象或 (uuid, username) 列表；为 None 时使所有用户的缓存失效
+
+    同时通知所有进程移除进程内缓存
+    """
+    if users is None:
+        user_perm_json_cache.invalidate()
+        color_logger.debug("失效所有用户权限JSON缓存")
+        return
+
+    keys = []
+    for user in users:
+        user_uuid, username = (user.uuid, user.username) if isinstance(user, User) else user
+        keys.append(user_uuid)
+        keys.append(username)
+
+    if not keys:
+        return
+
+    user_perm_json_cache.invalidate(keys)
+    color_logger.debug(f"失效用户权限JSON缓存: {len(keys)} 个键")
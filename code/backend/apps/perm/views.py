@@ -1,7 +1,9 @@
-from .utils import format_permission_data, format_role_data, get_user_perm_json_all
+from .utils import (
+    format_permission_data, format_role_data, get_permission_query_plan, get_role_query_plan, get_user_perm_json_all
+)
 from lib.request_tool import pub_get_request_body, pub_success_response, pub_error_response
 from .models import Permission, Role
-from lib.paginator_tool import pub_paging_tool
+from lib.paginator_tool import pub_paging_response_data
 from lib.log import color_logger
 from django.db.models import Q
 # Create your views here.
@@ -14,11 +16,9 @@ def permission_list(request):
 
         if request.method == 'GET':
 
-            page = int(body.get('page', 1))
-            page_size = int(body.get('page_size', 20))
             search = body.get('search', '')
             
-            permission_list = Permission.objects.all().order_by('name')
+            permission_list = get_permission_query_plan().apply(Permission.objects.all()).order_by('name')
             # 添加搜索功能
             if search:
                 permission_list = permission_list.filter(
@@ -26,18 +26,13 @@ def permission_list(request):
                     Q(code__icontains=search)
                 )
                 
-            # 分页查询
-            has_next, next_page, page_list, all_num, result = pub_paging_tool(page, permission_list, page_size)
+            # 分页查询（请求带 cursor 参数时使用游标分页）
+            page_info, result = pub_paging_response_data(body, permission_list, ordering=('name', 'uuid'))
             
             # 格式化返回数据
             result = [format_permission_data(permission) for permission in result]
             
-            return pub_success_response({
-                'has_next': has_next,
-                'next_page': next_page,
-                'all_num': all_num,
-                'data': result
-            })
+            return pub_success_response({**page_info, 'data': result})
         elif request.method == 'DELETE':
             uuids = body.get('uuids', [])
             permissions = Permission.objects.filter(uuid__in=uuids)
@@ -115,11 +110,9 @@ def role_list(request):
         body = pub_get_request_body(request)
         if request.method == 'GET':
 
-            page = int(body.get('page', 1))
-            page_size = int(body.get('page_size', 20))
             search = body.get('search', '')
 
-            role_list = Role.objects.all().order_by('name')
+            role_list = get_role_query_plan().apply(Role.objects.all()).order_by('name')
             # 添加搜索功能
             if search:
                 role_list = role_list.filter(
@@ -127,18 +120,13 @@ def role_list(request):
                     Q(code__icontains=search)
                 )
                 
-            # 分页查询
-            has_next, next_page, page_list, all_num, result = pub_paging_tool(page, role_list, page_size)
+            # 分页查询（请求带 cursor 参数时使用游标分页）
+            page_info, result = pub_paging_response_data(body, role_list, ordering=('name', 'uuid'))
             
             # 格式化返回数据
             result = [format_role_data(role) for role in result]
             
-            return pub_success_response({
-                'has_next': has_next,
-                'next_page': next_page,
-                'all_num': all_num,
-                'data': result
-            })
+            return pub_success_response({**page_info, 'data': result})
         elif request.method == 'DELETE':
             uuids = body.get('uuids', [])
             roles = Role.objects.filter(uuid__in=uuids)
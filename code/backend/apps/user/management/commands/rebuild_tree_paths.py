@@ -0,0 +1,18 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from lib.log import color_logger
+from lib.model_tools import BaseTypeTree
+
+
+class Command(BaseCommand):
+    help = 'Backfill materialized paths of all type tree models'
+
+    def handle(self, *args, **options):
+        for model in apps.get_models():
+            if not issubclass(model, BaseTypeTree):
+                continue
+
+            updated = model.rebuild_paths()
+            color_logger.info(f'重建类型树路径: {model.__name__}, 更新节点数量: {updated}')
+            self.stdout.write(self.style.SUCCESS(f'{model.__name__}: rebuilt {updated} paths'))
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+def backfill_usergroup_path(apps, schema_editor):
+    """按父子关系回填用户组的物化路径"""
+    UserGroup = apps.get_model('user', 'UserGroup')
+    nodes = list(UserGroup.objects.only('uuid', 'parent_id', 'path'))
+    children_map = {}
+    for node in nodes:
+        children_map.setdefault(node.parent_id, []).append(node)
+
+    stack = [(node, '/') for node in children_map.get(None, [])]
+    while stack:
+        node, parent_path = stack.pop()
+        node.path = f"{parent_path}{node.uuid.hex}/"
+        stack.extend((child, node.path) for child in children_map.get(node.uuid, []))
+
+    UserGroup.objects.bulk_update(nodes, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0007_systemconfig'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usergroup',
+            name='path',
+            field=models.CharField(db_index=True, default='', max_length=759, verbose_name='物化路径'),
+        ),
+        migrations.RunPython(backfill_usergroup_path, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 import re
 from lib.log import color_logger
 from .models import SystemConfig
+from .utils import get_system_config_value
 import json
 
 def validate_password_strength(password: str, config: dict = None) -> tuple[bool, str]:
@@ -60,9 +61,9 @@ def validate_password_strength(password: str, config: dict = None) -> tuple[bool
 def get_password_strength_config() -> dict:
     """获取密码强度配置，先从数据库获取，如果没有则使用默认配置"""
     try:
-        config_obj = SystemConfig.objects.filter(config_key='password_strength_config').first()
-        if config_obj:
-            return json.loads(config_obj.config_value)
+        config_value = get_system_config_value('password_strength_config')
+        if config_value:
+            return json.loads(config_value)
     except Exception as e:
         color_logger.warning(f"获取密码强度配置失败，使用默认配置: {e}")
 
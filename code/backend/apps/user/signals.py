@@ -0,0 +1,23 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from lib.log import color_logger
+from .models import SystemConfig
+from .utils import system_config_cache
+
+
+def _on_system_config_changed(sender, instance, **kwargs):
+    config_key = instance.config_key
+
+    def _invalidate():
+        try:
+            system_config_cache.invalidate([config_key])
+        except Exception as e:
+            color_logger.error(f"失效系统配置缓存失败: {config_key}, {e}")
+
+    # 提交后再失效，避免提交前有请求读取到旧数据并重新写入缓存
+    transaction.on_commit(_invalidate)
+
+
+post_save.connect(_on_system_config_changed, sender=SystemConfig, dispatch_uid='config_cache_SystemConfig_saved')
+post_delete.connect(_on_system_config_changed, sender=SystemConfig, dispatch_uid='config_cache_SystemConfig_deleted')
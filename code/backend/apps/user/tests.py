@@ -1,3 +1,124 @@
-from django.test import TestCase
+import json
+
+from django.test import RequestFactory, TestCase
+
+from apps.perm.models import Permission, Role
+from apps.perm.utils import get_permission_query_plan, get_role_query_plan
+from apps.perm.views import permission_list, role_list
+from .models import User, UserGroup
+from .utils import get_user_group_query_plan, get_user_query_plan
+from .views import user_group_list, user_list
 
 # Create your tests here.
+
+
+def prefetch_query_count(plan):
+    """查询计划中每个预取的关联（含嵌套的预取）各查询一次"""
+    return sum(1 + prefetch_query_count(sub_plan) for sub_plan in plan.prefetch.values())
+
+
+def list_query_count(plan, cursor=False):
+    """列表接口的查询次数：页码分页为 COUNT(*) + 当前页 + 预取，游标分页不执行 COUNT(*)"""
+    return (1 if cursor else 2) + prefetch_query_count(plan)
+
+
+class ListViewQueryCountTest(TestCase):
+    """列表接口的查询次数固定，不随记录数量和关联数量增长（防止 N+1 查询）"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.add_records(0, 3)
+
+    @classmethod
+    def add_records(cls, start, count):
+        """创建 count 组互相关联的权限、角色、用户和用户组"""
+        for i in range(start, start + count):
+            permission = Permission.objects.create(name=f'权限{i}', code=f'perm_{i}', permission_json={})
+            role = Role.objects.create(name=f'角色{i}', code=f'role_{i}')
+            role.permissions.add(permission)
+
+            user = User.objects.create(username=f'user_{i}', nickname=f'用户{i}')
+            user.roles.add(role)
+            user.permissions.add(permission)
+
+            user_group = UserGroup.objects.create(name=f'用户组{i}', code=f'group_{i}')
+            user_group.users.add(user)
+            user_group.roles.add(role)
+            user_group.permissions.add(permission)
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def assert_list_query_count(self, view, path, plan):
+        request = self.factory.get(path, {'page': 1, 'page_size': 20})
+        with self.assertNumQueries(list_query_count(plan)):
+            response = view(request)
+
+        result = json.loads(response.content)
+        self.assertTrue(result['success'], result['msg'])
+        return result['data']
+
+    def assert_list_query_count_constant(self, view, path, plan):
+        """增加记录前后查询次数相同"""
+        data = self.assert_list_query_count(view, path, plan)
+        self.assertEqual(len(data['data']), 3)
+
+        self.add_records(3, 5)
+        data = self.assert_list_query_count(view, path, plan)
+        self.assertEqual(len(data['data']), 8)
+
+    def test_user_list(self):
+        self.assert_list_query_count_constant(user_list, '/api/v1/user/users/', get_user_query_plan())
+
+    def test_user_group_list(self):
+        self.assert_list_query_count_constant(
+            user_group_list, '/api/v1/user/groups/', get_user_group_query_plan())
+
+    def test_role_list(self):
+        self.assert_list_query_count_constant(role_list, '/api/v1/perm/roles/', get_role_query_plan())
+
+    def test_permission_list(self):
+        self.assert_list_query_count_constant(
+            permission_list, '/api/v1/perm/permissions/', get_permission_query_plan())
+
+    def test_user_list_cursor(self):
+        """游标分页读取下一页游标时不会因 only() 未加载排序字段而逐条查询"""
+        request = self.factory.get('/api/v1/user/users/', {'cursor': '', 'page_size': 2})
+        with self.assertNumQueries(list_query_count(get_user_query_plan(), cursor=True)):
+            response = user_list(request)
+
+        result = json.loads(response.content)
+        self.assertTrue(result['success'], result['msg'])
+        self.assertTrue(result['data']['has_next'])
+        self.assertEqual(len(result['data']['data']), 2)
+
+    def test_user_list_relations(self):
+        """预取的关联数据完整返回"""
+        data = self.assert_list_query_count(user_list, '/api/v1/user/users/', get_user_query_plan())
+        user = next(item for item in data['data'] if item['username'] == 'user_0')
+        self.assertEqual([role['code'] for role in user['roles']], ['role_0'])
+        self.assertEqual([permission['code'] for permission in user['permissions']], ['perm_0'])
+        self.assertEqual([group['name'] for group in user['groups']], ['用户组0'])
+
+
+class BulkUpdateNodesDepthTest(TestCase):
+    """批量更新类型树时与 save 相同地限制层级，超出时不写入任何节点"""
+
+    @staticmethod
+    def build_chain(depth):
+        type_tree = {'code': 'group_0', 'name': '用户组0', 'children': []}
+        node_data = type_tree
+        for i in range(1, depth):
+            child = {'code': f'group_{i}', 'name': f'用户组{i}', 'children': []}
+            node_data['children'].append(child)
+            node_data = child
+        return type_tree
+
+    def test_max_depth(self):
+        UserGroup.bulk_update_nodes(self.build_chain(UserGroup.MAX_TREE_DEPTH))
+        self.assertEqual(UserGroup.objects.count(), UserGroup.MAX_TREE_DEPTH)
+
+    def test_too_deep(self):
+        with self.assertRaisesMessage(ValueError, f'类型树层级过深，最多{UserGroup.MAX_TREE_DEPTH}层'):
+            UserGroup.bulk_update_nodes(self.build_chain(UserGroup.MAX_TREE_DEPTH + 1))
+        self.assertFalse(UserGroup.all_objects.exists())
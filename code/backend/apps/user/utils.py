@@ -1,6 +1,57 @@
 from typing import Tuple, List, Dict, Optional, Any
+from backend.settings import config_data
 from lib.time_tools import utc_obj_to_time_zone_str
-from apps.user.models import User, UserGroup
+from apps.user.models import SystemConfig, User, UserGroup
+from lib.query_plan import QueryPlan
+from lib.two_tier_cache import TwoTierCache
+
+# 格式化函数 only_basic=True 时用到的字段
+USER_BASIC_PLAN = QueryPlan(User, only=['uuid', 'username', 'nickname', 'email', 'is_ldap', 'is_active'])
+USER_GROUP_BASIC_PLAN = QueryPlan(
+    UserGroup, only=['uuid', 'create_time', 'update_time', 'name', 'description', 'parent'])
+
+# 系统配置缓存，键为 config_key；配置变更时由 apps/user/signals.py 主动失效
+system_config_cache = TwoTierCache(
+    namespace='system_config',
+    ttl=config_data.get('TWO_TIER_CACHE', {}).get('CONFIG_TTL', 300),
+)
+
+
+def _load_system_config(config_key):
+    # 不存在的配置同样缓存，避免每次都查询数据库
+    config_value = SystemConfig.objects.filter(config_key=config_key).values_list('config_value', flat=True).first()
+    return {'config_value': config_value}
+
+
+def get_system_config_value(config_key):
+    """获取系统配置的值（两级缓存），不存在时返回 None"""
+    return system_config_cache.get(config_key, loader=_load_system_config)['config_value']
+
+
+def get_user_query_plan(only_basic=False):
+    """format_user_data 对应的查询计划"""
+    if only_basic:
+        return USER_BASIC_PLAN
+
+    from apps.perm.utils import PERMISSION_BASIC_PLAN, ROLE_BASIC_PLAN
+    return QueryPlan(User, only=USER_BASIC_PLAN.only, prefetch={
+        'roles': ROLE_BASIC_PLAN,
+        'permissions': PERMISSION_BASIC_PLAN,
+        'usergroup_set': USER_GROUP_BASIC_PLAN,
+    })
+
+
+def get_user_group_query_plan(only_basic=False):
+    """format_user_group_data 对应的查询计划"""
+    if only_basic:
+        return USER_GROUP_BASIC_PLAN
+
+    from apps.perm.utils import PERMISSION_BASIC_PLAN, ROLE_BASIC_PLAN
+    return QueryPlan(UserGroup, only=USER_GROUP_BASIC_PLAN.only, prefetch={
+        'users': USER_BASIC_PLAN,
+        'roles': ROLE_BASIC_PLAN,
+        'permissions': PERMISSION_BASIC_PLAN,
+    })
 
 
 def format_user_data(user_data: Dict[str, Any], 
@@ -49,7 +100,7 @@ def format_user_group_data(user_group: UserGroup, only_basic: bool = False):
 
         'name': user_group.name,
         'description': user_group.description,
-        'parent': user_group.parent.uuid if user_group.parent else None,
+        'parent': user_group.parent_id,
     }
 
     if not only_basic:
@@ -1,13 +1,14 @@
 from lib.password_tools import aes
-from .utils import format_user_data, format_user_group_data
+from .utils import format_user_data, format_user_group_data, get_user_group_query_plan, get_user_query_plan
 from lib.request_tool import pub_get_request_body, pub_success_response, pub_error_response
 from .models import User, UserGroup
 from apps.perm.models import Role, Permission
-from lib.paginator_tool import pub_paging_tool
+from lib.paginator_tool import pub_paging_response_data
 from lib.log import color_logger
 from django.db.models import Q
 from django.contrib.auth.hashers import check_password, make_password
 from .password_validator import validate_password_strength
+from apps.myAuth.token_utils import TokenManager
 import json
 
 # Create your views here.
@@ -19,11 +20,9 @@ def user_list(request):
         body = pub_get_request_body(request)
         if request.method == 'GET':
 
-            page = int(body.get('page', 1))
-            page_size = int(body.get('page_size', 20))
             search = body.get('search', '')
 
-            user_list = User.objects.all()
+            user_list = get_user_query_plan().apply(User.objects.all())
             # 添加搜索功能
             if search:
                 user_list = user_list.filter(
@@ -33,18 +32,13 @@ def user_list(request):
                     Q(email__icontains=search)
                 )
 
-            # 分页查询
-            has_next, next_page, page_list, all_num, result = pub_paging_tool(page, user_list, page_size)
+            # 分页查询（请求带 cursor 参数时使用游标分页）
+            page_info, result = pub_paging_response_data(body, user_list)
 
             # 格式化返回数据
             result = [format_user_data(user) for user in result]
 
-            return pub_success_response({
-                    'has_next': has_next,
-                    'next_page': next_page,
-                    'all_num': all_num,
-                    'data': result
-                })
+            return pub_success_response({**page_info, 'data': result})
         elif request.method == 'DELETE':
             uuids = body.get('uuids', [])
             users = User.objects.filter(uuid__in=uuids)
@@ -132,28 +126,22 @@ def user_group_list(request):
 
         if request.method == 'GET':
 
-            page = int(body.get('page', 1))
-            page_size = int(body.get('page_size', 20))
             search = body.get('search', '')
 
             # 分页查询
-            user_group_list = UserGroup.objects.all()
+            user_group_list = get_user_group_query_plan().apply(UserGroup.objects.all())
             # 添加搜索功能
             if search:
                 user_group_list = user_group_list.filter(
                     Q(name__icontains=search) |
                     Q(code__icontains=search)
                 )
-            has_next, next_page, page_list, all_num, result = pub_paging_tool(page, user_group_list, page_size)
+            # 请求带 cursor 参数时使用游标分页
+            page_info, result = pub_paging_response_data(body, user_group_list)
             # 格式化返回数据
             result = [format_user_group_data(user_group) for user_group in result]
 
-            return pub_success_response({
-                'has_next': has_next,
-                'next_page': next_page,
-                'all_num': all_num,
-                'data': result
-            })
+            return pub_success_response({**page_info, 'data': result})
         elif request.method == 'DELETE':
             uuids = body.get('uuids', [])
             user_groups = UserGroup.objects.filter(uuid__in=uuids)
@@ -293,6 +281,9 @@ def change_password(request):
         user.set_password(new_password)  # 使用Django的密码哈希
         user.save()
 
+        # 吊销该用户的其他会话，保留当前会话
+        TokenManager().invalidate_all_user_sessions_except_current(user.username, getattr(request, 'session_id', None))
+
         color_logger.info(f"用户 {user.username} 修改密码成功")
         return pub_success_response(msg='密码修改成功')
 
@@ -348,6 +339,9 @@ def reset_password(request):
         target_user.set_password(new_password)  # 使用Django的密码哈希
         target_user.save()
 
+        # 吊销目标用户的所有会话
+        TokenManager().invalidate_tokens(target_user.username)
+
         color_logger.info(f"用户 {current_user.username} 为用户 {target_user.username} 重置密码成功")
         return pub_success_response(msg='密码重置成功')
 
@@ -7,6 +7,7 @@ from celery import Celery
 from celery.schedules import crontab
 
 from backend.settings import config_data, set_color_logger_level
+from lib.auth_context import setup_celery_auth_context
 
 set_color_logger_level(config_data.get('LOG_LEVEL', "DEBUG"))
 
@@ -39,17 +40,37 @@ app.conf.update(
 
 app.autodiscover_tasks()
 
+# 认证上下文随任务传递，任务内的审计日志可以取到发起请求的用户
+setup_celery_auth_context()
+
 # 添加定时任务配置
 app.conf.update(
     imports=(
         'apps.demo.tasks',
+        'apps.audit.tasks',
+        'lib.redis_tool',
     ),
     beat_schedule={
         # 每30秒 测试任务
         'say-hello': {
             'task': 'apps.demo.tasks.say_hello',
             'schedule': timedelta(seconds=30),
-        }
+        },
+        # 消费Redis Stream中的审计日志（仅 AUDIT.SINK_BACKEND 为 redis_stream 时生效）
+        'drain-audit-log-stream': {
+            'task': 'apps.audit.tasks.drain_audit_log_stream',
+            'schedule': timedelta(seconds=config_data.get('AUDIT', {}).get('STREAM_DRAIN_INTERVAL', 5)),
+        },
+        # 审计日志小时统计（按水位增量处理新记录）
+        'rollup-audit-logs': {
+            'task': 'apps.audit.tasks.rollup_audit_logs',
+            'schedule': timedelta(seconds=config_data.get('AUDIT', {}).get('ROLLUP_INTERVAL', 60)),
+        },
+        # 每天凌晨归档过期的审计日志分区
+        'archive-audit-logs': {
+            'task': 'apps.audit.tasks.archive_audit_logs',
+            'schedule': crontab(hour=3, minute=30),
+        },
     }
 )
 
@@ -112,6 +112,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
+    'lib.redis_tool.RedisWriteBehindMiddleware',  # 以请求为范围合并可延迟的Redis写入
+    'apps.audit.sink.AuditSinkMiddleware',  # 以请求为范围缓冲审计日志
     'apps.myAuth.middleware.AuthMiddleware',
 ]
 
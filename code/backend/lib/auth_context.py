@@ -0,0 +1,122 @@
+import contextvars
+
+from lib.log import color_logger
+
+# 当前请求（或 celery 任务）的认证上下文
+# 使用 contextvar 而不是线程本地存储，ASGI 下同一线程内的并发请求互不影响
+_auth_context = contextvars.ContextVar('auth_context', default=None)
+
+# celery 消息头中传递认证上下文的键名
+CELERY_AUTH_CONTEXT_HEADER = 'auth_context'
+
+
+class AuthContext:
+    """请求范围内已校验的认证信息
+
+    AuthMiddleware 校验 token 后写入 payload，下游（审计日志、路由等）直接读取，
+    一个请求只校验一次 token。白名单路径等未经中间件校验的请求在首次读取时校验一次并缓存。
+
+    Args:
+        access_token: 请求中的 access token（不会传递到 celery 任务）
+        ip_address: 客户端IP
+        payload: 已校验的 token payload
+    """
+
+    __slots__ = ('access_token', 'ip_address', 'payload', '_verified')
+
+    def __init__(self, access_token=None, ip_address=None, payload=None):
+        self.access_token = access_token
+        self.ip_address = ip_address
+        self.payload = payload
+        self._verified = payload is not None
+
+    def set_payload(self, payload):
+        """写入已校验的 payload"""
+        self.payload = payload
+        self._verified = True
+
+    def get_payload(self):
+        """获取已校验的 payload，未校验时校验一次并缓存，校验失败返回 None"""
+        if not self._verified:
+            self._verified = True
+            if self.access_token and self.access_token not in ('undefined', 'null'):
+                from apps.myAuth.token_utils import TokenManager
+                try:
+                    self.payload = TokenManager().verify_token_with_cache(self.access_token) or None
+                except Exception as e:
+                    color_logger.error(f"认证上下文校验token失败: {e}")
+                    self.payload = None
+        return self.payload
+
+    @property
+    def username(self):
+        payload = self.get_payload()
+        return payload.get('username') if payload else None
+
+    @property
+    def session_id(self):
+        payload = self.get_payload()
+        return payload.get('session_id') if payload else None
+
+    def to_dict(self):
+        """序列化为可传递给 celery 任务的字典（只包含已校验的信息）"""
+        return {
+            'ip_address': self.ip_address,
+            'payload': self.get_payload(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(ip_address=data.get('ip_address'), payload=data.get('payload'))
+
+
+def get_auth_context():
+    """获取当前认证上下文，不在请求或任务范围内时返回 None"""
+    return _auth_context.get()
+
+
+def set_auth_context(auth_context):
+    """设置当前认证上下文，返回用于 reset_auth_context 的令牌"""
+    return _auth_context.set(auth_context)
+
+
+def reset_auth_context(context_token):
+    """恢复到设置之前的认证上下文"""
+    _auth_context.reset(context_token)
+
+
+def get_current_username():
+    """当前认证上下文中的用户名，未登录或不在请求范围内时返回 None"""
+    auth_context = get_auth_context()
+    return auth_context.username if auth_context else None
+
+
+def _publish_auth_context(headers=None, **kwargs):
+    """发布任务时将当前认证上下文写入消息头"""
+    auth_context = get_auth_context()
+    if auth_context is None or headers is None:
+        return
+    try:
+        headers[CELERY_AUTH_CONTEXT_HEADER] = auth_context.to_dict()
+    except Exception as e:
+        color_logger.error(f"传递认证上下文到celery任务失败: {e}")
+
+
+def _restore_auth_context(task=None, **kwargs):
+    """任务开始执行时从消息头恢复认证上下文"""
+    data = getattr(task.request, CELERY_AUTH_CONTEXT_HEADER, None) if task else None
+    _auth_context.set(AuthContext.from_dict(data) if data else None)
+
+
+def _clear_auth_context(**kwargs):
+    """任务执行结束后清除认证上下文，避免泄漏到同一 worker 的下一个任务"""
+    _auth_context.set(None)
+
+
+def setup_celery_auth_context():
+    """连接 celery 信号，使认证上下文随任务传递（发布方和 worker 都需要调用）"""
+    from celery.signals import before_task_publish, task_prerun, task_postrun
+
+    before_task_publish.connect(_publish_auth_context, weak=False, dispatch_uid='auth_context_publish')
+    task_prerun.connect(_restore_auth_context, weak=False, dispatch_uid='auth_context_restore')
+    task_postrun.connect(_clear_auth_context, weak=False, dispatch_uid='auth_context_clear')
@@ -2,10 +2,15 @@ import json
 from datetime import datetime, timezone
 from lib.log import color_logger
 
+def datetime_to_utc_str(o):
+    """datetime 转换为 UTC 时间字符串（精确到秒，以 Z 结尾）"""
+    return o.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
+
+
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, datetime):
-            return o.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
+            return datetime_to_utc_str(o)
 
         return super(DateTimeEncoder, self).default(o)
 
@@ -1,8 +1,25 @@
-from django.db import models
+from django.db import models, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from django.db.models import Max, Value
+from django.db.models.functions import Concat, Length, Substr
+import json
 import uuid
 from lib.log import color_logger
 from copy import deepcopy
 
+# 类型树批量更新完成后发送（代替逐行的 save/delete 信号）
+# 参数: sender=模型类, created/updated/deleted=节点列表, summary={'created': [code], 'updated': [code], 'deleted': [code]}
+tree_nodes_bulk_updated = Signal()
+
+
+def snapshot_value(value):
+    """字段快照中的值：JSONField 等可变值深拷贝，避免原地修改实例的值时快照跟着变化"""
+    if isinstance(value, (dict, list)):
+        return deepcopy(value)
+    return value
+
+
 class BaseManager(models.Manager):
     """
     自定义管理器，用于默认过滤掉 is_del=True 的数据
@@ -26,6 +43,40 @@ class BaseModel(models.Model):
     class Meta:
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """从数据库加载时记录字段快照，用于在保存时比较变更字段而无需再次查询"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: snapshot_value(value) for name, value in zip(field_names, values)}
+        return instance
+
+    def get_loaded_values(self):
+        """获取最近一次从数据库加载（或保存）时的字段快照 {attname: value}，新建的实例返回 None"""
+        return getattr(self, '_loaded_values', None)
+
+    def reset_loaded_values(self, update_fields=None):
+        """以当前字段值刷新快照（保存后调用）
+
+        指定 update_fields 时只刷新这些字段，延迟加载的字段不包含在内
+        """
+        deferred_fields = self.get_deferred_fields()
+        if update_fields is not None and self.get_loaded_values() is not None:
+            loaded_values = dict(self._loaded_values)
+            fields = [self._meta.get_field(name) for name in update_fields]
+        else:
+            loaded_values = {}
+            fields = self._meta.concrete_fields
+
+        for field in fields:
+            if field.concrete and field.attname not in deferred_fields:
+                loaded_values[field.attname] = snapshot_value(getattr(self, field.attname))
+        self._loaded_values = loaded_values
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # 所有 post_save 接收方都与保存前的快照比较，之后再刷新为下一次保存的比较基准
+        self.reset_loaded_values(kwargs.get('update_fields'))
+
     def delete(self):
         """
         覆盖 delete 方法，实现软删除
@@ -58,10 +109,91 @@ class BaseTypeTree(BaseModel):
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, verbose_name='父级类型')
     level = models.IntegerField(default=1, verbose_name='层级')
     sort = models.IntegerField(default=0, verbose_name='排序')
+    # 物化路径：从根节点到当前节点的 uuid(hex) 序列，如 "/<root>/<parent>/<self>/"
+    # 用于单次索引查询祖先/子孙节点；长度限制在 utf8mb4 索引上限内（每层33个字符，最多22层）
+    path = models.CharField(max_length=759, default='', db_index=True, verbose_name='物化路径')
 
     class Meta:
         abstract = True
 
+    PATH_SEPARATOR = '/'
+    PATH_MAX_LENGTH = 759
+    # 路径为 "/" + 每层 "<32位hex>/"
+    MAX_TREE_DEPTH = (PATH_MAX_LENGTH - 1) // 33
+
+    @classmethod
+    def build_path(cls, node_uuid, parent_path=''):
+        """根据父节点路径生成节点路径"""
+        return f"{parent_path or cls.PATH_SEPARATOR}{node_uuid.hex}{cls.PATH_SEPARATOR}"
+
+    @classmethod
+    def parse_path(cls, path):
+        """解析路径为 uuid 列表（从根节点到当前节点）"""
+        return [uuid.UUID(node_hex) for node_hex in path.strip(cls.PATH_SEPARATOR).split(cls.PATH_SEPARATOR) if node_hex]
+
+    def save(self, *args, **kwargs):
+        """保存时维护物化路径，父级变更时同步更新所有子孙节点的路径"""
+        parent_path = ''
+        if self.parent_id:
+            parent_path = self.__class__.all_objects.filter(pk=self.parent_id).values_list('path', flat=True).first()
+            if not parent_path:
+                raise ValueError('父级类型不存在或路径未初始化')
+            if f"{self.uuid.hex}{self.PATH_SEPARATOR}" in parent_path:
+                raise ValueError('不能将节点移动到自身或其子孙节点下')
+
+        new_path = self.build_path(self.uuid, parent_path)
+        if len(new_path) > self.PATH_MAX_LENGTH:
+            raise ValueError(f'类型树层级过深，最多{self.MAX_TREE_DEPTH}层')
+
+        if 'update_fields' in kwargs and kwargs['update_fields'] is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'path'}
+
+        # 子孙节点路径与节点自身在同一个事务中更新，保存失败时一起回滚
+        with transaction.atomic():
+            old_path = None
+            if not self._state.adding:
+                old_path = self.__class__.all_objects.filter(pk=self.pk).values_list('path', flat=True).first()
+
+            if old_path and old_path != new_path:
+                deepest = self.__class__.all_objects.filter(path__startswith=old_path).aggregate(
+                    max_length=Max(Length('path')))['max_length'] or len(old_path)
+                if deepest - len(old_path) + len(new_path) > self.PATH_MAX_LENGTH:
+                    raise ValueError(f'移动后子孙节点层级过深，最多{self.MAX_TREE_DEPTH}层')
+                # 先更新子孙节点，保证 post_save 信号中按新路径能查到所有子孙节点
+                self._rebase_descendant_paths(old_path, new_path)
+
+            self.path = new_path
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def _rebase_descendant_paths(cls, old_path, new_path):
+        """将路径前缀为 old_path 的节点（含节点自身）改为 new_path 前缀（单条 UPDATE）"""
+        updated = cls.all_objects.filter(path__startswith=old_path).update(
+            path=Concat(Value(new_path), Substr('path', len(old_path) + 1))
+        )
+        color_logger.debug(f"更新子孙节点路径: {cls.__name__} {old_path} -> {new_path}, 数量: {updated}")
+
+    @classmethod
+    def rebuild_paths(cls):
+        """按父子关系重建所有节点的路径（用于回填历史数据），返回更新的节点数量"""
+        nodes = list(cls.all_objects.only('uuid', 'parent_id', 'path'))
+        children_map = {}
+        for node in nodes:
+            children_map.setdefault(node.parent_id, []).append(node)
+
+        changed = []
+        stack = [(node, '') for node in children_map.get(None, [])]
+        while stack:
+            node, parent_path = stack.pop()
+            path = cls.build_path(node.uuid, parent_path)
+            if node.path != path:
+                node.path = path
+                changed.append(node)
+            stack.extend((child, path) for child in children_map.get(node.uuid, []))
+
+        cls.all_objects.bulk_update(changed, ['path'], batch_size=500)
+        return len(changed)
+
     def get_full_path(self):
         """获取完整路径"""
         if not self.parent:
@@ -84,9 +216,45 @@ class BaseTypeTree(BaseModel):
 
         return create_node(json_data)
     
+    @classmethod
+    def _iter_subtree_rows(cls, node, need_del=False, fields=()):
+        """按先序（路径字典序）逐行返回以 node 为根的子树节点（包含 node 自身）
+
+        单次查询，父节点总是先于子节点返回；不包含已删除节点时跳过其整个子树
+
+        Args:
+            fields: 除 uuid/parent_id/path/is_del 外需要返回的字段
+        """
+        rows = cls.all_objects.filter(path__startswith=node.path).order_by('path').values(
+            'uuid', 'parent_id', 'path', 'is_del', *fields
+        )
+
+        skip_prefix = None
+        for row in rows.iterator(chunk_size=1000):
+            if skip_prefix is not None and row['path'].startswith(skip_prefix):
+                continue
+            skip_prefix = None
+            if not need_del and row['is_del'] and row['path'] != node.path:
+                skip_prefix = row['path']
+                continue
+            yield row
+
+    @classmethod
+    def _tree_row_to_data(cls, row, need_del, extra_fields):
+        data = {
+            'uuid': row['uuid'],
+            'code': row['code'],
+            'name': row['name'],
+        }
+        for field in extra_fields:
+            data[field] = row[field]
+        if need_del:
+            data['is_del'] = row['is_del']
+        return data
+
     @classmethod
     def build_tree(cls, node, **kwargs):
-        """构建类型树
+        """构建类型树（单次查询，在内存中按父节点索引组装）
         
         Args:
             node: 节点对象
@@ -94,29 +262,48 @@ class BaseTypeTree(BaseModel):
                 need_del (bool): 是否包含已删除节点
                 extra_fields (list): 需要额外包含的字段列表
         """
-        data = {
-            'uuid': node.uuid,
-            'code': node.code,
-            'name': node.name,
-        }
-        
-        # 处理额外字段
-        extra_fields = kwargs.get('extra_fields', [])
-        if extra_fields:
-            for field in extra_fields:
-                data[field] = getattr(node, field)
+        need_del = kwargs.get('need_del', False)
+        extra_fields = list(kwargs.get('extra_fields', []))
+
+        root_data = None
+        node_index = {}
+        for row in cls._iter_subtree_rows(node, need_del, ['code', 'name', *extra_fields]):
+            data = cls._tree_row_to_data(row, need_del, extra_fields)
+            node_index[row['uuid']] = data
+            if root_data is None:
+                root_data = data
+            else:
+                node_index[row['parent_id']].setdefault('children', []).append(data)
+        return root_data
 
-        # 处理删除标记
+    @classmethod
+    def stream_tree_json(cls, node, **kwargs):
+        """以JSON文本片段的形式流式输出类型树，内存占用只与树的深度有关
+
+        参数与 build_tree 相同，可直接用于 StreamingHttpResponse
+        """
         need_del = kwargs.get('need_del', False)
-        if need_del:
-            data['is_del'] = node.is_del
-            children = cls.all_objects.filter(parent=node)
-        else:
-            children = cls.objects.filter(parent=node)
-        
-        if children:
-            data['children'] = [cls.build_tree(child, **kwargs) for child in children]
-        return data
+        extra_fields = list(kwargs.get('extra_fields', []))
+
+        # 当前路径上尚未闭合的节点: [路径, 是否已输出children]
+        open_nodes = []
+        for row in cls._iter_subtree_rows(node, need_del, ['code', 'name', *extra_fields]):
+            while open_nodes and not row['path'].startswith(open_nodes[-1][0]):
+                _, has_children = open_nodes.pop()
+                yield ']}' if has_children else '}'
+
+            if open_nodes:
+                yield ',' if open_nodes[-1][1] else ',"children":['
+                open_nodes[-1][1] = True
+
+            data = cls._tree_row_to_data(row, need_del, extra_fields)
+            # 去掉结尾的 "}"，以便继续追加 children
+            yield json.dumps(data, default=str, ensure_ascii=False)[:-1]
+            open_nodes.append([row['path'], False])
+
+        while open_nodes:
+            _, has_children = open_nodes.pop()
+            yield ']}' if has_children else '}'
 
     @classmethod
     def get_root_type(cls, need_del=False):
@@ -127,46 +314,52 @@ class BaseTypeTree(BaseModel):
             return cls.objects.filter(parent__isnull=True).first()
 
     @classmethod
-    def export_to_json(cls, need_del=False, **kwargs):
-        """导出类型树为JSON"""
+    def export_to_json(cls, need_del=False, stream=False, **kwargs):
+        """导出类型树为JSON
+
+        stream 为 True 时返回JSON文本片段的生成器，适用于较大的树
+        """
         root_type = cls.get_root_type(need_del)
         assert root_type is not None, "未找到根类型树"
 
         kwargs['need_del'] = need_del
+        if stream:
+            return cls.stream_tree_json(root_type, **kwargs)
         return cls.build_tree(root_type, **kwargs)
     
-    def get_type_all_parent_type(self):
-        """获取所有父级类型"""
-        parent_type_list = []
-        parent_type = self.parent
+    def get_type_all_parent_uuid_list(self):
+        """获取所有父级类型的uuid（由近到远），直接从路径解析，不查询数据库"""
+        return list(reversed(self.parse_path(self.path)[:-1]))
 
-        while parent_type:
-            parent_type_list.append(parent_type)
-            parent_type = parent_type.parent
+    def get_type_all_parent_type(self):
+        """获取所有父级类型（由近到远，包含已删除的父级）"""
+        parent_uuids = self.get_type_all_parent_uuid_list()
+        if not parent_uuids:
+            return []
 
-        return list(parent_type_list)
+        parent_types = {node.uuid: node for node in self.__class__.all_objects.filter(uuid__in=parent_uuids)}
+        return [parent_types[parent_uuid] for parent_uuid in parent_uuids if parent_uuid in parent_types]
     
     @classmethod
     def get_type_all_children_uuid_list(cls, node, **kwargs):
-        """获取所有子级类型"""
-        node_type_tree = cls.build_tree(node, **kwargs)
-
-        def _get_one_node_tree_all_uuids(node_tree):
-            res = []
-            res.append(node_tree.get('uuid'))
-            _children_type_list = node_tree.get('children', [])
-            if _children_type_list:
-                for child in _children_type_list:
-                    res.extend(_get_one_node_tree_all_uuids(child))
-            return res
+        """获取所有子级类型（包含节点自身）
 
-        children_type_list = _get_one_node_tree_all_uuids(node_type_tree)
-
-        return list(children_type_list)
+        Args:
+            node: 节点对象
+            **kwargs: 可选参数
+                need_del (bool): 是否包含已删除节点；不包含时，已删除节点下的子孙节点也不包含
+        """
+        return [row['uuid'] for row in cls._iter_subtree_rows(node, kwargs.get('need_del', False))]
     
     @classmethod
-    def update_nodes(cls, type_tree, extra_fields={}):
-        """更新节点"""
+    def update_nodes(cls, type_tree, extra_fields={}, bulk=False):
+        """更新节点
+
+        bulk 为 True 时使用批量模式，见 bulk_update_nodes
+        """
+        if bulk:
+            return cls.bulk_update_nodes(type_tree, extra_fields=extra_fields)
+
         # # 获取所有现有节点
         existing_nodes = {
             node.code: node 
@@ -246,3 +439,98 @@ class BaseTypeTree(BaseModel):
                 #     color_logger.warning(f"类型节点 {node.code} 已被工单引用,跳过删除")
         
         
+
+    @classmethod
+    def bulk_update_nodes(cls, type_tree, extra_fields={}):
+        """批量更新节点
+
+        在内存中比较传入的类型树与现有节点，然后在一个事务中：
+        - 按先父后子的顺序 bulk_create 新节点
+        - bulk_update 有变化的现有节点
+        - 一条 UPDATE 软删除未使用的节点
+
+        不触发逐行的 save/delete 信号，完成后发送一次 tree_nodes_bulk_updated 信号（用于汇总审计等）
+
+        Returns:
+            {'created': [code], 'updated': [code], 'deleted': [code]}
+        """
+        existing_nodes = {node.code: node for node in cls.all_objects.all()}
+        now = timezone.now()
+
+        nodes_to_create = []
+        nodes_to_update = []
+        update_fields = {'name', 'parent', 'level', 'path', 'is_del', 'update_time', *extra_fields}
+
+        # 先序遍历，保证父节点总是先于子节点处理
+        stack = [(type_tree, None, 0)]
+        while stack:
+            node_data, parent, level = stack.pop()
+            code = node_data['code']
+
+            update_dict = {
+                'name': node_data['name'],
+                'parent': parent,
+                'level': level,
+                'is_del': False,
+            }
+            for field, default_value in extra_fields.items():
+                update_dict[field] = node_data.get(field, default_value)
+
+            node = existing_nodes.pop(code, None)
+            is_new = node is None
+            if is_new:
+                node = cls(code=code, **update_dict)
+            # 与 save 相同的层级限制，在任何写入之前检查
+            path = cls.build_path(node.uuid, parent.path if parent else '')
+            if len(path) > cls.PATH_MAX_LENGTH:
+                raise ValueError(f'类型树层级过深，最多{cls.MAX_TREE_DEPTH}层')
+
+            if is_new:
+                node.path = path
+                nodes_to_create.append(node)
+            else:
+                update_dict['path'] = path
+                changed = False
+                for key, value in update_dict.items():
+                    old_value = node.parent_id if key == 'parent' else getattr(node, key)
+                    new_value = value.pk if key == 'parent' and value is not None else value
+                    if old_value != new_value:
+                        setattr(node, key, value)
+                        changed = True
+                if changed:
+                    node.update_time = now
+                    nodes_to_update.append(node)
+
+            for child in reversed(node_data.get('children', [])):
+                stack.append((child, node, level + 1))
+
+        nodes_to_delete = [node for node in existing_nodes.values() if not node.is_del]
+
+        with transaction.atomic():
+            if nodes_to_create:
+                cls.all_objects.bulk_create(nodes_to_create, batch_size=500)
+            if nodes_to_update:
+                cls.all_objects.bulk_update(nodes_to_update, list(update_fields), batch_size=500)
+            if nodes_to_delete:
+                cls.all_objects.filter(uuid__in=[node.uuid for node in nodes_to_delete]).update(
+                    is_del=True, update_time=now
+                )
+
+            summary = {
+                'created': [node.code for node in nodes_to_create],
+                'updated': [node.code for node in nodes_to_update],
+                'deleted': [node.code for node in nodes_to_delete],
+            }
+            tree_nodes_bulk_updated.send(
+                sender=cls,
+                created=nodes_to_create,
+                updated=nodes_to_update,
+                deleted=nodes_to_delete,
+                summary=summary,
+            )
+
+        color_logger.info(
+            f"批量更新类型树: {cls.__name__}, 新建 {len(nodes_to_create)}, "
+            f"更新 {len(nodes_to_update)}, 删除 {len(nodes_to_delete)}"
+        )
+        return summary
@@ -1,9 +1,20 @@
-from django.core.paginator import Paginator, EmptyPage, InvalidPage
-from typing import Union, List, Tuple
+import base64
+import json
+import math
+from datetime import datetime
+from django.db import connections
+from django.db.models import Q
+from typing import Union, List, Tuple, Optional, Sequence
 from django.db.models import QuerySet
+from lib.log import color_logger
 
+# 总数统计方式
+COUNT_MODE_NONE = 'none'  # 不统计总数
+COUNT_MODE_EXACT = 'exact'  # COUNT(*) 精确统计
+COUNT_MODE_ESTIMATE = 'estimate'  # 根据表统计信息/执行计划估算
 
-def pub_paging_tool(page: int, query: Union[QuerySet, List], page_size: int = 20) -> Tuple[bool, int, List, int, Union[QuerySet, List]]:
+
+def pub_paging_tool(page: int, query: Union[QuerySet, List], page_size: int = 20) -> Tuple[bool, int, int, int, Union[QuerySet, List]]:
     """通用分页工具
     
     Args:
@@ -12,8 +23,8 @@ def pub_paging_tool(page: int, query: Union[QuerySet, List], page_size: int = 20
         page_size: 每页数量
         
     Returns:
-        Tuple[bool, int, List, int, Union[QuerySet, List]]:
-        (是否有下一页, 下一页页码, 分页列表, 总数, 当前页数据)
+        Tuple[bool, int, int, int, Union[QuerySet, List]]:
+        (是否有下一页, 下一页页码, 总页数, 总数, 当前页数据)
     """
     # 处理列表类型数据
     if isinstance(query, list):
@@ -22,16 +33,194 @@ def pub_paging_tool(page: int, query: Union[QuerySet, List], page_size: int = 20
         end = start + page_size
         data = query[start:end]
         
-        return bool(end < total), page + 1, list(range(1, (total // page_size) + 2)), total, data
+        return bool(end < total), page + 1, max(1, math.ceil(total / page_size)), total, data
     
-    # 处理 QuerySet
+    # 处理 QuerySet，只统计一次总数
     total = query.count()
-    paginator = Paginator(query, page_size)
-    
+    num_pages = max(1, math.ceil(total / page_size))
+    if page < 1 or page > num_pages:
+        page = 1
+
+    start = (page - 1) * page_size
+    data = query[start:start + page_size]
+    has_next = page < num_pages
+
+    return has_next, page + 1 if has_next else 1, num_pages, total, data
+
+
+def _encode_cursor_value(value):
+    if isinstance(value, datetime):
+        # 保留微秒，避免相同秒内的记录被跳过
+        return value.isoformat()
+    if value is None or isinstance(value, (int, float, str, bool)):
+        return value
+    return str(value)
+
+
+def encode_cursor(values: Sequence) -> str:
+    """将排序字段的值编码为不透明的游标"""
+    raw = json.dumps([_encode_cursor_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> List:
+    """解码游标，返回排序字段的值"""
+    padding = '=' * (-len(cursor) % 4)
     try:
-        current_page = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-        current_page = paginator.page(1)
-    
-    return bool(current_page.has_next()), current_page.next_page_number() if current_page.has_next() else 1, \
-           list(range(1, paginator.num_pages + 1)), total, current_page.object_list
\ No newline at end of file
+        return json.loads(base64.urlsafe_b64decode(cursor + padding).decode('utf-8'))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'无效的游标: {cursor}') from e
+
+
+def _build_keyset_filter(ordering: Sequence[str], values: Sequence) -> Q:
+    """构造 "排在游标之后" 的条件，如 (a < x) OR (a = x AND b < y)"""
+    keyset_filter = Q()
+    equal_filter = Q()
+    for field, value in zip(ordering, values):
+        field_name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        keyset_filter |= equal_filter & Q(**{f'{field_name}__{lookup}': value})
+        equal_filter &= Q(**{field_name: value})
+    return keyset_filter
+
+
+def _load_ordering_fields(query: QuerySet, ordering: Sequence[str]) -> QuerySet:
+    """查询集使用了 only()/defer() 时补充加载排序字段，读取游标值时不会逐条触发额外查询"""
+    if query._fields is not None:
+        # values()/values_list() 查询的字段由调用方决定
+        return query
+
+    field_names, defer = query.query.deferred_loading
+    ordering_names = {field.lstrip('-') for field in ordering}
+    if defer:
+        if field_names & ordering_names:
+            query = query.defer(None).defer(*(field_names - ordering_names))
+    elif field_names and not ordering_names <= field_names:
+        query = query.only(*field_names, *ordering_names)
+    return query
+
+
+def estimate_count(query: QuerySet) -> Optional[int]:
+    """估算查询集的行数，不执行 COUNT(*)
+
+    - MySQL 无过滤条件时读取 information_schema 中的表统计信息
+    - MySQL 有过滤条件时读取执行计划中的预估扫描行数
+    - 其他数据库返回精确总数
+    """
+    connection = connections[query.db]
+    if connection.vendor != 'mysql':
+        return query.count()
+
+    try:
+        with connection.cursor() as cursor:
+            if not query.query.where:
+                cursor.execute(
+                    'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                    [query.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+                return int(row[0] or 0) if row else 0
+
+            sql, params = query.order_by().values('pk').query.sql_with_params()
+            cursor.execute(f'EXPLAIN {sql}', params)
+            columns = [col[0].lower() for col in cursor.description]
+            rows_index = columns.index('rows')
+            return max(int(row[rows_index] or 0) for row in cursor.fetchall())
+    except Exception as e:
+        color_logger.warning(f'估算总数失败，改为精确统计: {e}')
+        return query.count()
+
+
+def pub_cursor_paging_tool(query: QuerySet, cursor: Optional[str] = None, page_size: int = 20,
+                           ordering: Sequence[str] = ('-create_time', '-uuid'),
+                           count_mode: str = COUNT_MODE_NONE) -> Tuple[bool, Optional[str], Optional[int], List]:
+    """游标（keyset）分页工具
+
+    按 ordering 排序（最后一个字段需唯一，且最好有对应的索引），
+    翻页时以上一页最后一条记录的排序值作为条件，不使用 OFFSET，也默认不执行 COUNT
+
+    Args:
+        query: 查询集
+        cursor: 上一页返回的 next_cursor，为空时返回第一页
+        page_size: 每页数量
+        ordering: 排序字段
+        count_mode: 总数统计方式 none/exact/estimate
+
+    Returns:
+        (是否有下一页, 下一页游标, 总数(count_mode 为 none 时为 None), 当前页数据)
+    """
+    total = None
+    if count_mode == COUNT_MODE_EXACT:
+        total = query.count()
+    elif count_mode == COUNT_MODE_ESTIMATE:
+        total = estimate_count(query)
+
+    page_query = _load_ordering_fields(query, ordering).order_by(*ordering)
+    if cursor:
+        page_query = page_query.filter(_build_keyset_filter(ordering, decode_cursor(cursor)))
+
+    # 多取一条判断是否有下一页
+    data = list(page_query[:page_size + 1])
+    has_next = len(data) > page_size
+    data = data[:page_size]
+
+    next_cursor = None
+    if has_next:
+        last = data[-1]
+        next_cursor = encode_cursor([getattr(last, field.lstrip('-')) for field in ordering])
+
+    return has_next, next_cursor, total, data
+
+
+def iter_keyset_batches(query: QuerySet, batch_size: int = 2000,
+                        ordering: Sequence[str] = ('-create_time', '-uuid')):
+    """按 keyset 分批遍历查询集，每批一次查询，不使用 OFFSET
+
+    MySQL 驱动会把整个结果集读入内存（QuerySet.iterator 无法流式读取），
+    遍历大结果集时用它保持内存占用固定。支持模型实例和 values() 返回的字典
+
+    Yields:
+        每批的数据列表
+    """
+    field_names = [field.lstrip('-') for field in ordering]
+    ordered_query = _load_ordering_fields(query, ordering).order_by(*ordering)
+    last_values = None
+    while True:
+        batch_query = ordered_query
+        if last_values is not None:
+            batch_query = batch_query.filter(_build_keyset_filter(ordering, last_values))
+
+        batch = list(batch_query[:batch_size])
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+
+        last = batch[-1]
+        last_values = [last[name] if isinstance(last, dict) else getattr(last, name) for name in field_names]
+
+
+def pub_paging_response_data(body: dict, query: QuerySet, ordering: Sequence[str] = ('-create_time', '-uuid')):
+    """按请求参数选择分页方式，供列表接口使用
+
+    请求中带 cursor 参数（首页传空字符串）时使用游标分页，可通过 count_mode 指定总数统计方式；
+    否则使用页码分页
+
+    Returns:
+        (分页信息字典, 当前页数据)
+    """
+    page_size = int(body.get('page_size', 20))
+
+    if 'cursor' in body:
+        has_next, next_cursor, total, data = pub_cursor_paging_tool(
+            query,
+            cursor=body.get('cursor') or None,
+            page_size=page_size,
+            ordering=ordering,
+            count_mode=body.get('count_mode', COUNT_MODE_NONE),
+        )
+        return {'has_next': has_next, 'next_cursor': next_cursor, 'all_num': total}, data
+
+    has_next, next_page, _, total, data = pub_paging_tool(int(body.get('page', 1)), query, page_size)
+    return {'has_next': has_next, 'next_page': next_page, 'all_num': total}, data
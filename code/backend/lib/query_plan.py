@@ -0,0 +1,42 @@
+from django.db.models import Prefetch
+
+
+class QueryPlan:
+    """查询计划：声明格式化函数需要的字段和关联，由列表接口统一应用到查询集上
+
+    使用示例::
+
+        ROLE_BASIC_PLAN = QueryPlan(Role, only=['uuid', 'name', 'code'])
+        USER_PLAN = QueryPlan(User, prefetch={'roles': ROLE_BASIC_PLAN})
+
+        users = USER_PLAN.apply(User.objects.filter(...))
+
+    Args:
+        model: 计划对应的模型
+        only: 只查询的字段，为空时查询所有字段
+        select: 需要 select_related 的外键
+        prefetch: {关联名: 关联模型的 QueryPlan}，以 Prefetch 对象预取，子计划同样生效
+    """
+
+    def __init__(self, model, only=None, select=None, prefetch=None):
+        self.model = model
+        self.only = list(only or [])
+        self.select = list(select or [])
+        self.prefetch = dict(prefetch or {})
+
+    def get_queryset(self):
+        """按计划构造模型的默认查询集"""
+        return self.apply(self.model.objects.all())
+
+    def apply(self, queryset):
+        """将计划应用到查询集上"""
+        if self.select:
+            queryset = queryset.select_related(*self.select)
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*[
+                Prefetch(lookup, queryset=plan.get_queryset())
+                for lookup, plan in self.prefetch.items()
+            ])
+        if self.only:
+            queryset = queryset.only(*self.only)
+        return queryset
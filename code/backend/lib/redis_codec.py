@@ -0,0 +1,198 @@
+import json
+import struct
+import zlib
+from datetime import datetime
+
+from backend.settings import config_data
+from lib.json_tools import DateTimeEncoder, datetime_to_utc_str
+from lib.log import color_logger
+
+# 可选依赖：未安装时对应的序列化/压缩方式不可用，配置了也会回退到 json / 不压缩
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Redis 值的格式：
+# - 旧格式（无头部）：json 文本，升级前写入的值和 SERIALIZER=json 且未压缩时写入的值
+# - 新格式：MAGIC(3字节) + 格式版本(1字节) + 序列化方式(1字节) + 压缩方式(1字节) + 数据
+# MAGIC 以 0xff 开头，不可能出现在 UTF-8 编码的 json 文本中，因此两种格式可以共存
+CODEC_MAGIC = b'\xffRV'
+CODEC_VERSION = 1
+CODEC_HEADER = struct.Struct('>3sBBB')
+
+SERIALIZER_JSON = 'json'
+SERIALIZER_ORJSON = 'orjson'
+SERIALIZER_MSGPACK = 'msgpack'
+
+COMPRESSION_NONE = 'none'
+COMPRESSION_ZLIB = 'zlib'
+COMPRESSION_LZ4 = 'lz4'
+
+# 写入头部的编号，已使用的编号不能修改
+SERIALIZER_IDS = {SERIALIZER_JSON: 1, SERIALIZER_ORJSON: 2, SERIALIZER_MSGPACK: 3}
+COMPRESSION_IDS = {COMPRESSION_NONE: 0, COMPRESSION_ZLIB: 1, COMPRESSION_LZ4: 2}
+
+# 缓存场景优先压缩速度
+ZLIB_LEVEL = 1
+
+
+class RedisCodecError(ValueError):
+    pass
+
+
+def _encode_default(o):
+    """orjson / msgpack 无法直接序列化的类型，datetime 与 DateTimeEncoder 的输出一致"""
+    if isinstance(o, datetime):
+        return datetime_to_utc_str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not serializable")
+
+
+def _json_dumps(value):
+    return json.dumps(value, cls=DateTimeEncoder).encode('utf-8')
+
+
+def _orjson_dumps(value):
+    # OPT_PASSTHROUGH_DATETIME：datetime 交给 _encode_default，保持与 json 相同的格式
+    return orjson.dumps(
+        value, default=_encode_default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    )
+
+
+def _msgpack_dumps(value):
+    return msgpack.packb(value, default=_encode_default, use_bin_type=True)
+
+
+def _msgpack_loads(data):
+    # msgpack 保留非字符串的字典键（json 会转换为字符串）
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+# {序列化方式: (是否可用, 序列化, 反序列化)}
+SERIALIZERS = {
+    SERIALIZER_JSON: (True, _json_dumps, json.loads),
+    SERIALIZER_ORJSON: (orjson is not None, _orjson_dumps, orjson.loads if orjson else None),
+    SERIALIZER_MSGPACK: (msgpack is not None, _msgpack_dumps, _msgpack_loads),
+}
+
+# {压缩方式: (是否可用, 压缩, 解压)}
+COMPRESSIONS = {
+    COMPRESSION_NONE: (True, None, None),
+    COMPRESSION_ZLIB: (True, lambda data: zlib.compress(data, ZLIB_LEVEL), zlib.decompress),
+    COMPRESSION_LZ4: (
+        lz4_frame is not None,
+        lz4_frame.compress if lz4_frame else None,
+        lz4_frame.decompress if lz4_frame else None,
+    ),
+}
+
+SERIALIZER_NAMES = {serializer_id: name for name, serializer_id in SERIALIZER_IDS.items()}
+COMPRESSION_NAMES = {compression_id: name for name, compression_id in COMPRESSION_IDS.items()}
+
+
+def is_serializer_available(serializer):
+    return serializer in SERIALIZERS and SERIALIZERS[serializer][0]
+
+
+def is_compression_available(compression):
+    return compression in COMPRESSIONS and COMPRESSIONS[compression][0]
+
+
+class RedisCodec:
+    """Redis 值的编解码
+
+    - 写入：按配置的序列化方式编码，数据不小于 compress_min_size 且压缩后更小时才压缩
+    - 读取：根据头部选择解码方式，没有头部的值按旧格式（json）解码，与写入时的配置无关
+
+    Args:
+        serializer: json / orjson / msgpack，依赖未安装时回退到 json
+        compression: none / zlib / lz4，依赖未安装时回退到不压缩
+        compress_min_size: 触发压缩的最小字节数
+    """
+
+    def __init__(self, serializer=SERIALIZER_JSON, compression=COMPRESSION_NONE, compress_min_size=1024):
+        if serializer not in SERIALIZERS:
+            raise RedisCodecError(f"不支持的序列化方式: {serializer}")
+        if compression not in COMPRESSIONS:
+            raise RedisCodecError(f"不支持的压缩方式: {compression}")
+        if not is_serializer_available(serializer):
+            color_logger.warning(f"Redis序列化方式 {serializer} 的依赖未安装，回退到 json")
+            serializer = SERIALIZER_JSON
+        if not is_compression_available(compression):
+            color_logger.warning(f"Redis压缩方式 {compression} 的依赖未安装，回退到不压缩")
+            compression = COMPRESSION_NONE
+
+        self.serializer = serializer
+        self.compression = compression
+        self.compress_min_size = compress_min_size
+        self._dumps = SERIALIZERS[serializer][1]
+        self._compress = COMPRESSIONS[compression][1]
+
+    def __repr__(self):
+        return f"RedisCodec({self.serializer}, {self.compression}, {self.compress_min_size})"
+
+    def encode(self, value):
+        data = self._dumps(value)
+        compression = COMPRESSION_NONE
+        if self._compress is not None and len(data) >= self.compress_min_size:
+            compressed = self._compress(data)
+            if len(compressed) < len(data):
+                data, compression = compressed, self.compression
+
+        # json 且未压缩时写入旧格式，升级过程中未升级的实例也能读取
+        if self.serializer == SERIALIZER_JSON and compression == COMPRESSION_NONE:
+            return data
+        header = CODEC_HEADER.pack(
+            CODEC_MAGIC, CODEC_VERSION, SERIALIZER_IDS[self.serializer], COMPRESSION_IDS[compression]
+        )
+        return header + data
+
+    def decode(self, data):
+        if data is None:
+            return None
+        if isinstance(data, str) or not data.startswith(CODEC_MAGIC):
+            return json.loads(data)
+        if len(data) < CODEC_HEADER.size:
+            raise RedisCodecError("Redis值的头部不完整")
+
+        _, version, serializer_id, compression_id = CODEC_HEADER.unpack_from(data)
+        if version != CODEC_VERSION:
+            raise RedisCodecError(f"不支持的Redis值格式版本: {version}")
+        serializer = SERIALIZER_NAMES.get(serializer_id)
+        compression = COMPRESSION_NAMES.get(compression_id)
+        if not is_serializer_available(serializer):
+            raise RedisCodecError(f"无法解码Redis值，序列化方式不可用: {serializer or serializer_id}")
+        if not is_compression_available(compression):
+            raise RedisCodecError(f"无法解码Redis值，压缩方式不可用: {compression or compression_id}")
+
+        payload = data[CODEC_HEADER.size:]
+        decompress = COMPRESSIONS[compression][2]
+        if decompress is not None:
+            payload = decompress(payload)
+        return SERIALIZERS[serializer][2](payload)
+
+
+_redis_codec = None
+
+
+def get_redis_codec():
+    """按配置 REDIS_CODEC 创建的编解码器（进程内只创建一次）"""
+    global _redis_codec
+    if _redis_codec is None:
+        codec_config = config_data.get('REDIS_CODEC', {})
+        _redis_codec = RedisCodec(
+            serializer=codec_config.get('SERIALIZER', SERIALIZER_JSON),
+            compression=codec_config.get('COMPRESSION', COMPRESSION_NONE),
+            compress_min_size=codec_config.get('COMPRESS_MIN_SIZE', 1024),
+        )
+    return _redis_codec
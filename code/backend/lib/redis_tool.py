@@ -1,63 +1,252 @@
+import contextvars
 import json
+import threading
+import time
 import uuid
 from django_redis import get_redis_connection
 from lib.json_tools import DateTimeEncoder
 from lib.log import color_logger
+from lib.redis_codec import get_redis_codec
 from celery import shared_task
 
+# 批量命令（MGET、pipeline、DEL）每批的键数量，避免单条命令过大阻塞 Redis
+REDIS_BATCH_SIZE = 500
+
+# 写后缓冲（write-behind）：请求范围内以 write_behind=True 写入的值先合并在缓冲区中，
+# 响应返回前由 RedisWriteBehindMiddleware 以 pipeline 一次写入；不在请求范围内时直接写入
+# 缓冲区格式: {redis_db_name: {键: (序列化后的值, 过期时间)}}，同一个键只保留最后一次写入
+_write_behind_buffer = contextvars.ContextVar('redis_write_behind_buffer', default=None)
+
+
+def dump_redis_value(redis_key_value):
+    """序列化写入 Redis 的值（编码方式见 lib.redis_codec）"""
+    return get_redis_codec().encode(redis_key_value)
+
+
+def load_redis_value(redis_data):
+    """反序列化从 Redis 读取的值，兼容没有头部的旧格式"""
+    return get_redis_codec().decode(redis_data)
+
+
 def get_redis_value(redis_db_name, redis_key_name):
+    # 当前请求中尚未写入的值
+    pending = _get_pending_writes(redis_db_name)
+    if pending and redis_key_name in pending:
+        return load_redis_value(pending[redis_key_name][0])
+
     redis_conn = get_redis_connection(redis_db_name)
     redis_data = redis_conn.get(redis_key_name)
     
     if redis_data:
-        return json.loads(redis_data)
+        return load_redis_value(redis_data)
     
     return None
 
+def _decode_redis_key(key):
+    return key.decode('utf-8') if isinstance(key, bytes) else key
+
+
+def _iter_batches(items, batch_size):
+    items = list(items)
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+
+def scan_redis_keys(redis_db_name, match, count=1000):
+    """以 SCAN 游标遍历匹配的键（不会像 KEYS 一样阻塞 Redis），返回字符串形式的键"""
+    redis_conn = get_redis_connection(redis_db_name)
+    for key in redis_conn.scan_iter(match=match, count=count):
+        yield _decode_redis_key(key)
+
+
 def get_redis_value_with_prefix(redis_db_name, redis_key_prefix):
+    """获取匹配 redis_key_prefix（glob 模式，如 "prefix:*"）的所有键值
+
+    以 SCAN 遍历键，按批 MGET 读取值；没有匹配的键时返回 None
+    """
+    keys = list(scan_redis_keys(redis_db_name, redis_key_prefix))
+    if not keys:
+        return None
+    return get_many(redis_db_name, keys)
+
+
+def get_many(redis_db_name, redis_key_names, batch_size=REDIS_BATCH_SIZE):
+    """按批 MGET 读取多个键
+
+    Returns:
+        {键: 值}，不存在的键不包含在结果中
+    """
     redis_conn = get_redis_connection(redis_db_name)
-    redis_data = redis_conn.keys(redis_key_prefix)
-    # color_logger.debug(f'redis_key_prefix: {redis_key_prefix}')
-    # color_logger.debug(f'redis_data: {redis_data}')
-    
-    if redis_data:
-        return {key.decode('utf-8') if isinstance(key, bytes) else key: json.loads(redis_conn.get(key)) for key in redis_data}
-    
-    return None
-        
+    pending = _get_pending_writes(redis_db_name) or {}
+    result = {}
+    for batch in _iter_batches(redis_key_names, batch_size):
+        for key, redis_data in zip(batch, redis_conn.mget(batch)):
+            key = _decode_redis_key(key)
+            if key in pending:
+                redis_data = pending[key][0]
+            if redis_data is not None:
+                result[key] = load_redis_value(redis_data)
+    return result
+
+
+def set_many(redis_db_name, redis_key_values, set_expire=3600, batch_size=REDIS_BATCH_SIZE, write_behind=False):
+    """以 pipeline 按批写入多个键值
 
-@shared_task
-def set_redis_value(redis_db_name, redis_key_name, redis_key_value, set_expire=3600):
+    :param redis_key_values: {键: 值}
+    :param set_expire: 过期时间（秒），None 表示永不过期；也可以传 {键: 过期时间} 为每个键指定过期时间
+    :param write_behind: 在请求范围内时合并到写后缓冲区，响应返回前再写入
     """
-    设置 Redis 键值
+    writes = {
+        key: (dump_redis_value(value), set_expire.get(key) if isinstance(set_expire, dict) else set_expire)
+        for key, value in redis_key_values.items()
+    }
+    if write_behind and _buffer_writes(redis_db_name, writes):
+        return
+    _write_redis_data(redis_db_name, writes, batch_size)
+
+
+def _write_redis_data(redis_db_name, writes, batch_size=REDIS_BATCH_SIZE):
+    """以 pipeline 按批写入 {键: (序列化后的值, 过期时间)}"""
+    redis_conn = get_redis_connection(redis_db_name)
+    for batch in _iter_batches(writes.items(), batch_size):
+        pipe = redis_conn.pipeline(transaction=False)
+        for key, (redis_data, expire) in batch:
+            if expire is not None:
+                pipe.set(key, redis_data, ex=expire)
+            else:
+                pipe.set(key, redis_data)
+        pipe.execute()
+
+
+def delete_many(redis_db_name, redis_key_names, batch_size=REDIS_BATCH_SIZE):
+    """按批删除多个键，返回删除的键数量"""
+    redis_key_names = list(redis_key_names)
+    _discard_pending_writes(redis_db_name, redis_key_names)
+    redis_conn = get_redis_connection(redis_db_name)
+    deleted = 0
+    for batch in _iter_batches(redis_key_names, batch_size):
+        deleted += redis_conn.delete(*batch)
+    return deleted
+
+
+def get_ttl_many(redis_db_name, redis_key_names, batch_size=REDIS_BATCH_SIZE):
+    """以 pipeline 按批读取多个键的剩余过期时间
+
+    Returns:
+        {键: 剩余秒数}，不存在或没有过期时间的键不包含在结果中
+    """
+    redis_conn = get_redis_connection(redis_db_name)
+    result = {}
+    for batch in _iter_batches(redis_key_names, batch_size):
+        pipe = redis_conn.pipeline(transaction=False)
+        for key in batch:
+            pipe.ttl(key)
+        for key, ttl in zip(batch, pipe.execute()):
+            if ttl is not None and ttl > 0:
+                result[_decode_redis_key(key)] = ttl
+    return result
+
+
+def set_redis_value(redis_db_name, redis_key_name, redis_key_value, set_expire=3600, write_behind=False):
+    """
+    设置 Redis 键值（同步写入）
     :param redis_db_name: Redis 数据库名
     :param redis_key_name: 键名
     :param redis_key_value: 键值
     :param set_expire: 过期时间（秒），默认为 3600 秒，None 表示永不过期
+    :param write_behind: 在请求范围内时合并到写后缓冲区，响应返回前再写入；
+        只用于可以延迟写入的缓存，其他进程需要立即读取到的值（如 token）不要使用
     """
+    redis_data = dump_redis_value(redis_key_value)
+    if write_behind and _buffer_writes(redis_db_name, {redis_key_name: (redis_data, set_expire)}):
+        return
+
     redis_conn = get_redis_connection(redis_db_name)
     
     # 更新 Redis
     if set_expire is not None:
         # 设置带过期时间的键值
-        redis_conn.set(
-            redis_key_name,
-            json.dumps(redis_key_value, cls=DateTimeEncoder),
-            ex=set_expire
-        )
+        redis_conn.set(redis_key_name, redis_data, ex=set_expire)
     else:
         # 设置永不过期的键值
-        redis_conn.set(
-            redis_key_name,
-            json.dumps(redis_key_value, cls=DateTimeEncoder)
-        )
+        redis_conn.set(redis_key_name, redis_data)
+
+
+@shared_task(name='lib.redis_tool.set_redis_value')
+def set_redis_value_task(redis_db_name, redis_key_name, redis_key_value, set_expire=3600):
+    """在 Celery worker 中设置 Redis 键值（任务名沿用之前的 set_redis_value，兼容队列中已有的消息）"""
+    set_redis_value(redis_db_name, redis_key_name, redis_key_value, set_expire=set_expire)
+
+
+def set_redis_value_async(redis_db_name, redis_key_name, redis_key_value, set_expire=3600):
+    """投递到 Celery 异步设置 Redis 键值，值需要可以被 Celery 序列化"""
+    return set_redis_value_task.delay(redis_db_name, redis_key_name, redis_key_value, set_expire=set_expire)
 
 
 def delete_redis_value(redis_db_name, redis_key_name):
+    _discard_pending_writes(redis_db_name, [redis_key_name])
     redis_conn = get_redis_connection(redis_db_name)
     redis_conn.delete(redis_key_name)
 
 
+def _get_pending_writes(redis_db_name):
+    buffer = _write_behind_buffer.get()
+    return buffer.get(redis_db_name) if buffer else None
+
+
+def _buffer_writes(redis_db_name, writes):
+    """合并到写后缓冲区，不在请求范围内时返回 False"""
+    buffer = _write_behind_buffer.get()
+    if buffer is None:
+        return False
+    buffer.setdefault(redis_db_name, {}).update(writes)
+    return True
+
+
+def _discard_pending_writes(redis_db_name, redis_key_names):
+    """删除键时丢弃缓冲区中尚未写入的值，避免之后被写回"""
+    pending = _get_pending_writes(redis_db_name)
+    if pending:
+        for key in redis_key_names:
+            pending.pop(key, None)
+
+
+def begin_write_behind():
+    """开始写后缓冲（请求开始时调用），返回用于 end_write_behind 的 token"""
+    return _write_behind_buffer.set({})
+
+
+def end_write_behind(token):
+    """结束写后缓冲，返回缓冲区中尚未写入的值"""
+    buffer = _write_behind_buffer.get()
+    _write_behind_buffer.reset(token)
+    return buffer or {}
+
+
+def flush_pending_writes(buffer):
+    """将写后缓冲区中的值按 Redis 库分别以 pipeline 写入"""
+    for redis_db_name, writes in buffer.items():
+        if writes:
+            _write_redis_data(redis_db_name, writes)
+
+
+class RedisWriteBehindMiddleware:
+    """以请求为范围合并 write_behind=True 的 Redis 写入，响应返回前一次写入"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = begin_write_behind()
+        try:
+            response = self.get_response(request)
+        finally:
+            buffer = end_write_behind(token)
+        # 写入失败时抛出异常，不返回可能引用了未写入数据的响应
+        flush_pending_writes(buffer)
+        return response
+
+
 def can_get_work_lock(redis_db_name, work_flag, lock_time=10, need_expire=False):
     redis_conn = get_redis_connection(redis_db_name)
     redis_key_name = f'work_lock_{work_flag}'
@@ -82,3 +271,48 @@ def release_work_lock(redis_db_name, work_flag):
     color_logger.info(f'释放锁: {work_flag}')
     redis_key_name = f'work_lock_{work_flag}'
     redis_conn.delete(redis_key_name)
+
+
+def publish_redis_message(redis_db_name, channel, message):
+    """
+    向 Redis 频道广播消息
+    :param redis_db_name: Redis 数据库名
+    :param channel: 频道名
+    :param message: 消息内容，会被序列化为 JSON
+    """
+    redis_conn = get_redis_connection(redis_db_name)
+    redis_conn.publish(channel, json.dumps(message, cls=DateTimeEncoder))
+
+
+def subscribe_redis_channel(redis_db_name, channel, callback, on_connect=None):
+    """
+    在后台守护线程中订阅 Redis 频道，断线后自动重连
+    :param redis_db_name: Redis 数据库名
+    :param channel: 频道名
+    :param callback: 收到消息时的回调，参数为反序列化后的消息
+    :param on_connect: 每次（重新）订阅成功后的回调，可用于清理断线期间可能错过消息的本地状态
+    :return: 订阅线程
+    """
+    def _listen():
+        while True:
+            try:
+                pubsub = get_redis_connection(redis_db_name).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel)
+                color_logger.info(f'订阅Redis频道成功: {channel}')
+                if on_connect:
+                    on_connect()
+
+                for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+                    try:
+                        callback(json.loads(message['data']))
+                    except Exception as e:
+                        color_logger.error(f'处理Redis频道消息失败: {channel}, {e}')
+            except Exception as e:
+                color_logger.error(f'订阅Redis频道异常，1秒后重连: {channel}, {e}')
+                time.sleep(1)
+
+    thread = threading.Thread(target=_listen, name=f'redis-subscribe-{channel}', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,158 @@
+from lib.cache_tool import LRUCache
+
+# HTTP方法对应的位，未知方法统一使用 OTHER 位
+METHOD_BITS = {
+    'GET': 1 << 0,
+    'POST': 1 << 1,
+    'PUT': 1 << 2,
+    'PATCH': 1 << 3,
+    'DELETE': 1 << 4,
+    'HEAD': 1 << 5,
+    'OPTIONS': 1 << 6,
+}
+OTHER_METHOD_BIT = 1 << 7
+ALL_METHODS_MASK = (1 << 8) - 1
+
+# 路径段通配符：
+# - "*" 位于末尾时匹配剩余的一个或多个路径段，位于中间时匹配任意一个路径段
+# - "{name}" 匹配任意一个路径段
+WILDCARD_SEGMENT = '*'
+
+
+def methods_to_mask(methods):
+    """将方法（字符串或列表）转换为位掩码，"*" 表示所有方法"""
+    if methods is None:
+        return ALL_METHODS_MASK
+    if isinstance(methods, str):
+        methods = [methods]
+
+    mask = 0
+    for method in methods:
+        method = str(method).upper()
+        if method == WILDCARD_SEGMENT:
+            return ALL_METHODS_MASK
+        mask |= METHOD_BITS.get(method, OTHER_METHOD_BIT)
+    return mask
+
+
+def _split_path(path):
+    """拆分路径为路径段，忽略查询参数和首尾的 "/" """
+    path = path.split('?', 1)[0].strip('/')
+    return path.split('/') if path else []
+
+
+def _is_param_segment(segment):
+    return segment == WILDCARD_SEGMENT or (segment.startswith('{') and segment.endswith('}'))
+
+
+class _TrieNode:
+    __slots__ = ('children', 'param_child', 'mask', 'tail_mask')
+
+    def __init__(self):
+        self.children = {}  # 固定路径段 -> 子节点
+        self.param_child = None  # 单个路径段通配
+        self.mask = None  # 路径恰好在此结束时允许的方法
+        self.tail_mask = None  # 末尾 "*"：匹配剩余路径段时允许的方法
+
+
+class RouteMatcher:
+    """按路径段构建的前缀树，用于匹配API路径与允许的方法
+
+    routes 格式与权限JSON中 backend.api 相同::
+
+        {
+            "/api/v1/user/users/": ["GET", "DELETE"],
+            "/api/v1/user/*": ["GET"],
+            "/api/v1/perm/role/{uuid}/": "*"
+        }
+
+    同一路径命中多个规则时，允许的方法取并集
+    """
+
+    def __init__(self, routes=None):
+        self._root = _TrieNode()
+        if isinstance(routes, dict):
+            for path, methods in routes.items():
+                self.add(path, methods)
+        elif routes:
+            # 列表形式只声明路径，不限制方法
+            for path in routes:
+                self.add(path)
+
+    def add(self, path, methods=None):
+        """添加路由规则"""
+        mask = methods_to_mask(methods)
+        segments = _split_path(path)
+
+        node = self._root
+        for index, segment in enumerate(segments):
+            if segment == WILDCARD_SEGMENT and index == len(segments) - 1:
+                node.tail_mask = (node.tail_mask or 0) | mask
+                return
+            if _is_param_segment(segment):
+                if node.param_child is None:
+                    node.param_child = _TrieNode()
+                node = node.param_child
+            else:
+                node = node.children.setdefault(segment, _TrieNode())
+        node.mask = (node.mask or 0) | mask
+
+    def match(self, path):
+        """返回路径允许的方法位掩码，没有任何规则命中时返回 None"""
+        segments = _split_path(path)
+        result = None
+        stack = [(self._root, 0)]
+
+        while stack:
+            node, index = stack.pop()
+            if index == len(segments):
+                if node.mask is not None:
+                    result = (result or 0) | node.mask
+                continue
+
+            if node.tail_mask is not None:
+                result = (result or 0) | node.tail_mask
+
+            segment = segments[index]
+            child = node.children.get(segment)
+            if child is not None:
+                stack.append((child, index + 1))
+            if node.param_child is not None:
+                stack.append((node.param_child, index + 1))
+
+        return result
+
+    def matches(self, path):
+        """路径是否命中任意规则（不考虑方法）"""
+        return self.match(path) is not None
+
+    def allows(self, path, methods):
+        """路径是否允许所有给定的方法"""
+        mask = self.match(path)
+        if mask is None:
+            return False
+        required = methods_to_mask(methods)
+        return mask & required == required
+
+
+# id(routes) -> (routes, 匹配器)，条目持有规则对象的引用，缓存期间 id 不会被复用
+_compiled_matchers = LRUCache(maxsize=1024)
+_EMPTY_MATCHER = RouteMatcher()
+
+
+def get_route_matcher(routes):
+    """获取路由规则对应的已编译匹配器
+
+    按规则对象缓存：两级缓存返回的权限文档在失效或重新加载前是同一个对象，
+    每个文档只编译一次，不需要每次序列化比较内容；调用方不能原地修改传入的规则
+    """
+    if not routes:
+        return _EMPTY_MATCHER
+
+    cached = _compiled_matchers.get(id(routes))
+    if cached is not None and cached[0] is routes:
+        return cached[1]
+
+    matcher = RouteMatcher(routes)
+    _compiled_matchers.set(id(routes), (routes, matcher))
+    return matcher
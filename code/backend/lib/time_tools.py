@@ -157,7 +157,8 @@ def get_year_month_holidays(year, month):
             redis_db_name='DEFAULT',
             redis_key_name=redis_key_name,
             redis_key_value=month_holidays,
-            set_expire=None
+            set_expire=None,
+            write_behind=True
         )
     
     return month_holidays
@@ -0,0 +1,428 @@
+import os
+import threading
+import time
+from collections import Counter
+
+from django.db import connection
+from django_redis import get_redis_connection
+
+from backend.settings import config_data
+from lib.cache_tool import LRUCache, SingleFlight
+from lib.log import color_logger
+from lib.redis_tool import (
+    delete_many, dump_redis_value, get_many, load_redis_value, publish_redis_message, scan_redis_keys, set_many,
+    subscribe_redis_channel,
+)
+
+# 两级缓存失效广播频道（Redis 频道不区分库，统一通过 default 连接收发）
+# 消息格式: {
+#     "namespace": "xxx",
+#     "keys": ["xxx"] 或 None,  # None 表示清空整个命名空间
+# }
+TWO_TIER_CACHE_CHANNEL = 'two_tier_cache_invalidate'
+
+# 跨进程汇总的命中统计（Redis 哈希，default 库）
+CACHE_STATS_KEY_PREFIX = 'two_tier_cache_stats:'
+# 过期后后台刷新的跨进程锁，同一时刻只有一个进程回源
+REFRESH_LOCK_KEY_PREFIX = 'two_tier_cache_refresh:'
+# 命名空间的版本号（与缓存数据在同一个库，不过期），每次失效加一
+VERSION_KEY_PREFIX = 'two_tier_cache_version:'
+
+# 版本号未变化时才写入，回源期间其他进程失效了缓存时放弃写入
+# KEYS[1]: 版本号键, KEYS[2..]: 缓存键
+# ARGV[1]: 回源前读取的版本号, ARGV[2]: 过期秒数, ARGV[3..]: 序列化后的值
+SET_IF_VERSION_LUA = """
+if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+    return 0
+end
+for i = 2, #KEYS do
+    redis.call('SET', KEYS[i], ARGV[i + 1], 'EX', ARGV[2])
+end
+return 1
+"""
+
+# 统计项
+# - local_hits: 进程内缓存命中
+# - redis_hits: 进程内未命中，Redis 命中
+# - stale_hits: Redis 中的值已过新鲜期但仍在 stale_ttl 内，返回旧值并在后台刷新
+# - misses: 两级缓存都未命中，需要同步回源
+# - loads / load_errors: 回源次数 / 回源失败次数（含后台刷新）
+# - invalidations: 失效次数（含收到的广播）
+STAT_FIELDS = ('local_hits', 'redis_hits', 'stale_hits', 'misses', 'loads', 'load_errors', 'invalidations')
+
+_caches = {}  # namespace -> TwoTierCache
+_registry_lock = threading.Lock()
+_listener_lock = threading.Lock()
+_listener_pid = None
+
+
+def get_cache_config():
+    return config_data.get('TWO_TIER_CACHE', {})
+
+
+class TwoTierCache:
+    """两级缓存：进程内 LRU + Redis
+
+    - 读取顺序：进程内缓存 -> Redis -> loader 回源，同一进程内同一个键的并发读取只执行一次
+    - 数据新鲜期为 ttl 秒，之后的 stale_ttl 秒内仍返回 Redis 中的旧值，并在后台刷新（跨进程只有一个进程回源）
+    - 进程内缓存只保存新鲜的值，最长 local_ttl 秒，过期后重新读取 Redis
+    - invalidate 递增 Redis 中的版本号、删除 Redis 中的值并通过 Redis 频道广播，所有进程（uwsgi worker、celery）移除进程内缓存
+    - 回源的值只在版本号与回源前相同时写入 Redis（比较和写入在同一个 Lua 脚本中），
+      回源期间任何进程失效过缓存时不写入，避免旧数据在 ttl 内覆盖失效
+    - 回源或 set 的值同步写入 Redis（不使用写后缓冲：缓冲期间其他进程的失效无法撤销缓冲区中的旧值）
+    - 返回值在进程内共享，调用方不要修改
+
+    Args:
+        namespace: 命名空间，Redis 键为 "{namespace}:{key}"
+        loader: 回源函数 loader(key)，返回 None 时不缓存；get 时也可以单独传入
+        redis_db_name: 缓存数据所在的 Redis 库
+        ttl: 新鲜期（秒）
+        stale_ttl: 新鲜期之后仍可返回旧值的秒数
+        local_ttl: 进程内缓存的最长新鲜期（秒），默认取配置 TWO_TIER_CACHE.LOCAL_TTL
+        local_maxsize: 进程内缓存的最大条目数，默认取配置 TWO_TIER_CACHE.LOCAL_MAX_SIZE
+    """
+
+    def __init__(self, namespace, loader=None, redis_db_name='default', ttl=300, stale_ttl=30,
+                 local_ttl=None, local_maxsize=None):
+        cache_config = get_cache_config()
+        self.namespace = namespace
+        self.loader = loader
+        self.redis_db_name = redis_db_name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.local_ttl = cache_config.get('LOCAL_TTL', 60) if local_ttl is None else local_ttl
+
+        self._local = LRUCache(
+            maxsize=cache_config.get('LOCAL_MAX_SIZE', 1024) if local_maxsize is None else local_maxsize
+        )
+        self._single_flight = SingleFlight()
+        self._lock = threading.Lock()
+        # 每次失效加一，失效前开始的回源结果不再写入缓存
+        self._generation = 0
+        self._refreshing = set()
+
+        self._stats_lock = threading.Lock()
+        self._stats = Counter()
+        self._pending_stats = Counter()
+        self._stats_flushed_at = time.time()
+
+        with _registry_lock:
+            if namespace in _caches:
+                raise ValueError(f"两级缓存命名空间重复: {namespace}")
+            _caches[namespace] = self
+
+    def redis_key(self, key):
+        return f"{self.namespace}:{key}"
+
+    @property
+    def version_key(self):
+        return f"{VERSION_KEY_PREFIX}{self.namespace}"
+
+    def get_version(self):
+        """当前版本号，批量回源前读取并传给 set_many"""
+        return self._decode_version(get_redis_connection(self.redis_db_name).get(self.version_key))
+
+    @staticmethod
+    def _decode_version(version):
+        if version is None:
+            return '0'
+        return version.decode('utf-8') if isinstance(version, bytes) else str(version)
+
+    @property
+    def redis_expire(self):
+        """写入 Redis 的过期时间，包含可以返回旧值的时间"""
+        return self.ttl + self.stale_ttl
+
+    def get(self, key, loader=None):
+        """获取缓存值，未命中时回源；回源返回 None 或失败时不缓存"""
+        ensure_cache_listener()
+        key = str(key)
+
+        value = self._local.get(key)
+        if value is not None:
+            self._count('local_hits')
+            return value
+
+        return self._single_flight.do(key, self._fetch, key, loader)
+
+    def get_many(self, keys):
+        """批量读取已缓存的值（不回源）
+
+        Returns:
+            {key: value}，未缓存的键不包含在结果中
+        """
+        ensure_cache_listener()
+        result = {}
+        missing = []
+        now = time.time()
+        for key in map(str, keys):
+            value = self._local.get(key)
+            if value is not None:
+                self._count('local_hits')
+                result[key] = value
+            else:
+                missing.append(key)
+
+        if missing:
+            generation = self._generation
+            cached = get_many(self.redis_db_name, [self.redis_key(key) for key in missing])
+            for key in missing:
+                value = cached.get(self.redis_key(key))
+                if value is not None:
+                    self._count('redis_hits')
+                    self._set_local(key, value, now + self.ttl, generation)
+                    result[key] = value
+        return result
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, values, version=None):
+        """写入两级缓存，值为 None 的键忽略
+
+        Args:
+            version: 回源前 get_version() 读取的版本号，传入时只在版本号未变化时写入
+        """
+        generation = self._generation
+        values = {str(key): value for key, value in values.items() if value is not None}
+        if not values:
+            return
+        if version is not None:
+            if not self._set_redis_if_version(values, version):
+                return
+        else:
+            set_many(
+                self.redis_db_name,
+                {self.redis_key(key): value for key, value in values.items()},
+                set_expire=self.redis_expire
+            )
+        fresh_until = time.time() + self.ttl
+        for key, value in values.items():
+            self._set_local(key, value, fresh_until, generation)
+
+    def invalidate(self, keys=None):
+        """删除缓存并广播失效消息，keys 为 None 时清空整个命名空间"""
+        # 先递增版本号，正在回源的进程之后不会再写入
+        get_redis_connection(self.redis_db_name).incr(self.version_key)
+        if keys is None:
+            redis_keys = list(scan_redis_keys(self.redis_db_name, f"{self.namespace}:*"))
+        else:
+            keys = [str(key) for key in keys]
+            redis_keys = [self.redis_key(key) for key in keys]
+        if redis_keys:
+            delete_many(self.redis_db_name, redis_keys)
+        self.evict_local(keys)
+
+        try:
+            publish_redis_message(
+                redis_db_name='default',
+                channel=TWO_TIER_CACHE_CHANNEL,
+                message={'namespace': self.namespace, 'keys': keys}
+            )
+        except Exception as e:
+            color_logger.error(f"广播两级缓存失效消息失败: {self.namespace}, {e}")
+
+    def evict_local(self, keys=None):
+        """只移除本进程的缓存，keys 为 None 时清空"""
+        with self._lock:
+            self._generation += 1
+            if keys is None:
+                self._local.clear()
+            else:
+                for key in keys:
+                    self._local.delete(str(key))
+        self._count('invalidations')
+
+    def get_stats(self):
+        """本进程的统计"""
+        with self._stats_lock:
+            stats = {field: self._stats[field] for field in STAT_FIELDS}
+        stats['local_size'] = len(self._local)
+        return stats
+
+    def _fetch(self, key, loader):
+        generation = self._generation
+        cached, version = self._get_from_redis(key)
+        if cached is not None:
+            value, fresh_until = cached
+            if fresh_until > time.time():
+                self._count('redis_hits')
+            else:
+                self._count('stale_hits')
+                self._refresh_in_background(key, loader)
+            self._set_local(key, value, fresh_until, generation)
+            return value
+
+        self._count('misses')
+        return self._load(key, loader, generation, version)
+
+    def _load(self, key, loader, generation, version):
+        loader = loader or self.loader
+        try:
+            value = loader(key)
+        except Exception:
+            self._count('load_errors')
+            raise
+        self._count('loads')
+
+        # 回源期间缓存被失效过（本进程或其他进程），结果可能是旧数据，只返回不缓存
+        if value is None or generation != self._generation or version is None:
+            return value
+        try:
+            if not self._set_redis_if_version({key: value}, version):
+                return value
+        except Exception as e:
+            color_logger.error(f"写入两级缓存失败: {self.redis_key(key)}, {e}")
+        self._set_local(key, value, time.time() + self.ttl, generation)
+        return value
+
+    def _set_redis_if_version(self, values, version):
+        """版本号仍为 version 时写入 {key: value}，返回是否写入"""
+        redis_keys = [self.redis_key(key) for key in values]
+        written = get_redis_connection(self.redis_db_name).eval(
+            SET_IF_VERSION_LUA, len(redis_keys) + 1, self.version_key, *redis_keys,
+            version, self.redis_expire, *[dump_redis_value(value) for value in values.values()]
+        )
+        if not written:
+            color_logger.debug(f"两级缓存在回源期间被失效，放弃写入: {self.namespace}, {list(values)[:10]}")
+        return bool(written)
+
+    def _get_from_redis(self, key):
+        """返回 ((值, 新鲜期截止时间戳), 版本号)，不存在时值为 None；Redis 异常时按未命中处理，版本号为 None"""
+        try:
+            pipe = get_redis_connection(self.redis_db_name).pipeline(transaction=False)
+            pipe.get(self.redis_key(key))
+            pipe.pttl(self.redis_key(key))
+            pipe.get(self.version_key)
+            redis_data, pttl, version = pipe.execute()
+        except Exception as e:
+            color_logger.error(f"读取两级缓存失败: {self.redis_key(key)}, {e}")
+            return None, None
+        version = self._decode_version(version)
+        if redis_data is None:
+            return None, version
+
+        # 写入时的过期时间为 ttl + stale_ttl，剩余时间不足 stale_ttl 即已过新鲜期；没有过期时间时视为新鲜
+        now = time.time()
+        fresh_until = now + pttl / 1000 - self.stale_ttl if pttl is not None and pttl > 0 else now + self.ttl
+        return (load_redis_value(redis_data), fresh_until), version
+
+    def _set_local(self, key, value, fresh_until, generation):
+        """写入进程内缓存，已过新鲜期的值不写入"""
+        now = time.time()
+        fresh_until = min(fresh_until, now + self.local_ttl)
+        if fresh_until <= now:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._local.set(key, value, expire_at=fresh_until)
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(
+            target=self._refresh, args=(key, loader), name=f'two-tier-refresh-{self.namespace}', daemon=True
+        ).start()
+
+    def _refresh(self, key, loader):
+        generation = self._generation
+        lock_key = f"{REFRESH_LOCK_KEY_PREFIX}{self.redis_key(key)}"
+        redis_conn = get_redis_connection('default')
+        locked = False
+        try:
+            locked = redis_conn.set(lock_key, os.getpid(), nx=True, ex=max(int(self.stale_ttl), 1))
+            if locked:
+                self._single_flight.do(key, self._load, key, loader, generation, self.get_version())
+            else:
+                # 其他进程正在回源，Redis 中已有新值时直接使用
+                cached, _ = self._get_from_redis(key)
+                if cached is not None and cached[1] > time.time():
+                    self._set_local(key, cached[0], cached[1], generation)
+        except Exception as e:
+            color_logger.error(f"后台刷新两级缓存失败: {self.redis_key(key)}, {e}")
+        finally:
+            if locked:
+                redis_conn.delete(lock_key)
+            with self._lock:
+                self._refreshing.discard(key)
+            # 后台线程中回源可能打开了数据库连接
+            connection.close()
+
+    def _count(self, field):
+        now = time.time()
+        with self._stats_lock:
+            self._stats[field] += 1
+            self._pending_stats[field] += 1
+            if now - self._stats_flushed_at < get_cache_config().get('STATS_FLUSH_INTERVAL', 10):
+                return
+            pending = dict(self._pending_stats)
+            self._pending_stats.clear()
+            self._stats_flushed_at = now
+        self._flush_stats(pending)
+
+    def _flush_stats(self, pending):
+        try:
+            pipe = get_redis_connection('default').pipeline(transaction=False)
+            for field, count in pending.items():
+                pipe.hincrby(f"{CACHE_STATS_KEY_PREFIX}{self.namespace}", field, count)
+            pipe.execute()
+        except Exception as e:
+            color_logger.error(f"写入两级缓存统计失败: {self.namespace}, {e}")
+
+
+def get_cache_stats():
+    """所有进程汇总的各命名空间统计（各进程每 STATS_FLUSH_INTERVAL 秒写入一次）
+
+    Returns:
+        {namespace: {统计项: 次数, 'hit_ratio': 命中率}}
+    """
+    redis_conn = get_redis_connection('default')
+    result = {}
+    for key in scan_redis_keys('default', f"{CACHE_STATS_KEY_PREFIX}*"):
+        raw = redis_conn.hgetall(key)
+        stats = {field: 0 for field in STAT_FIELDS}
+        for field, count in raw.items():
+            stats[field.decode('utf-8') if isinstance(field, bytes) else field] = int(count)
+        hits = stats['local_hits'] + stats['redis_hits'] + stats['stale_hits']
+        total = hits + stats['misses']
+        stats['hit_ratio'] = round(hits / total, 4) if total else None
+        result[key[len(CACHE_STATS_KEY_PREFIX):]] = stats
+    return result
+
+
+def _on_cache_invalidate_message(message):
+    cache = _caches.get(message.get('namespace'))
+    if cache is not None:
+        cache.evict_local(message.get('keys'))
+
+
+def _clear_all_local():
+    for cache in list(_caches.values()):
+        cache.evict_local()
+
+
+def ensure_cache_listener():
+    """确保当前进程已启动失效消息的订阅线程
+
+    uwsgi 等预fork模型下线程不会被子进程继承，因此按进程号判断是否需要启动
+    """
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        # fork 后继承的缓存条目无法再收到失效消息，直接清空
+        _clear_all_local()
+        subscribe_redis_channel(
+            redis_db_name='default',
+            channel=TWO_TIER_CACHE_CHANNEL,
+            callback=_on_cache_invalidate_message,
+            # 断线期间可能错过失效消息，重连后清空
+            on_connect=_clear_all_local
+        )
+        _listener_pid = os.getpid()